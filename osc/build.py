@@ -5,8 +5,10 @@
 
 from __future__ import print_function
 
+import fnmatch
 import os
 import re
+import stat
 import sys
 import shutil
 
@@ -152,6 +154,9 @@ class Buildinfo:
                 pass
 
         self.deps = []
+        # name -> list of deps (a kiwi build may contain the same package
+        # multiple times)
+        self.deps_by_name = {}
         self.projects = {}
         self.keys = []
         self.prjkeys = []
@@ -162,6 +167,7 @@ class Buildinfo:
             if p.project:
                 self.projects[p.project] = 1
             self.deps.append(p)
+            self.deps_by_name.setdefault(p.name, []).append(p)
         for node in root.findall('path'):
             self.pathes.append(node.get('project')+"/"+node.get('repository'))
 
@@ -178,80 +184,102 @@ class Buildinfo:
 
 
     def has_dep(self, name):
-        for i in self.deps:
-            if i.name == name:
-                return True
-        return False
+        return name in self.deps_by_name
 
     def remove_dep(self, name):
-        # we need to iterate over all deps because if this a
-        # kiwi build the same package might appear multiple times
-        # NOTE: do not loop and remove items, the second same one would not get catched
-        self.deps = [i for i in self.deps if not i.name == name]
-
-
-class Pac:
+        self.remove_deps([name])
+
+    def remove_deps(self, names):
+        """
+        removes all deps with one of the passed names (if this is a kiwi
+        build the same package might appear multiple times)
+        """
+        names = set(names).intersection(self.deps_by_name)
+        if names:
+            self.filter_deps(lambda dep: not dep.name in names)
+
+    def filter_deps(self, func):
+        """keeps only the deps for which func returns True"""
+        self.deps = [dep for dep in self.deps if func(dep)]
+        self.deps_by_name = {}
+        for dep in self.deps:
+            self.deps_by_name.setdefault(dep.name, []).append(dep)
+
+
+class Pac(object):
     """represent a package to be downloaded
 
-    We build a map that's later used to fill our URL templates
+    The fields are also available as a map (see mp) that's later used
+    to fill our URL templates
     """
+    fields = ('binary', 'package',
+              'epoch', 'version', 'release', 'hdrmd5',
+              'project', 'repository',
+              'preinstall', 'vminstall', 'runscripts',
+              'noinstall', 'installonly', 'notmeta',
+              'buildarch', 'pacsuffix', 'arch', 'name',
+              'extproject', 'extrepository', 'repopackage', 'repoarch',
+              'apiurl', 'canonname', 'filename', 'repofilename')
+    __slots__ = fields + ('urllist', 'localdir', 'fullfilename', 'url_local')
+
     def __init__(self, node, buildarch, pacsuffix, apiurl, localpkgs = []):
 
-        self.mp = {}
         for i in ['binary', 'package',
                   'epoch', 'version', 'release', 'hdrmd5',
                   'project', 'repository',
                   'preinstall', 'vminstall', 'runscripts',
                   'noinstall', 'installonly', 'notmeta',
                  ]:
-            self.mp[i] = node.get(i)
+            setattr(self, i, node.get(i))
 
-        self.mp['buildarch']  = buildarch
-        self.mp['pacsuffix']  = pacsuffix
+        self.buildarch = buildarch
+        self.pacsuffix = pacsuffix
 
-        self.mp['arch'] = node.get('arch') or self.mp['buildarch']
-        self.mp['name'] = node.get('name') or self.mp['binary']
+        self.arch = node.get('arch') or self.buildarch
+        self.name = node.get('name') or self.binary
 
         # this is not the ideal place to check if the package is a localdep or not
-        localdep = self.mp['name'] in localpkgs # and not self.mp['noinstall']
+        localdep = self.name in localpkgs # and not self.noinstall
         if not localdep and not (node.get('project') and node.get('repository')):
             raise oscerr.APIError('incomplete information for package %s, may be caused by a broken project configuration.'
-                                  % self.mp['name'] )
+                                  % self.name )
 
+        self.extproject = self.extrepository = None
         if not localdep:
-            self.mp['extproject'] = node.get('project').replace(':', ':/')
-            self.mp['extrepository'] = node.get('repository').replace(':', ':/')
-        self.mp['repopackage'] = node.get('package') or '_repository'
-        self.mp['repoarch'] = node.get('repoarch') or self.mp['buildarch']
+            self.extproject = node.get('project').replace(':', ':/')
+            self.extrepository = node.get('repository').replace(':', ':/')
+        self.repopackage = node.get('package') or '_repository'
+        self.repoarch = node.get('repoarch') or self.buildarch
 
-        if pacsuffix == 'deb' and not (self.mp['name'] and self.mp['arch'] and self.mp['version']):
+        if pacsuffix == 'deb' and not (self.name and self.arch and self.version):
             raise oscerr.APIError(
                 "buildinfo for package %s/%s/%s is incomplete"
-                    % (self.mp['name'], self.mp['arch'], self.mp['version']))
+                    % (self.name, self.arch, self.version))
 
-        self.mp['apiurl'] = apiurl
+        self.apiurl = apiurl
 
-        if self.mp['name'].startswith('container:'):
-            canonname = self.mp['name'] + '.tar.xz'
+        if self.name.startswith('container:'):
+            canonname = self.name + '.tar.xz'
         elif pacsuffix == 'deb':
-            canonname = debquery.DebQuery.filename(self.mp['name'], self.mp['epoch'], self.mp['version'], self.mp['release'], self.mp['arch'])
+            canonname = debquery.DebQuery.filename(self.name, self.epoch, self.version, self.release, self.arch)
         elif pacsuffix == 'arch':
-            canonname = archquery.ArchQuery.filename(self.mp['name'], self.mp['epoch'], self.mp['version'], self.mp['release'], self.mp['arch'])
+            canonname = archquery.ArchQuery.filename(self.name, self.epoch, self.version, self.release, self.arch)
         else:
-            canonname = rpmquery.RpmQuery.filename(self.mp['name'], self.mp['epoch'], self.mp['version'], self.mp['release'], self.mp['arch'])
+            canonname = rpmquery.RpmQuery.filename(self.name, self.epoch, self.version, self.release, self.arch)
 
-        self.mp['canonname'] = canonname
+        self.canonname = canonname
         # maybe we should rename filename key to binary
-        self.mp['filename'] = node.get('binary') or canonname
-        if self.mp['repopackage'] == '_repository':
-            self.mp['repofilename'] = self.mp['name']
+        self.filename = node.get('binary') or canonname
+        if self.repopackage == '_repository':
+            self.repofilename = self.name
         else:
             # OBS 2.3 puts binary into product bdeps (noinstall ones)
-            self.mp['repofilename'] = self.mp['filename']
-
-        # make the content of the dictionary accessible as class attributes
-        self.__dict__.update(self.mp)
+            self.repofilename = self.filename
 
+    @property
+    def mp(self):
+        """the fields as a dict (used to fill the URL templates)"""
+        return dict((i, getattr(self, i)) for i in self.fields)
 
     def makeurls(self, cachedir, urllist):
 
@@ -270,8 +298,9 @@ class Pac:
         self.urllist.append(self.url_local)
 
         # remote URLs
+        mp = self.mp
         for url in urllist:
-            self.urllist.append(url % self.mp)
+            self.urllist.append(url % mp)
 
     def __str__(self):
         return self.name
@@ -332,61 +361,77 @@ def get_preinstall_image(apiurl, arch, cache_dir, img_info):
         os.rename(ifile_path_part, ifile_path)
     return (imagefile, imagesource, img_bins)
 
-def get_built_files(pacdir, buildtype):
-    if buildtype == 'spec':
-        b_built = subprocess.Popen(['find', os.path.join(pacdir, 'RPMS'),
-                                    '-name', '*.rpm'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-        s_built = subprocess.Popen(['find', os.path.join(pacdir, 'SRPMS'),
-                                    '-name', '*.rpm'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-    elif buildtype == 'kiwi':
-        b_built = subprocess.Popen(['find', os.path.join(pacdir, 'KIWI'),
-                                    '-type', 'f'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-        s_built = ''
-    elif buildtype == 'docker':
-        b_built = subprocess.Popen(['find', os.path.join(pacdir, 'DOCKER'),
-                                    '-type', 'f'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-        s_built = ''
-    elif buildtype == 'fissile':
-        b_built = subprocess.Popen(['find', os.path.join(pacdir, 'FISSILE'),
-                                    '-type', 'f'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-        s_built = ''
-    elif buildtype == 'dsc' or buildtype == 'collax':
-        b_built = subprocess.Popen(['find', os.path.join(pacdir, 'DEBS'),
-                                    '-name', '*.deb'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-        s_built = subprocess.Popen(['find', os.path.join(pacdir, 'SOURCES.DEB'),
-                                    '-type', 'f'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-    elif buildtype == 'arch':
-        b_built = subprocess.Popen(['find', os.path.join(pacdir, 'ARCHPKGS'),
-                                    '-name', '*.pkg.tar*'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-        s_built = ''
-    elif buildtype == 'livebuild':
-        b_built = subprocess.Popen(['find', os.path.join(pacdir, 'OTHER'),
-                                    '-name', '*.iso*'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-        s_built = ''
-    elif buildtype == 'snapcraft':
-        b_built = subprocess.Popen(['find', os.path.join(pacdir, 'OTHER'),
-                                    '-name', '*.snap'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-        s_built = ''
-    elif buildtype == 'appimage':
-        b_built = subprocess.Popen(['find', os.path.join(pacdir, 'OTHER'),
-                                    '-name', '*.AppImage'],
-                                   stdout=subprocess.PIPE).stdout.read().strip()
-        s_built = ''
-    else:
+# build type -> (binaries, sources); each is a (subdir of the pacdir,
+# name pattern) tuple and a pattern of None matches all files
+built_files_patterns = {
+    'spec': (('RPMS', '*.rpm'), ('SRPMS', '*.rpm')),
+    'kiwi': (('KIWI', None), None),
+    'docker': (('DOCKER', None), None),
+    'fissile': (('FISSILE', None), None),
+    'dsc': (('DEBS', '*.deb'), ('SOURCES.DEB', None)),
+    'collax': (('DEBS', '*.deb'), ('SOURCES.DEB', None)),
+    'arch': (('ARCHPKGS', '*.pkg.tar*'), None),
+    'livebuild': (('OTHER', '*.iso*'), None),
+    'snapcraft': (('OTHER', '*.snap'), None),
+    'appimage': (('OTHER', '*.AppImage'), None),
+}
+
+def scan_built_files(topdir, pattern=None, digest=False):
+    """
+    returns a sorted list of (path, size, mtime, md5) tuples for all files
+    below topdir whose name matches pattern. The md5 is only computed if
+    digest is True (otherwise it is None).
+    """
+    built = []
+    # os.walk is based on os.scandir (python 3.5 and later)
+    for root, dirs, fnames in os.walk(topdir):
+        for fname in fnames:
+            if pattern is not None and not fnmatch.fnmatchcase(fname, pattern):
+                continue
+            path = os.path.join(root, fname)
+            try:
+                st = os.stat(path)
+            except OSError:
+                # dangling symlink
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            built.append((path, st.st_size, st.st_mtime, dgst(path) if digest else None))
+    built.sort()
+    return built
+
+def get_built_files(pacdir, buildtype, digest=False):
+    """
+    returns a (sources, binaries) tuple of lists of the built files (see
+    scan_built_files)
+    """
+    if not buildtype in built_files_patterns:
         print('WARNING: Unknown package type \'%s\'.' % buildtype, file=sys.stderr)
-        b_built = ''
-        s_built = ''
-    return s_built, b_built
+        return [], []
+    res = []
+    for i in reversed(built_files_patterns[buildtype]):
+        if i is None:
+            res.append([])
+        else:
+            res.append(scan_built_files(os.path.join(pacdir, i[0]), i[1], digest))
+    return tuple(res)
+
+def keep_built_files(built, destdir):
+    """
+    copies the built files to destdir. A file which was already copied
+    (same size and mtime or, if the md5 of the built file is known, same
+    content) is not copied again.
+    """
+    for path, size, mtime, md5 in built:
+        dest = os.path.join(destdir, os.path.basename(path))
+        try:
+            st = os.stat(dest)
+            if st.st_size == size and (st.st_mtime == mtime or
+                                       md5 is not None and dgst(dest) == md5):
+                continue
+        except (IOError, OSError):
+            pass
+        shutil.copy2(path, dest)
 
 def get_repo(path):
     """Walks up path looking for any repodata directories.
@@ -413,6 +458,28 @@ def get_repo(path):
 
     return repositoryDirectory
 
+prefer_pkgs_index = '.osc_prefer_pkgs.db'
+
+def query_prefer_pkgs(paths):
+    """
+    returns the PackageQueryRecords of the packages in paths (in the same
+    order). The headers of new or changed packages are read by a pool of
+    worker processes (see packagequery.query_many). The results are cached
+    in an index (prefer_pkgs_index) in the directory of the packages.
+    """
+    from .util import packagequery
+
+    dirs = {}
+    for path in paths:
+        dirs.setdefault(os.path.dirname(path), []).append(path)
+    records = {}
+    for dirname, pkgs in dirs.items():
+        cache = None
+        if os.access(dirname, os.W_OK):
+            cache = os.path.join(dirname, prefer_pkgs_index)
+        records.update(zip(pkgs, packagequery.query_many(pkgs, cache=cache, prune=True)))
+    return [records[path] for path in paths if records[path] is not None]
+
 def get_prefer_pkgs(dirs, wanted_arch, type, cpio):
     import glob
     from .util import repodata, packagequery
@@ -436,17 +503,20 @@ def get_prefer_pkgs(dirs, wanted_arch, type, cpio):
     packageQueries = packagequery.PackageQueries(wanted_arch)
 
     for repository in repositories:
-        repodataPackageQueries = repodata.queries(repository)
+        repodataPackageQueries = repodata.iterqueries(repository, wanted_arch)
 
         for packageQuery in repodataPackageQueries:
             packageQueries.add(packageQuery)
 
+    pkgs = []
     for path in paths:
         if path.endswith('.src.rpm') or path.endswith('.nosrc.rpm'):
             continue
         if path.endswith('.patch.rpm') or path.endswith('.delta.rpm'):
             continue
-        packageQuery = packagequery.PackageQuery.query(path)
+        pkgs.append(path)
+
+    for packageQuery in query_prefer_pkgs(pkgs):
         packageQueries.add(packageQuery)
 
     prefer_pkgs = dict((name, packageQuery.path())
@@ -719,9 +789,9 @@ def main(apiurl, opts, argv):
         cpiodata.add(os.path.basename(build_descr), build_descr_data)
         # buildenv must come last for compatibility reasons...
         if buildenvfile:
-            cpiodata.add("buildenv", open(buildenvfile).read())
+            cpiodata.add_file("buildenv", buildenvfile, 0o644)
         if servicefile:
-            cpiodata.add("_service", open(servicefile).read())
+            cpiodata.add_file("_service", servicefile, 0o644)
         build_descr_data = cpiodata.get()
 
     # special handling for overlay and rsync-src/dest
@@ -866,9 +936,9 @@ def main(apiurl, opts, argv):
                 # Instead, we put it in a list which is appended to the rpmlist later.
                 # At the same time, this will make sure that these packages are
                 # not verified.
-                bi.remove_dep(name)
                 rpmlist_prefers.append((name, path))
                 print(' - %s (%s)' % (name, path))
+        bi.remove_deps([name for name, path in rpmlist_prefers])
 
     print('Updating cache of required packages')
 
@@ -911,9 +981,7 @@ def main(apiurl, opts, argv):
         (imagefile, imagesource, imagebins) = get_preinstall_image(apiurl, arch, cache_dir, bi.preinstallimage)
         if imagefile:
             # remove binaries from build deps which are included in preinstall image
-            for i in bi.deps:
-                if i.name in imagebins:
-                    bi.remove_dep(i.name)
+            bi.remove_deps(imagebins)
 
     # now update the package cache
     fetcher.run(bi)
@@ -991,11 +1059,8 @@ def main(apiurl, opts, argv):
         if os.path.exists('containers'):
             shutil.rmtree('containers')
         os.mkdir('repos')
+        bi.filter_deps(lambda i: i.extproject)
         for i in bi.deps:
-            if not i.extproject:
-                # remove
-                bi.deps.remove(i)
-                continue
             if i.notmeta:
                 continue
             # project
@@ -1103,7 +1168,7 @@ def main(apiurl, opts, argv):
             print('Skipping verification of package signatures')
         else:
             print('Verifying integrity of cached packages')
-            verify_pacs(bi)
+            verify_pacs(bi, fetcher.cache_index)
     elif bi.pacsuffix == 'deb':
         if opts.no_verify or opts.noinit:
             print('Skipping verification of package signatures')
@@ -1114,17 +1179,15 @@ def main(apiurl, opts, argv):
 
     for i in bi.deps:
         if i.hdrmd5:
-            from .util import packagequery
-            if i.name.startswith('container:'):
-                hdrmd5 = dgst(i.fullfilename)
-            else:
-                hdrmd5 = packagequery.PackageQuery.queryhdrmd5(i.fullfilename)
+            hdrmd5 = fetcher.cache_index.hdrmd5(i.fullfilename,
+                                                i.name.startswith('container:'))
             if not hdrmd5:
                 print("Error: cannot get hdrmd5 for %s" % i.fullfilename)
                 sys.exit(1)
             if hdrmd5 != i.hdrmd5:
                 print("Error: hdrmd5 mismatch for %s: %s != %s" % (i.fullfilename, hdrmd5, i.hdrmd5))
                 sys.exit(1)
+    fetcher.cache_index.save()
 
     print('Writing build configuration')
 
@@ -1247,16 +1310,16 @@ def main(apiurl, opts, argv):
         pacdir = os.path.join(build_root, pacdir)
 
     if os.path.exists(pacdir):
-        (s_built, b_built) = get_built_files(pacdir, bi.buildtype)
+        # the digests are only needed to skip identical copies
+        (s_built, b_built) = get_built_files(pacdir, bi.buildtype, digest=bool(opts.keep_pkgs))
 
         print()
-        if s_built: print(s_built)
+        if s_built: print('\n'.join([i[0] for i in s_built]))
         print()
-        print(b_built)
+        print('\n'.join([i[0] for i in b_built]))
 
         if opts.keep_pkgs:
-            for i in b_built.splitlines() + s_built.splitlines():
-                shutil.copy2(i, os.path.join(opts.keep_pkgs, os.path.basename(i)))
+            keep_built_files(b_built + s_built, opts.keep_pkgs)
 
     if bi_file:
         bi_file.close()
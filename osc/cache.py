@@ -0,0 +1,399 @@
+# Copyright (C) 2006 Novell Inc.  All rights reserved.
+# This program is free software; it may be used, copied, modified
+# and distributed under the terms of the GNU General Public Licence,
+# either version 2, or (at your option) any later version.
+
+from __future__ import print_function
+
+import atexit
+import errno
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # no locking (e.g. on windows)
+    fcntl = None
+
+from .core import dgst
+from .util import packagequery
+
+
+def read_json(fname):
+    """returns the dict which is stored in fname (an empty dict if it does not exist)"""
+    try:
+        with open(fname) as f:
+            data = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return data
+
+def write_json(fname, data):
+    """atomically replaces fname"""
+    dirname, basename = os.path.split(fname)
+    fd, tmpfile = tempfile.mkstemp(prefix=basename, dir=dirname)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmpfile, fname)
+    finally:
+        if os.path.exists(tmpfile):
+            os.unlink(tmpfile)
+
+
+class CacheIndex:
+    """
+    Persistent index of the package cache (packagecachedir). It maps the
+    path of a cached package (relative to the cachedir) to its size, mtime,
+    inode and hdrmd5, so that a cached package can be validated with a
+    single stat call instead of parsing its header (or hashing the whole
+    file in case of a container).
+    """
+
+    index_name = '.osc_cache_index'
+
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        self.fname = os.path.join(cachedir, self.index_name)
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.entries = read_json(self.fname)
+        self.removed = set()
+        # hdrmd5 -> keys (see lookup)
+        self.content = None
+
+    def _key(self, filename):
+        return os.path.relpath(os.path.abspath(filename), os.path.abspath(self.cachedir))
+
+    @staticmethod
+    def _stat(filename):
+        st = os.stat(filename)
+        return [st.st_size, st.st_mtime, st.st_ino]
+
+    @staticmethod
+    def compute_hdrmd5(filename, container=False):
+        if container:
+            return dgst(filename)
+        return packagequery.PackageQuery.queryhdrmd5(filename)
+
+    def hdrmd5(self, filename, container=False):
+        """
+        returns the hdrmd5 of filename (it is only computed if the file
+        is not in the index or if it was changed). None is returned if the
+        file does not exist or if it has no hdrmd5.
+        """
+        key = self._key(filename)
+        try:
+            st = self._stat(filename)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[:3] == st:
+            return entry[3]
+        return self.add(filename, container=container)
+
+    def add(self, filename, hdrmd5=None, container=False):
+        """
+        adds filename to the index (hdrmd5 is computed if it is not
+        specified)
+        """
+        if hdrmd5 is None:
+            hdrmd5 = self.compute_hdrmd5(filename, container)
+        entry = self._stat(filename) + [hdrmd5]
+        key = self._key(filename)
+        with self.lock:
+            self.entries[key] = entry
+            self.removed.discard(key)
+            self.dirty = True
+            if self.content is not None:
+                self.content.setdefault(hdrmd5, []).append(key)
+        return hdrmd5
+
+    def lookup(self, hdrmd5):
+        """
+        returns the filename of an (unchanged) cached package with the
+        specified hdrmd5 or None
+        """
+        with self.lock:
+            if self.content is None:
+                self.content = {}
+                for key, entry in self.entries.items():
+                    self.content.setdefault(entry[3], []).append(key)
+            candidates = [(key, self.entries.get(key)) for key in self.content.get(hdrmd5, [])]
+        for key, entry in candidates:
+            filename = os.path.join(self.cachedir, key)
+            try:
+                if entry is not None and entry[3] == hdrmd5 and self._stat(filename) == entry[:3]:
+                    return filename
+            except OSError:
+                pass
+        return None
+
+    def link(self, hdrmd5, filename):
+        """
+        hardlinks a cached package with the specified hdrmd5 (for instance
+        from a different project) to filename. Returns True if a package
+        was linked.
+        """
+        src = self.lookup(hdrmd5)
+        if src is None:
+            return False
+        try:
+            os.link(src, filename)
+        except OSError:
+            # for instance, filename already exists
+            return False
+        self.add(filename, hdrmd5)
+        return True
+
+    def remove(self, filename):
+        key = self._key(filename)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.removed.add(key)
+            self.dirty = True
+
+    def save(self):
+        """
+        writes the index (the entries of a concurrently written index are
+        merged)
+        """
+        if not self.dirty or not os.access(self.cachedir, os.W_OK):
+            return
+        with self.lock:
+            entries = read_json(self.fname)
+            entries.update(self.entries)
+            for key in self.removed:
+                entries.pop(key, None)
+            self.entries = entries
+            write_json(self.fname, self.entries)
+            self.dirty = False
+            self.removed = set()
+
+
+class VerifiedCache:
+    """
+    Remembers the packages whose signatures were successfully verified
+    with a set of keys, so that the packages of an unchanged cache are not
+    verified again on every build. Like in the CacheIndex, a package is
+    identified by its path, size, mtime and inode (and its hdrmd5), so a
+    modified or replaced package is verified again.
+    """
+
+    cache_name = '.osc_verified'
+
+    def __init__(self, cachedir, keys):
+        self.cachedir = cachedir
+        self.fname = os.path.join(cachedir, self.cache_name)
+        self.keyset = self.keyset_id(keys)
+        # path -> [size, mtime, ino, hdrmd5, keysets]
+        self.verified = read_json(self.fname)
+        self.added = {}
+
+    @staticmethod
+    def keyset_id(keys):
+        """identifies the set of keys by their content"""
+        return hashlib.md5(''.join(sorted([dgst(i) for i in keys])).encode()).hexdigest()
+
+    def _key(self, filename):
+        return os.path.relpath(os.path.abspath(filename), os.path.abspath(self.cachedir))
+
+    @staticmethod
+    def _ident(filename, hdrmd5):
+        if hdrmd5 is None:
+            return None
+        try:
+            return CacheIndex._stat(filename) + [hdrmd5]
+        except OSError:
+            return None
+
+    def is_verified(self, filename, hdrmd5):
+        ident = self._ident(filename, hdrmd5)
+        entry = self.verified.get(self._key(filename))
+        return (ident is not None and entry is not None and entry[:4] == ident
+                and self.keyset in entry[4])
+
+    def add(self, filename, hdrmd5):
+        ident = self._ident(filename, hdrmd5)
+        if ident is None or self.is_verified(filename, hdrmd5):
+            return
+        key = self._key(filename)
+        entry = self.verified.get(key)
+        keysets = []
+        if entry is not None and entry[:4] == ident:
+            keysets = entry[4]
+        self.verified[key] = self.added[key] = ident + [keysets + [self.keyset]]
+
+    def save(self):
+        if not self.added or not os.access(self.cachedir, os.W_OK):
+            return
+        verified = read_json(self.fname)
+        for key, entry in self.added.items():
+            old = verified.get(key)
+            if old is not None and old[:4] == entry[:4]:
+                entry = entry[:4] + [list(set(old[4] + entry[4]))]
+            verified[key] = entry
+        write_json(self.fname, verified)
+        self.added = {}
+
+
+class CacheLock:
+    """
+    Lock of the package cache: a build holds a shared lock while it pins
+    its dependencies (see pin) and a prune holds an exclusive lock.
+    """
+    lock_name = '.osc_cache_lock'
+
+    def __init__(self, cachedir, exclusive=False):
+        self.fname = os.path.join(cachedir, self.lock_name)
+        self.exclusive = exclusive
+        self.f = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return self
+        try:
+            self.f = open(self.fname, 'a')
+        except IOError:
+            # the cachedir is not writable: nothing can be pruned
+            return self
+        fcntl.flock(self.f, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *args):
+        if self.f is not None:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+            self.f.close()
+            self.f = None
+
+
+pins_dir = '.osc_pins'
+# the pin files of the current process
+_pins = set()
+
+def _unpin(fname):
+    try:
+        os.unlink(fname)
+    except OSError:
+        pass
+
+def pin(cachedir, filenames):
+    """
+    pins filenames (the dependencies of a build) until the current
+    process exits, so that they are not removed by a concurrent prune.
+    """
+    dirname = os.path.join(cachedir, pins_dir)
+    fname = os.path.join(dirname, str(os.getpid()))
+    with CacheLock(cachedir):
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            # a pin file of a former process with the same pid is truncated
+            with open(fname, 'a' if fname in _pins else 'w') as f:
+                f.write(''.join(['%s\n' % os.path.abspath(i) for i in filenames]))
+        except (IOError, OSError):
+            return
+    if not fname in _pins:
+        _pins.add(fname)
+        atexit.register(_unpin, fname)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+def pinned(cachedir):
+    """returns the files which are pinned by running processes"""
+    dirname = os.path.join(cachedir, pins_dir)
+    files = set()
+    if not os.path.isdir(dirname):
+        return files
+    for pid in os.listdir(dirname):
+        fname = os.path.join(dirname, pid)
+        if not pid.isdigit() or not _pid_alive(int(pid)):
+            # a stale pin
+            _unpin(fname)
+            continue
+        try:
+            with open(fname) as f:
+                files.update([line.rstrip('\n') for line in f])
+        except IOError:
+            pass
+    return files
+
+def touch(filenames):
+    """
+    updates the access time of filenames (it is set explicitly because
+    the atime is not (reliably) updated on most mounts)
+    """
+    now = time.time()
+    for fname in filenames:
+        try:
+            os.utime(fname, (now, os.stat(fname).st_mtime))
+        except OSError:
+            pass
+
+def prune(cachedir, max_size=0, max_age=0, dry_run=False):
+    """
+    removes the least recently used packages from the cache until it
+    is not bigger than max_size MiB. Additionally, packages which were
+    not used for max_age days are removed (0 disables the respective
+    limit). Packages which are pinned by a running build are never
+    removed. Returns a list of (filename, size) tuples of the removed
+    packages.
+    """
+    if not max_size and not max_age or not os.path.isdir(cachedir):
+        return []
+    removed = []
+    with CacheLock(cachedir, exclusive=True):
+        keep = pinned(cachedir)
+        files = []
+        total = 0
+        # hardlinked packages (see CacheIndex.link) are only counted once
+        links = {}
+        for root, dirs, fnames in os.walk(cachedir):
+            dirs[:] = [i for i in dirs if not i.startswith('.')]
+            for fname in fnames:
+                # skip the index, the _pubkey files etc.
+                if fname.startswith('.') or fname.startswith('_'):
+                    continue
+                fname = os.path.join(root, fname)
+                st = os.lstat(fname)
+                inode = (st.st_dev, st.st_ino)
+                if not inode in links:
+                    total += st.st_size
+                    links[inode] = 0
+                links[inode] += 1
+                files.append((st.st_atime, st.st_size, inode, fname))
+        files.sort()
+        too_old = time.time() - max_age * 24 * 60 * 60
+        for atime, size, inode, fname in files:
+            if not (max_age and atime < too_old or max_size and total > max_size * 1024 * 1024):
+                # the remaining files are newer
+                break
+            if os.path.abspath(fname) in keep:
+                continue
+            if not dry_run:
+                os.unlink(fname)
+            links[inode] -= 1
+            if not links[inode]:
+                total -= size
+            removed.append((fname, size))
+        if removed and not dry_run:
+            index = CacheIndex(cachedir)
+            for fname, size in removed:
+                index.remove(fname)
+            index.save()
+    return removed
+
+# vim: sw=4 et
@@ -15,8 +15,8 @@ class KeyError(Exception):
         return ''+self.key+' :'+' '.join(self.args)
 
 class Checker:
-    def __init__(self):
-        self.dbdir = mkdtemp(prefix='oscrpmdb')
+    def __init__(self, tmpdir=None):
+        self.dbdir = mkdtemp(prefix='oscrpmdb', dir=tmpdir)
         self.imported = {}
         rpm.addMacro('_dbpath', self.dbdir)
         self.ts = rpm.TransactionSet()
@@ -4297,6 +4297,14 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                         help='Use server side generated sources instead of local generation.' )
     @cmdln.option('-l', '--limit-size', metavar='limit_size',
                         help='Skip all files with a given size')
+    @cmdln.option('--include', metavar='GLOB', action='append',
+                        help='only check out files matching GLOB (sparse checkout, can be given multiple times)')
+    @cmdln.option('--exclude', metavar='GLOB', action='append',
+                        help='do not check out files matching GLOB (sparse checkout, can be given multiple times)')
+    @cmdln.option('--lazy-size', metavar='SIZE',
+                        help='only create empty placeholders for files bigger than SIZE bytes '
+                             '(a k, M or G suffix can be used; 0: all files), '
+                             'their content is downloaded on demand')
     @cmdln.alias('co')
     def do_checkout(self, subcmd, opts, *args):
         """${cmd_name}: Check out content from the repository
@@ -4323,6 +4331,15 @@ Please submit there instead, or use --nodevelproject to force direct submission.
             with the result of rpm -q --qf '%%{DISTURL}\\n' PACKAGE
                osc co obs://API/PROJECT/PLATFORM/REVISION-PACKAGE
 
+        The options --include and --exclude can be used to check out only a
+        subset of the package's files (the rules are stored in the working
+        copy and are also used by "osc up"). Excluded files are shown as 'S':
+               osc co --include '*.spec' --include '*.changes' --include '*.patch' PROJECT PACKAGE
+
+        With --lazy-size only placeholders are created for big files. Their
+        content is downloaded when it is needed (by "osc build", "osc diff",
+        "osc revert", ...) or explicitly via "osc fetch".
+
         ${cmd_option_list}
         """
 
@@ -4335,6 +4352,12 @@ Please submit there instead, or use --nodevelproject to force direct submission.
             raise oscerr.WrongArgs('Incorrect number of arguments.\n\n' \
                   + self.get_cmd_help('checkout'))
 
+        if opts.lazy_size is not None:
+            try:
+                opts.lazy_size = parse_size(opts.lazy_size)
+            except ValueError:
+                raise oscerr.WrongArgs('--lazy-size: \'%s\' is not a valid size' % opts.lazy_size)
+
         # XXX: this too openSUSE-setup specific...
         # FIXME: this should go into ~jw/patches/osc/osc.proj_pack_20101201.diff
         #        to be available to all subcommands via @cmdline.prep(proj_pack)
@@ -4385,7 +4408,9 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                              prj_dir=project_dir, service_files = opts.source_service_files, \
                              server_service_files=opts.server_side_source_service_files, \
                              progress_obj=self.download_progress, size_limit=opts.limit_size, \
-                             meta=opts.meta, outdir=opts.output_dir)
+                             meta=opts.meta, outdir=opts.output_dir, \
+                             sparse_include=opts.include, sparse_exclude=opts.exclude, \
+                             lazy_size=opts.lazy_size)
             print_request_list(apiurl, project, package)
 
         elif project:
@@ -4427,7 +4452,8 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                                      prj_dir = prj_dir, service_files = opts.source_service_files, \
                                      server_service_files = opts.server_side_source_service_files, \
                                      progress_obj=self.download_progress, size_limit=opts.limit_size, \
-                                     meta=opts.meta)
+                                     meta=opts.meta, sparse_include=opts.include, \
+                                     sparse_exclude=opts.exclude, lazy_size=opts.lazy_size)
                 except oscerr.LinkExpandError as e:
                     print('Link cannot be expanded:\n', e, file=sys.stderr)
                     print('Use "osc repairlink" for fixing merge conflicts:\n', file=sys.stderr)
@@ -4436,7 +4462,8 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                                      prj_dir = prj_dir, service_files = opts.source_service_files, \
                                      server_service_files = opts.server_side_source_service_files, \
                                      progress_obj=self.download_progress, size_limit=opts.limit_size, \
-                                     meta=opts.meta)
+                                     meta=opts.meta, sparse_include=opts.include, \
+                                     sparse_exclude=opts.exclude, lazy_size=opts.lazy_size)
             print_request_list(apiurl, project)
 
         else:
@@ -4468,7 +4495,8 @@ Please submit there instead, or use --nodevelproject to force direct submission.
           'R' Replaced (file was deleted and added again afterwards)
           '?' item is not under version control
           '!' item is missing (removed by non-osc command) or incomplete
-          'S' item is skipped (item exceeds a file size limit or is _service:* file)
+          'S' item is skipped (item exceeds a file size limit, is excluded by the
+              sparse checkout rules or is _service:* file)
           'F' Frozen (use "osc pull" to merge conflicts) (package-only state)
 
         examples:
@@ -4796,6 +4824,10 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                         help='Use server side generated sources instead of local generation.' )
     @cmdln.option('-l', '--limit-size', metavar='limit_size',
                         help='Skip all files with a given size')
+    @cmdln.option('--include', metavar='GLOB', action='append',
+                        help='only update files matching GLOB (replaces the stored sparse rules)')
+    @cmdln.option('--exclude', metavar='GLOB', action='append',
+                        help='do not update files matching GLOB (replaces the stored sparse rules)')
     @cmdln.alias('up')
     def do_update(self, subcmd, opts, *args):
         """${cmd_name}: Update a working copy
@@ -4907,7 +4939,8 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                 elif (p.islink() and p.isexpanded()) or opts.server_side_source_service_files:
                     rev = p.latest_rev(include_service_files=opts.server_side_source_service_files)
 
-            p.update(rev, opts.server_side_source_service_files, opts.limit_size)
+            p.update(rev, opts.server_side_source_service_files, opts.limit_size,
+                     opts.include, opts.exclude)
             if opts.source_service_files:
                 print('Running local source services')
                 p.run_source_services()
@@ -5023,6 +5056,29 @@ Please submit there instead, or use --nodevelproject to force direct submission.
                 p.clear_from_conflictlist(filename)
 
 
+    def do_fetch(self, subcmd, opts, *args):
+        """${cmd_name}: Download the content of placeholder files
+
+        A working copy which was checked out with --lazy-size contains
+        empty placeholders for big files. Their content is downloaded
+        on demand or explicitly with this command.
+
+        usage:
+            osc fetch [PATH...]
+        ${cmd_option_list}
+        """
+
+        args = parseargs(args)
+        pacs = findpacs(args, progress_obj=self.download_progress)
+
+        for p in pacs:
+            files = p.todo or None
+            for filename in p.lazy:
+                if files is None or filename in files:
+                    print(statfrmt('U', os.path.join(getTransActPath(p.dir), filename)))
+            p.materialize(files)
+
+
     @cmdln.alias('dists')
 # FIXME: using just ^DISCONTINUED as match is not a general approach and only valid for one instance
 #        we need to discuss an api call for that, if we need this
@@ -6227,6 +6283,13 @@ Please submit there instead, or use --nodevelproject to force direct submission.
 
         args = self.parse_repoarchdescr(args, opts.noinit or opts.offline, opts.alternative_project, False, opts.vm_type, opts.multibuild_package)
 
+        # the build needs the content of the placeholder files
+        if not opts.offline and is_package_dir(os.curdir):
+            p = Package(os.curdir)
+            if p.lazy:
+                print('Fetching the content of the placeholder files')
+                p.materialize()
+
         # check for source services
         r = None
         try:
@@ -6418,6 +6481,47 @@ Please submit there instead, or use --nodevelproject to force direct submission.
         return build_ret
 
 
+    @cmdln.option('--max-size', metavar='MiB', type='int',
+                  help='remove the least recently used packages until the cache '
+                       'is not bigger than MiB (default: packagecache_maxsize)')
+    @cmdln.option('--max-age', metavar='DAYS', type='int',
+                  help='remove the packages which were not used for DAYS days '
+                       '(default: packagecache_maxage)')
+    @cmdln.option('-n', '--dry-run', action='store_true',
+                  help='only show the packages which would be removed')
+    def do_cache(self, subcmd, opts, *args):
+        """${cmd_name}: Manage the package cache of osc build
+
+        The packages which are used by a running build are never removed.
+
+        usage:
+            osc cache prune [--max-size MiB] [--max-age DAYS]
+        ${cmd_option_list}
+        """
+        from . import cache
+
+        if len(args) != 1 or args[0] != 'prune':
+            raise oscerr.WrongArgs('Unknown or missing command.\n\n' \
+                  + self.get_cmd_help('cache'))
+
+        apiurl = self.get_api_url()
+        cachedir = conf.config['packagecachedir'] % {'apihost': urlsplit(apiurl)[1]}
+        max_size = opts.max_size
+        if max_size is None:
+            max_size = conf.config['packagecache_maxsize']
+        max_age = opts.max_age
+        if max_age is None:
+            max_age = conf.config['packagecache_maxage']
+        if not max_size and not max_age:
+            raise oscerr.WrongOptions('Please specify --max-size or --max-age '
+                                      '(or set packagecache_maxsize in oscrc)')
+        removed = cache.prune(cachedir, max_size, max_age, opts.dry_run)
+        for fname, size in removed:
+            print(statfrmt('D', fname))
+        print('%d packages (%d MiB) %s' % (len(removed), sum([i[1] for i in removed]) // (1024 * 1024),
+              'would be removed' if opts.dry_run else 'removed'))
+
+
     @cmdln.option('--local-package', action='store_true',
                   help='package doesn\'t exist on the server')
     @cmdln.option('--alternative-project', metavar='PROJECT',
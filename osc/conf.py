@@ -173,17 +173,27 @@ DEFAULTS = {'apiurl': 'https://api.opensuse.org',
             'linkcontrol': '0',
             'include_request_from_project': '1',
             'local_service_run': '1',
+            # number of independent source services (download_url, obs_scm, ...)
+            # which are run concurrently
+            'service_jobs': str(_get_processors()),
 
             # Maintenance defaults to OBS instance defaults
             'maintained_attribute': 'OBS:Maintained',
             'maintenance_attribute': 'OBS:MaintenanceProject',
             'maintained_update_project_attribute': 'OBS:UpdateProject',
             'show_download_progress': '0',
+            # number of concurrent downloads per mirror host (osc build)
+            'download_jobs': '4',
+            # limits of the package cache (0: no limit)
+            'packagecache_maxsize': '0',
+            'packagecache_maxage': '0',
             # path to the vc script
             'vc-cmd': '/usr/lib/build/vc',
 
             # heuristic to speedup Package.status
-            'status_mtime_heuristic': '0'
+            'status_mtime_heuristic': '0',
+            # keep the state of package working copies in a single file
+            'store_v2': '0',
 }
 
 # some distros like Debian rename and move build to obs-build
@@ -200,8 +210,9 @@ boolean_opts = ['debug', 'do_package_tracking', 'http_debug', 'post_mortem', 'tr
     'checkout_no_colon', 'checkout_rooted', 'check_for_request_on_action', 'linkcontrol', 'show_download_progress', 'request_show_interactive',
     'request_show_source_buildstatus', 'review_inherit_group', 'use_keyring', 'gnome_keyring', 'no_verify', 'builtin_signature_check',
     'http_full_debug', 'include_request_from_project', 'local_service_run', 'buildlog_strip_time', 'no_preinstallimage',
-    'status_mtime_heuristic']
-integer_opts = ['build-jobs']
+    'status_mtime_heuristic', 'store_v2']
+integer_opts = ['build-jobs', 'service_jobs', 'download_jobs', 'packagecache_maxsize',
+    'packagecache_maxage']
 
 api_host_options = ['user', 'pass', 'passx', 'aliases', 'http_headers', 'email', 'sslcertck', 'cafile', 'capath', 'trusted_prj']
 
@@ -215,6 +226,12 @@ apiurl = %(apiurl)s
 # Downloaded packages are cached here. Must be writable by you.
 #packagecachedir = %(packagecachedir)s
 
+# Remove the least recently used packages from the package cache
+# if it is bigger than N MiB or if they were not used for N days
+# (see also "osc cache prune")
+#packagecache_maxsize = N
+#packagecache_maxage = N
+
 # Wrapper to call build as root (sudo, su -, ...)
 #su-wrapper = %(su-wrapper)s
 
@@ -228,6 +245,13 @@ apiurl = %(apiurl)s
 # compile with N jobs (default: "getconf _NPROCESSORS_ONLN")
 #build-jobs = N
 
+# run at most N independent source services (download_url, obs_scm, ...)
+# concurrently (default: "getconf _NPROCESSORS_ONLN")
+#service_jobs = N
+
+# download at most N build dependencies per mirror host concurrently
+#download_jobs = %(download_jobs)s
+
 # build-type to use - values can be (depending on the capabilities of the 'build' script)
 # empty    -  chroot build
 # kvm      -  kvm VM build  (needs build-device, build-swap, build-memory)
@@ -333,6 +357,12 @@ apiurl = %(apiurl)s
 # check for unversioned/removed files before commit
 #check_filelist = 1
 
+# keep the state of package working copies (_files, _to_be_added, ...) in
+# a single, atomically replaced file (.osc/_store). Existing working copies
+# are migrated when they are used. Note: older osc versions cannot work
+# with migrated working copies.
+#store_v2 = 0
+
 # check for pending requests after executing an action (e.g. checkout, update, commit)
 #check_for_request_on_action = 0
 
@@ -11,6 +11,10 @@ __version__ = '0.162.1git'
 # "store" changes in an incompatible way. Please add any needed migration
 # functionality to check_store_version().
 __store_version__ = '1.0'
+# version of the (opt-in) store format which keeps the state of a package
+# working copy in a single file (see STORE_V2_FILES and the "store_v2"
+# config option).
+__store_v2_version__ = '2.0'
 
 import locale
 import os
@@ -66,6 +70,12 @@ DISTURL_RE = re.compile(r"^(?P<bs>.*)://(?P<apiurl>.*?)/(?P<project>.*?)/(?P<rep
 BUILDLOGURL_RE = re.compile(r"^(?P<apiurl>https?://.*?)/build/(?P<project>.*?)/(?P<repository>.*?)/(?P<arch>.*?)/(?P<package>.*?)/_log$")
 BUFSIZE = 1024*1024
 store = '.osc'
+# the metadata "files" which are kept in the single '_store' file of
+# a store v2 package working copy
+STORE_V2_FILES = ('_files', '_meta', '_to_be_added', '_to_be_deleted',
+    '_in_conflict', '_size_limit', '_frozenlink', '_pulled', '_linkrepair',
+    '_meta_mode', '_commit_msg', '_sparse_include', '_sparse_exclude',
+    '_lazy', '_lazy_size')
 
 new_project_templ = """\
 <project name="%(name)s">
@@ -250,6 +260,45 @@ def os_path_samefile(path1, path2):
     except:
         return os.path.realpath(path1) == os.path.realpath(path2)
 
+try:
+    # python 3.5 and later
+    from os import scandir as _scandir
+except ImportError:
+    _scandir = None
+
+class _DirEntry:
+    """minimal os.DirEntry replacement (for python versions without os.scandir)"""
+    def __init__(self, dir, name):
+        self.name = name
+        self.path = os.path.join(dir, name)
+    def is_dir(self):
+        return os.path.isdir(self.path)
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+def scan_dir(dir):
+    """
+    Returns a dict which maps the name of each entry in dir to
+    an os.DirEntry like object. The directory is read in a single pass.
+    """
+    if _scandir is None:
+        return dict((name, _DirEntry(dir, name)) for name in os.listdir(dir))
+    return dict((entry.name, entry) for entry in _scandir(dir))
+
+_exclude_glob_re = {}
+def exclude_glob_re():
+    """
+    Returns a compiled regex which matches all names that are
+    excluded via the exclude_glob config option.
+    """
+    import fnmatch
+    globs = tuple(conf.config['exclude_glob'])
+    if not globs in _exclude_glob_re:
+        regex = '|'.join(['(?:%s)' % fnmatch.translate(i) for i in globs])
+        # '(?!)' never matches
+        _exclude_glob_re[globs] = re.compile(regex or '(?!)')
+    return _exclude_glob_re[globs]
+
 class File:
     """represent a file, including its metadata"""
     def __init__(self, name, md5, size, mtime, skipped=False):
@@ -267,6 +316,11 @@ class File:
 class Serviceinfo:
     """Source service content
     """
+
+    # services which only create new files (they do not modify or consume
+    # the output of other services) and thus can be run concurrently
+    independent_services = ('download_url', 'download_files', 'obs_scm', 'tar_scm')
+
     def __init__(self):
         """creates an empty serviceinfo instance"""
         self.services = []
@@ -388,9 +442,131 @@ class Serviceinfo:
         r.append( s )
         return r
 
-    def execute(self, dir, callmode = None, singleservice = None, verbose = None):
+    def _skip_service(self, service, callmode, singleservice):
+        """checks if service should not be run in the callmode"""
+        if callmode == "all":
+            return False
+        if singleservice and service['name'] != singleservice:
+            return True
+        if service['mode'] == "buildtime":
+            return True
+        if service['mode'] == "serveronly" and callmode != "disabled":
+            return True
+        if service['mode'] == "disabled" and callmode != "disabled":
+            return True
+        if service['mode'] != "disabled" and callmode == "disabled":
+            return True
+        if service['mode'] != "trylocal" and service['mode'] != "localonly" and callmode == "trylocal":
+            return True
+        return False
+
+    def _schedule(self, services):
+        """splits services into batches which can be run concurrently.
+
+        Only services which download new files without looking at the
+        output of the other services are grouped together. All other
+        services (e.g. recompress, set_version) get a batch of their own,
+        so that they see the merged output of all preceding services.
+        """
+        batches = []
+        batch = []
+        for service in services:
+            if service['name'] not in self.independent_services:
+                if batch:
+                    batches.append(batch)
+                    batch = []
+                batches.append([service])
+                continue
+            batch.append(service)
+            # an extracted file (e.g. a spec file) may be consumed later on
+            if '--extract' in service['command']:
+                batches.append(batch)
+                batch = []
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _merge_output(self, service, temp_dir, dir, callmode):
+        """moves the generated files from temp_dir to dir"""
+        if service['mode'] == "disabled" or service['mode'] == "trylocal" or service['mode'] == "localonly" or callmode == "local" or callmode == "trylocal" or callmode == "all":
+            for filename in os.listdir(temp_dir):
+                os.rename(os.path.join(temp_dir, filename), os.path.join(dir, filename))
+        else:
+            name = service['name']
+            for filename in os.listdir(temp_dir):
+                os.rename(os.path.join(temp_dir, filename), os.path.join(dir, "_service:"+name+":"+filename))
+
+    def _run_commands(self, cmds, jobs, verbose=None):
+        """runs the commands concurrently (at most jobs at a time).
+
+        A free slot is refilled as soon as one of the running commands
+        finishes. If a command fails, no further commands are started.
+        Returns a list of (cmd, returncode) tuples for the finished
+        commands (in the order of cmds). The commands which are still
+        running when an exception occurs are killed.
+        """
+        import time
+
+        pending = list(range(len(cmds)))
+        running = []
+        results = [None] * len(cmds)
+        failed = False
+        try:
+            while running or (pending and not failed):
+                while pending and not failed and len(running) < jobs:
+                    i = pending.pop(0)
+                    if conf.config['verbose'] > 1 or verbose or conf.config['debug']:
+                        print("Run source service:", ' '.join(cmds[i]))
+                    running.append((i, start_external(cmds[i][0], *cmds[i][1:])))
+                finished = [(i, proc) for i, proc in running if proc.poll() is not None]
+                for i, proc in finished:
+                    running.remove((i, proc))
+                    results[i] = proc.returncode
+                    failed = failed or proc.returncode != 0
+                if not finished:
+                    time.sleep(0.05)
+        finally:
+            for i, proc in running:
+                try:
+                    proc.kill()
+                except OSError:
+                    # already terminated
+                    pass
+                proc.wait()
+        return [(cmd, r) for cmd, r in zip(cmds, results) if r is not None]
+
+    def _run_batch(self, batch, dir, callmode, verbose):
+        """runs all services of the batch concurrently (at most
+        conf.config['service_jobs'] at a time) and merges their output
+        in the order of the _service file.
+        """
         import tempfile
 
+        jobs = max(conf.config['service_jobs'], 1)
+        temp_dirs = []
+        try:
+            cmds = []
+            for service in batch:
+                cmd = service['command']
+                if not os.path.exists("/usr/lib/obs/service/"+cmd[0]):
+                    raise oscerr.PackageNotInstalled("obs-service-%s"%cmd[0])
+                temp_dir = tempfile.mkdtemp(dir=dir, suffix='.%s.service' % service['name'])
+                temp_dirs.append(temp_dir)
+                cmds.append(["/usr/lib/obs/service/"+cmd[0]] + cmd[1:] + [ "--outdir", temp_dir ])
+
+            for cmd, r in self._run_commands(cmds, jobs, verbose):
+                if r != 0:
+                    print("Aborting: service call failed: ", ' '.join(cmd))
+                    return r
+
+            for service, temp_dir in zip(batch, temp_dirs):
+                self._merge_output(service, temp_dir, dir, callmode)
+        finally:
+            for temp_dir in temp_dirs:
+                shutil.rmtree(temp_dir)
+        return 0
+
+    def execute(self, dir, callmode = None, singleservice = None, verbose = None):
         # cleanup existing generated files
         for filename in os.listdir(dir):
             if filename.startswith('_service:') or filename.startswith('_service_'):
@@ -417,49 +593,13 @@ class Serviceinfo:
             os.putenv("OBS_SERVICE_PACKAGE", self.package)
 
         # recreate files
-        ret = 0
-        for service in allservices:
-            if callmode != "all":
-                if singleservice and service['name'] != singleservice:
-                    continue
-                if service['mode'] == "buildtime":
-                    continue
-                if service['mode'] == "serveronly" and callmode != "disabled":
-                    continue
-                if service['mode'] == "disabled" and callmode != "disabled":
-                    continue
-                if service['mode'] != "disabled" and callmode == "disabled":
-                    continue
-                if service['mode'] != "trylocal" and service['mode'] != "localonly" and callmode == "trylocal":
-                    continue
-            temp_dir = None
-            try:
-                temp_dir = tempfile.mkdtemp(dir=dir, suffix='.%s.service' % service['name'])
-                cmd = service['command']
-                if not os.path.exists("/usr/lib/obs/service/"+cmd[0]):
-                    raise oscerr.PackageNotInstalled("obs-service-%s"%cmd[0])
-                cmd[0] = "/usr/lib/obs/service/"+cmd[0]
-                cmd = cmd + [ "--outdir", temp_dir ]
-                if conf.config['verbose'] > 1 or verbose or conf.config['debug']:
-                    print("Run source service:", ' '.join(cmd))
-                r = run_external(*cmd)
-
-                if r != 0:
-                    print("Aborting: service call failed: ", ' '.join(cmd))
-                    # FIXME: addDownloadUrlService calls si.execute after
-                    #        updating _services.
-                    return r
-
-                if service['mode'] == "disabled" or service['mode'] == "trylocal" or service['mode'] == "localonly" or callmode == "local" or callmode == "trylocal" or callmode == "all":
-                    for filename in os.listdir(temp_dir):
-                        os.rename(os.path.join(temp_dir, filename), os.path.join(dir, filename))
-                else:
-                    name = service['name']
-                    for filename in os.listdir(temp_dir):
-                        os.rename(os.path.join(temp_dir, filename), os.path.join(dir, "_service:"+name+":"+filename))
-            finally:
-                if temp_dir is not None:
-                    shutil.rmtree(temp_dir)
+        services = [s for s in allservices if not self._skip_service(s, callmode, singleservice)]
+        for batch in self._schedule(services):
+            r = self._run_batch(batch, dir, callmode, verbose)
+            if r != 0:
+                # FIXME: addDownloadUrlService calls si.execute after
+                #        updating _services.
+                return r
 
         return 0
 
@@ -634,7 +774,6 @@ class Project:
 
             `wc_check` : bool
         """
-        import fnmatch
         self.dir = dir
         self.absdir = os.path.abspath(dir)
         self.progress_obj = progress_obj
@@ -659,10 +798,10 @@ class Project:
         if conf.config['do_package_tracking']:
             self.pac_root = self.read_packages().getroot()
             self.pacs_have = [ pac.get('name') for pac in self.pac_root.findall('package') ]
-            self.pacs_excluded = [ i for i in os.listdir(self.dir)
-                                   for j in conf.config['exclude_glob']
-                                   if fnmatch.fnmatch(i, j) ]
-            self.pacs_unvers = [ i for i in os.listdir(self.dir) if i not in self.pacs_have and i not in self.pacs_excluded ]
+            excluded = exclude_glob_re()
+            entries = os.listdir(self.dir)
+            self.pacs_excluded = [ i for i in entries if excluded.match(i) ]
+            self.pacs_unvers = [ i for i in entries if i not in self.pacs_have and i not in self.pacs_excluded ]
             # store all broken packages (e.g. packages which where removed by a non-osc cmd)
             # in the self.pacs_broken list
             self.pacs_broken = []
@@ -1119,7 +1258,8 @@ class Package:
     REQ_STOREFILES = ('_project', '_package', '_apiurl', '_files', '_osclib_version')
     OPT_STOREFILES = ('_to_be_added', '_to_be_deleted', '_in_conflict', '_in_update',
         '_in_commit', '_meta', '_meta_mode', '_frozenlink', '_pulled', '_linkrepair',
-        '_size_limit', '_commit_msg')
+        '_size_limit', '_commit_msg', '_store', '_sparse_include', '_sparse_exclude',
+        '_lazy', '_lazy_size')
 
     def __init__(self, workingdir, progress_obj=None, size_limit=None, wc_check=True):
         global store
@@ -1152,14 +1292,17 @@ class Package:
         self.todo = []
 
     def wc_check(self):
+        # self.store_entries was gathered by update_datastructs
         dirty_files = []
         for fname in self.filenamelist:
-            if not os.path.exists(os.path.join(self.storedir, fname)) and not fname in self.skipped:
+            if not fname in self.store_entries and not fname in self.skipped \
+                and not fname in self.lazy:
                 dirty_files.append(fname)
         for fname in Package.REQ_STOREFILES:
-            if not os.path.isfile(os.path.join(self.storedir, fname)):
+            if not fname in self.store_names or \
+                fname in self.store_entries and self.store_entries[fname].is_dir():
                 dirty_files.append(fname)
-        for fname in os.listdir(self.storedir):
+        for fname in self.store_entries:
             if fname in Package.REQ_STOREFILES or fname in Package.OPT_STOREFILES or \
                 fname.startswith('_build'):
                 continue
@@ -1189,7 +1332,8 @@ class Package:
         # all files which are present in the filelist have to exist in the storedir
         for f in self.filelist:
             # XXX: should we also check the md5?
-            if not os.path.exists(os.path.join(self.storedir, f.name)) and not f.name in self.skipped:
+            if not os.path.exists(os.path.join(self.storedir, f.name)) and not f.name in self.skipped \
+                and not f.name in self.lazy:
                 # if get_source_file fails we're screwed up...
                 get_source_file(self.apiurl, self.prjname, self.name, f.name,
                     targetfilename=os.path.join(self.storedir, f.name), revision=self.rev,
@@ -1318,17 +1462,21 @@ class Package:
         if self.meta:
             store_write_string(self.absdir, '_meta_mode', '')
         elif self.ismetamode():
-            os.unlink(os.path.join(self.storedir, '_meta_mode'))
+            store_unlink_file(self.absdir, '_meta_mode')
 
     def write_sizelimit(self):
         if self.size_limit and self.size_limit <= 0:
-            try:
-                os.unlink(os.path.join(self.storedir, '_size_limit'))
-            except:
-                pass
+            store_unlink_file(self.absdir, '_size_limit')
         else:
             store_write_string(self.absdir, '_size_limit', str(self.size_limit) + '\n')
 
+    def write_lazylist(self):
+        self.__write_storelist('_lazy', self.lazy)
+
+    def write_sparselist(self):
+        self.__write_storelist('_sparse_include', self.sparse_include)
+        self.__write_storelist('_sparse_exclude', self.sparse_exclude)
+
     def write_addlist(self):
         self.__write_storelist('_to_be_added', self.to_be_added)
 
@@ -1495,6 +1643,8 @@ class Package:
                 # in sha256sums.
                 # The storefile is guaranteed to exist (since we have a
                 # pulled/linkrepair wc, the file cannot have state 'S')
+                if filename in self.lazy:
+                    self.materialize([filename])
                 storefile = os.path.join(self.storedir, filename)
                 sha256sums[filename] = sha256_dgst(storefile)
 
@@ -1548,6 +1698,9 @@ class Package:
                 self.put_source_file(filename, tdir, copy_only=True)
             # update store with the committed files
             self.__commit_update_store(tdir)
+            # a committed placeholder file is not a placeholder anymore
+            self.lazy = [i for i in self.lazy
+                         if not os.path.exists(os.path.join(self.storedir, i))]
         finally:
             if tdir is not None and os.path.isdir(tdir):
                 shutil.rmtree(tdir)
@@ -1556,9 +1709,9 @@ class Package:
         print('Committed revision %s.' % self.rev)
 
         if self.ispulled():
-            os.unlink(os.path.join(self.storedir, '_pulled'))
+            store_unlink_file(self.absdir, '_pulled')
         if self.islinkrepair():
-            os.unlink(os.path.join(self.storedir, '_linkrepair'))
+            store_unlink_file(self.absdir, '_linkrepair')
             self.linkrepair = False
             # XXX: mark package as invalid?
             print('The source link has been repaired. This directory can now be removed.')
@@ -1576,8 +1729,11 @@ class Package:
         for filename in todo_delete:
             self.to_be_deleted.remove(filename)
             self.delete_storefile(filename)
+            if filename in self.lazy:
+                self.lazy.remove(filename)
         self.write_deletelist()
         self.write_addlist()
+        self.write_lazylist()
         self.update_datastructs()
 
         print_request_list(self.apiurl, self.prjname, self.name)
@@ -1604,10 +1760,7 @@ class Package:
 
     def __write_storelist(self, name, data):
         if len(data) == 0:
-            try:
-                os.unlink(os.path.join(self.storedir, name))
-            except:
-                pass
+            store_unlink_file(self.absdir, name)
         else:
             store_write_string(self.absdir, name, '%s\n' % '\n'.join(data))
 
@@ -1634,6 +1787,44 @@ class Package:
         if not origfile is None:
             os.unlink(origfile)
 
+    def is_placeholder(self, n):
+        """
+        Check if the local file n is a placeholder (an empty file whose
+        content was not downloaded yet).
+        """
+        filename = os.path.join(self.absdir, n)
+        return n in self.lazy and os.path.isfile(filename) and \
+            os.path.getsize(filename) == 0
+
+    def materialize(self, files=None):
+        """
+        Download the content of the placeholder files (or only of the
+        placeholders in the files list). The local file is only replaced
+        if it is still a placeholder.
+        """
+        for n in self.lazy[:]:
+            if files is not None and not n in files:
+                continue
+            f = self.findfilebyname(n)
+            storefilename = os.path.join(self.storedir, n)
+            get_source_file(self.apiurl, self.prjname, self.name, n, targetfilename=storefilename,
+                    revision=self.rev, progress_obj=self.progress_obj, mtime=f.mtime, meta=self.meta)
+            filename = os.path.join(self.absdir, n)
+            if self.is_placeholder(n) or not os.path.exists(filename):
+                shutil.copyfile(storefilename, filename)
+                utime(filename, (-1, f.mtime))
+            self.lazy.remove(n)
+            self.write_lazylist()
+
+    def write_placeholder(self, n, mtime=None):
+        filename = os.path.join(self.absdir, n)
+        open(filename, 'w').close()
+        if mtime:
+            utime(filename, (-1, mtime))
+        if not n in self.lazy:
+            self.lazy.append(n)
+            self.write_lazylist()
+
     def mergefile(self, n, revision, mtime=None):
         filename = os.path.join(self.dir, n)
         storefilename = os.path.join(self.storedir, n)
@@ -1694,15 +1885,29 @@ class Package:
 
     def get_files_meta(self, revision='latest', skip_service=True):
         fm = show_files_meta(self.apiurl, self.prjname, self.name, revision=revision, meta=self.meta)
-        # look for "too large" files according to size limit and mark them
+        # look for "too large" files according to size limit and for files
+        # which are excluded by the sparse rules and mark them
         root = ET.fromstring(fm)
         for e in root.findall('entry'):
             size = e.get('size')
             if size and self.size_limit and int(size) > self.size_limit \
-                or skip_service and (e.get('name').startswith('_service:') or e.get('name').startswith('_service_')):
+                or skip_service and (e.get('name').startswith('_service:') or e.get('name').startswith('_service_')) \
+                or self.is_sparse_excluded(e.get('name')):
                 e.set('skipped', 'true')
         return ET.tostring(root, encoding=ET_ENCODING)
 
+    def is_sparse_excluded(self, n):
+        """
+        Check if the file n is excluded by the sparse checkout rules: a file
+        is excluded if it matches an exclude glob or if include globs are
+        specified and it matches none of them.
+        """
+        import fnmatch
+        if self.sparse_include and \
+            not [ i for i in self.sparse_include if fnmatch.fnmatch(n, i) ]:
+            return True
+        return len([ i for i in self.sparse_exclude if fnmatch.fnmatch(n, i) ]) > 0
+
     def get_local_meta(self):
         """Get the local _meta file for the package."""
         meta = store_read_file(self.absdir, '_meta')
@@ -1732,7 +1937,6 @@ class Package:
         file has changed (e.g. update_local_filesmeta() has been
         called).
         """
-        import fnmatch
         files_tree = read_filemeta(self.dir)
         files_tree_root = files_tree.getroot()
 
@@ -1762,24 +1966,40 @@ class Package:
             self.filelist.append(f)
             self.filenamelist.append(f.name)
 
-        self.to_be_added = read_tobeadded(self.absdir)
-        self.to_be_deleted = read_tobedeleted(self.absdir)
-        self.in_conflict = read_inconflict(self.absdir)
-        self.linkrepair = os.path.isfile(os.path.join(self.storedir, '_linkrepair'))
-        self.size_limit = read_sizelimit(self.dir)
-        self.meta = self.ismetamode()
+        # a single pass over the wc and the store dir (the optional store
+        # files are only read if they exist)
+        self.dir_entries = scan_dir(self.absdir)
+        self.store_entries = scan_dir(self.storedir)
+        self.store_names = set(self.store_entries)
+        if '_store' in self.store_entries:
+            self.store_names.update(store_v2_read(self.absdir))
+        self.to_be_added = self.__read_storelist('_to_be_added')
+        self.to_be_deleted = self.__read_storelist('_to_be_deleted')
+        self.in_conflict = self.__read_storelist('_in_conflict')
+        self.sparse_include = self.__read_storelist('_sparse_include')
+        self.sparse_exclude = self.__read_storelist('_sparse_exclude')
+        self.lazy = self.__read_storelist('_lazy')
+        self.lazy_size = None
+        if '_lazy_size' in self.store_names:
+            self.lazy_size = read_lazysize(self.dir)
+        self.linkrepair = '_linkrepair' in self.store_names
+        self.size_limit = None
+        if '_size_limit' in self.store_names:
+            self.size_limit = read_sizelimit(self.dir)
+        self.meta = '_meta_mode' in self.store_names
 
         # gather unversioned files, but ignore some stuff
-        self.excluded = []
-        for i in os.listdir(self.dir):
-            for j in conf.config['exclude_glob']:
-                if fnmatch.fnmatch(i, j):
-                    self.excluded.append(i)
-                    break
-        self.filenamelist_unvers = [ i for i in os.listdir(self.dir)
+        excluded = exclude_glob_re()
+        self.excluded = [ i for i in self.dir_entries if excluded.match(i) ]
+        self.filenamelist_unvers = [ i for i in self.dir_entries
                                      if i not in self.excluded
                                      if i not in self.filenamelist ]
 
+    def __read_storelist(self, name):
+        if not name in self.store_names:
+            return []
+        return store_readlist(self.absdir, name)
+
     def islink(self):
         """tells us if the package is a link (has 'linkinfo').
         A package with linkinfo is a package which links to another package.
@@ -1797,19 +2017,19 @@ class Package:
 
     def ispulled(self):
         """tells us if we have pulled a link."""
-        return os.path.isfile(os.path.join(self.storedir, '_pulled'))
+        return store_exists(self.absdir, '_pulled')
 
     def isfrozen(self):
         """tells us if the link is frozen."""
-        return os.path.isfile(os.path.join(self.storedir, '_frozenlink'))
+        return store_exists(self.absdir, '_frozenlink')
 
     def ismetamode(self):
         """tells us if the package is in meta mode"""
-        return os.path.isfile(os.path.join(self.storedir, '_meta_mode'))
+        return store_exists(self.absdir, '_meta_mode')
 
     def get_pulled_srcmd5(self):
         pulledrev = None
-        for line in open(os.path.join(self.storedir, '_pulled'), 'r'):
+        for line in store_readlist(self.absdir, '_pulled'):
             pulledrev = line.strip()
         return pulledrev
 
@@ -1851,16 +2071,21 @@ class Package:
 
     def get_status(self, excluded=False, *exclude_states):
         global store
+        # take a fresh snapshot of the wc and the store dir, which is used
+        # for all status lookups (instead of stat'ing each file separately)
+        self.dir_entries = scan_dir(self.absdir)
+        self.store_entries = scan_dir(self.storedir)
         todo = self.todo
         if not todo:
             todo = self.filenamelist + self.to_be_added + \
-                [i for i in self.filenamelist_unvers if not os.path.isdir(os.path.join(self.absdir, i))]
+                [i for i in self.filenamelist_unvers
+                 if not (i in self.dir_entries and self.dir_entries[i].is_dir())]
             if excluded:
                 todo.extend([i for i in self.excluded if i != store])
             todo = set(todo)
         res = []
         for fname in sorted(todo):
-            st = self.status(fname)
+            st = self.__status(fname, self.dir_entries, self.store_entries)
             if not st in exclude_states:
                 res.append((st, fname))
         return res
@@ -1883,20 +2108,35 @@ class Package:
           x       -            x        'S' and listed in self.skipped
           -       -            x        'S' and listed in self.skipped
           -       x            x        '!'
+          x       -            x        ' ' and listed in self.lazy (placeholder,
+                                            if the content differs: 'M')
+          -       -            x        '!' and listed in self.lazy
           -       -            -        NOT DEFINED
 
         """
+        return self.__status(n)
 
+    def __status(self, n, dir_entries=None, store_entries=None):
+        """
+        computes the status of n. If dir_entries and store_entries
+        (see scan_dir()) are specified, they are used instead of stat'ing
+        the local file and the storefile.
+        """
         known_by_meta = False
         exists = False
         exists_in_store = False
         localfile = os.path.join(self.absdir, n)
         if n in self.filenamelist:
             known_by_meta = True
-        if os.path.exists(localfile):
-            exists = True
-        if os.path.exists(os.path.join(self.storedir, n)):
-            exists_in_store = True
+        if dir_entries is None:
+            exists = os.path.exists(localfile)
+        elif n in dir_entries:
+            # a dangling symlink does not exist
+            exists = not dir_entries[n].is_symlink() or os.path.exists(localfile)
+        if store_entries is None:
+            exists_in_store = os.path.exists(os.path.join(self.storedir, n))
+        else:
+            exists_in_store = n in store_entries
 
         if n in self.to_be_deleted:
             state = 'D'
@@ -1904,6 +2144,13 @@ class Package:
             state = 'C'
         elif n in self.skipped:
             state = 'S'
+        elif n in self.lazy and exists:
+            # an untouched placeholder is not hashed
+            state = ' '
+            if not self.is_placeholder(n) and dgst(localfile) != self.findfilebyname(n).md5:
+                state = 'M'
+        elif n in self.lazy:
+            state = '!'
         elif n in self.to_be_added and exists and exists_in_store:
             state = 'R'
         elif n in self.to_be_added and exists:
@@ -1962,6 +2209,8 @@ class Package:
             else:
                 diff.append('--- %s\t(revision %s)\n' % (fname, revision or self.rev))
                 diff.append('+++ %s\t(working copy)\n' % fname)
+                if revision is None and fname in self.lazy:
+                    self.materialize([fname])
                 fname = os.path.join(self.storedir, fname)
                
             try:
@@ -2030,6 +2279,8 @@ class Package:
                 continue
             elif revision and self.findfilebyname(f.name).md5 == f.md5 and state != 'M':
                 continue
+            if f.name in self.lazy:
+                self.materialize([f.name])
             yield [diff_hdr % f.name]
             if revision is None:
                 yield get_source_file_diff(self.absdir, f.name, self.rev)
@@ -2146,8 +2397,7 @@ rev: %s
         print()
 
     def unmark_frozen(self):
-        if os.path.exists(os.path.join(self.storedir, '_frozenlink')):
-            os.unlink(os.path.join(self.storedir, '_frozenlink'))
+        store_unlink_file(self.absdir, '_frozenlink')
 
     def latest_rev(self, include_service_files=False, expand=False):
         # if expand is True the xsrcmd5 will be returned (even if the wc is unexpanded)
@@ -2248,13 +2498,20 @@ rev: %s
                 return True
         return sinfo.get('srcmd5') != self.srcmd5
 
-    def update(self, rev = None, service_files = False, size_limit = None):
+    def update(self, rev = None, service_files = False, size_limit = None,
+               sparse_include = None, sparse_exclude = None):
         import tempfile
         rfiles = []
         # size_limit is only temporary for this update
         old_size_limit = self.size_limit
         if not size_limit is None:
             self.size_limit = int(size_limit)
+        # in contrast to the size_limit the sparse rules are kept in the
+        # store (and replace the existing rules)
+        if not sparse_include is None or not sparse_exclude is None:
+            self.sparse_include = list(sparse_include or [])
+            self.sparse_exclude = list(sparse_exclude or [])
+            self.write_sparselist()
         if os.path.isfile(os.path.join(self.storedir, '_in_update', '_files')):
             print('resuming broken update...')
             root = ET.parse(os.path.join(self.storedir, '_in_update', '_files')).getroot()
@@ -2332,16 +2589,24 @@ rev: %s
                     'failed to add file \'%s\' file/dir with the same name already exists' % f.name)
         # ok, the update can't fail due to existing files
         for f in added:
-            self.updatefile(f.name, rev, f.mtime)
+            if not self.lazy_size is None and f.size > self.lazy_size:
+                # the content is downloaded on demand
+                self.write_placeholder(f.name, f.mtime)
+            else:
+                self.updatefile(f.name, rev, f.mtime)
             print(statfrmt('A', os.path.join(pathn, f.name)))
         for f in deleted:
             # if the storefile doesn't exist we're resuming an aborted update:
             # the file was already deleted but we cannot know this
             # OR we're processing a _service: file (simply keep the file)
-            if os.path.isfile(os.path.join(self.storedir, f.name)) and self.status(f.name) not in ('M', 'C'):
+            if os.path.isfile(os.path.join(self.storedir, f.name)) and self.status(f.name) not in ('M', 'C') \
+                or self.is_placeholder(f.name):
 #            if self.status(f.name) != 'M':
                 self.delete_localfile(f.name)
             self.delete_storefile(f.name)
+            if f.name in self.lazy:
+                self.lazy.remove(f.name)
+                self.write_lazylist()
             print(statfrmt('D', os.path.join(pathn, f.name)))
             if f.name in self.to_be_deleted:
                 self.to_be_deleted.remove(f.name)
@@ -2351,6 +2616,13 @@ rev: %s
                 self.write_conflictlist()
 
         for f in kept:
+            if self.is_placeholder(f.name):
+                # nothing to do: the content is downloaded on demand
+                continue
+            elif f.name in self.lazy:
+                # the local file was modified (or removed) - get the
+                # original content (needed for the merge)
+                self.materialize([f.name])
             state = self.status(f.name)
 #            print f.name, state
             if state == 'M' and self.findfilebyname(f.name).md5 == f.md5:
@@ -2425,6 +2697,8 @@ rev: %s
             raise oscerr.OscIOError(None, 'file \'%s\' is not under version control' % filename)
         elif filename in self.skipped:
             raise oscerr.OscIOError(None, 'file \'%s\' is marked as skipped and cannot be reverted' % filename)
+        if filename in self.lazy:
+            self.materialize([filename])
         if filename in self.filenamelist and not os.path.exists(os.path.join(self.storedir, filename)):
             raise oscerr.PackageInternalError('file \'%s\' is listed in filenamelist but no storefile exists' % filename)
         state = self.status(filename)
@@ -2440,7 +2714,8 @@ rev: %s
             self.write_addlist()
 
     @staticmethod
-    def init_package(apiurl, project, package, dir, size_limit=None, meta=False, progress_obj=None):
+    def init_package(apiurl, project, package, dir, size_limit=None, meta=False, progress_obj=None,
+                     sparse_include=None, sparse_exclude=None, lazy_size=None):
         global store
 
         if not os.path.exists(dir):
@@ -2451,6 +2726,8 @@ rev: %s
             raise oscerr.OscIOError(None, 'error: \'%s\' is already an initialized osc working copy' % dir)
         else:
             os.mkdir(os.path.join(dir, store))
+        if conf.config['store_v2']:
+            store_v2_write(dir, {})
         store_write_project(dir, project)
         store_write_string(dir, '_package', package + '\n')
         store_write_apiurl(dir, apiurl)
@@ -2458,8 +2735,17 @@ rev: %s
             store_write_string(dir, '_meta_mode', '')
         if size_limit:
             store_write_string(dir, '_size_limit', str(size_limit) + '\n')
+        if sparse_include:
+            store_write_string(dir, '_sparse_include', '%s\n' % '\n'.join(sparse_include))
+        if sparse_exclude:
+            store_write_string(dir, '_sparse_exclude', '%s\n' % '\n'.join(sparse_exclude))
+        if not lazy_size is None:
+            store_write_string(dir, '_lazy_size', str(lazy_size) + '\n')
         store_write_string(dir, '_files', '<directory />' + '\n')
-        store_write_string(dir, '_osclib_version', __store_version__ + '\n')
+        if conf.config['store_v2']:
+            store_write_string(dir, '_osclib_version', __store_v2_version__ + '\n')
+        else:
+            store_write_string(dir, '_osclib_version', __store_version__ + '\n')
         return Package(dir, progress_obj=progress_obj, size_limit=size_limit)
 
 
@@ -3193,6 +3479,14 @@ def read_filemeta(dir):
     filesmeta = os.path.join(dir, store, '_files')
     if not is_package_dir(dir):
         raise oscerr.NoWorkingCopy(msg)
+    if is_store_v2(dir):
+        data = store_v2_read(dir).get('_files')
+        if data is None:
+            raise oscerr.NoWorkingCopy('%s (%s does not exist)' % (msg, filesmeta))
+        try:
+            return ET.ElementTree(ET.fromstring(data))
+        except SyntaxError as e:
+            raise oscerr.NoWorkingCopy('%s\nWhen parsing .osc/_files, the following error was encountered:\n%s' % (msg, e))
     if not os.path.isfile(filesmeta):
         raise oscerr.NoWorkingCopy('%s (%s does not exist)' % (msg, filesmeta))
 
@@ -3206,7 +3500,11 @@ def store_readlist(dir, name):
     global store
 
     r = []
-    if os.path.exists(os.path.join(dir, store, name)):
+    if name in STORE_V2_FILES and is_store_v2(dir):
+        data = store_v2_read(dir).get(name)
+        if data:
+            r = data.rstrip('\n').split('\n')
+    elif os.path.exists(os.path.join(dir, store, name)):
         r = [line.rstrip('\n') for line in open(os.path.join(dir, store, name), 'r')]
     return r
 
@@ -3222,13 +3520,31 @@ def read_sizelimit(dir):
     r = None
     fname = os.path.join(dir, store, '_size_limit')
 
-    if os.path.exists(fname):
+    if is_store_v2(dir):
+        r = store_v2_read(dir).get('_size_limit', '').strip()
+    elif os.path.exists(fname):
         r = open(fname).readline().strip()
 
     if r is None or not r.isdigit():
         return None
     return int(r)
 
+def parse_size(size):
+    """
+    converts size (a number of bytes with an optional k, M or G suffix)
+    into an int. Raises a ValueError if size is invalid.
+    """
+    m = re.match(r'^\s*(\d+)\s*([kKmMgG]?)[bB]?\s*$', str(size))
+    if m is None:
+        raise ValueError('invalid size: \'%s\'' % size)
+    return int(m.group(1)) * 1024 ** ' kmg'.index(m.group(2).lower() or ' ')
+
+def read_lazysize(dir):
+    r = store_read_file(dir, '_lazy_size')
+    if r is None or not r.strip().isdigit():
+        return None
+    return int(r.strip())
+
 def read_inconflict(dir):
     return store_readlist(dir, '_in_conflict')
 
@@ -3378,6 +3694,12 @@ def check_store_version(dir):
             msg = msg + '\nTry svn instead of osc.'
         raise oscerr.NoWorkingCopy(msg)
 
+    if v == __store_v2_version__:
+        return
+    if v == __store_version__ and conf.config['store_v2'] and is_package_dir(dir):
+        store_v2_migrate(dir)
+        return
+
     if v != __store_version__:
         if v in ['0.2', '0.3', '0.4', '0.5', '0.6', '0.7', '0.8', '0.9', '0.95', '0.96', '0.97', '0.98', '0.99']:
             # version is fine, no migration needed
@@ -4921,7 +5243,8 @@ def make_dir(apiurl, project, package, pathname=None, prj_dir=None, package_trac
 
 def checkout_package(apiurl, project, package,
                      revision=None, pathname=None, prj_obj=None,
-                     expand_link=False, prj_dir=None, server_service_files = None, service_files=None, progress_obj=None, size_limit=None, meta=False, outdir=None):
+                     expand_link=False, prj_dir=None, server_service_files = None, service_files=None, progress_obj=None, size_limit=None, meta=False, outdir=None,
+                     sparse_include=None, sparse_exclude=None, lazy_size=None):
     try:
         # the project we're in might be deleted.
         # that'll throw an error then.
@@ -4997,7 +5320,8 @@ def checkout_package(apiurl, project, package,
         if x:
             revision = x
     directory = make_dir(apiurl, project, package, pathname, prj_dir, conf.config['do_package_tracking'], outdir)
-    p = Package.init_package(apiurl, project, package, directory, size_limit, meta, progress_obj)
+    p = Package.init_package(apiurl, project, package, directory, size_limit, meta, progress_obj,
+                             sparse_include, sparse_exclude, lazy_size)
     if isfrozen:
         p.mark_frozen()
     # no project structure is wanted when outdir is used
@@ -6408,9 +6732,102 @@ def store_read_apiurl(dir, defaulturl=True):
         apiurl = conf.config['apiurl']
     return apiurl
 
+def is_store_v2(dir):
+    """tells us if the store of the working copy dir uses the store v2 format"""
+    global store
+    return os.path.isfile(os.path.join(dir, store, '_store'))
+
+_store_v2_cache = {}
+def store_v2_read(dir):
+    """
+    Returns a dict which maps the STORE_V2_FILES of the store v2 working
+    copy dir to their contents. The returned dict must not be modified.
+    """
+    import json
+    global store
+
+    fname = os.path.join(dir, store, '_store')
+    st = os.stat(fname)
+    key = (st.st_ino, st.st_size, st.st_mtime)
+    cached = _store_v2_cache.get(os.path.abspath(fname))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    f = open(fname, 'r')
+    try:
+        data = json.load(f)
+    except ValueError as e:
+        raise oscerr.WorkingCopyInconsistent(store_read_project(dir), None, ['_store'],
+            'Cannot parse \'%s\': %s' % (fname, e))
+    finally:
+        f.close()
+    for k, v in data.items():
+        if not isinstance(v, str):
+            # python 2.x: json returns unicode objects
+            data[k] = v.encode('utf-8')
+    _store_v2_cache[os.path.abspath(fname)] = (key, data)
+    return data
+
+def store_v2_write(dir, data):
+    """
+    Atomically replaces the '_store' file of the working copy dir with
+    data (a dict which maps names from STORE_V2_FILES to their contents).
+    """
+    import json
+    global store
+
+    fname = os.path.join(dir, store, '_store')
+    try:
+        f = open(fname + '.new', 'w')
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(fname + '.new', fname)
+    except:
+        if os.path.exists(fname + '.new'):
+            os.unlink(fname + '.new')
+        raise
+    st = os.stat(fname)
+    _store_v2_cache[os.path.abspath(fname)] = ((st.st_ino, st.st_size, st.st_mtime), data)
+
+def store_v2_migrate(dir):
+    """
+    Migrates the store of the working copy dir to the store v2 format:
+    all STORE_V2_FILES are moved into a single '_store' file.
+    """
+    global store
+
+    data = {}
+    if is_store_v2(dir):
+        # an earlier migration was interrupted
+        data.update(store_v2_read(dir))
+    for name in STORE_V2_FILES:
+        fname = os.path.join(dir, store, name)
+        if os.path.isfile(fname):
+            data[name] = open(fname, 'r').read()
+    store_v2_write(dir, data)
+    for name in STORE_V2_FILES:
+        fname = os.path.join(dir, store, name)
+        if os.path.isfile(fname):
+            os.unlink(fname)
+    store_write_string(dir, '_osclib_version', __store_v2_version__ + '\n')
+
+def store_exists(dir, file):
+    """tells us if file exists in the store of the working copy dir"""
+    global store
+
+    if file in STORE_V2_FILES and is_store_v2(dir):
+        return file in store_v2_read(dir)
+    return os.path.isfile(os.path.join(dir, store, file))
+
 def store_write_string(dir, file, string, subdir=''):
     global store
 
+    if not subdir and file in STORE_V2_FILES and is_store_v2(dir):
+        data = dict(store_v2_read(dir))
+        data[file] = string
+        store_v2_write(dir, data)
+        return
     if subdir and not os.path.isdir(os.path.join(dir, store, subdir)):
         os.mkdir(os.path.join(dir, store, subdir))
     fname = os.path.join(dir, store, subdir, file)
@@ -6433,12 +6850,19 @@ def store_write_apiurl(dir, apiurl):
 def store_unlink_file(dir, file):
     global store
 
+    if file in STORE_V2_FILES and is_store_v2(dir):
+        data = dict(store_v2_read(dir))
+        if data.pop(file, None) is not None:
+            store_v2_write(dir, data)
+        return
     try: os.unlink(os.path.join(dir, store, file))
     except: pass
 
 def store_read_file(dir, file):
     global store
 
+    if file in STORE_V2_FILES and is_store_v2(dir):
+        return store_v2_read(dir).get(file)
     try:
         content = open(os.path.join(dir, store, file)).read()
         return content
@@ -6754,18 +7178,61 @@ def delete_storedir(store_dir):
     if tail == '.osc':
         delete_dir(store_dir)
 
-def unpack_srcrpm(srpm, dir, *files):
+def unpack_srcrpm(srpm, dir, *files, **kwargs):
     """
     This method unpacks the passed srpm into the
     passed dir. If arguments are passed to the \'files\' tuple
-    only this files will be unpacked.
+    only this files will be unpacked (they may contain shell-style
+    wildcards). Like "cpio -i", an existing file is only replaced
+    by a newer one, unless overwrite=True is passed.
     """
+    overwrite = kwargs.pop('overwrite', False)
     if not is_srcrpm(srpm):
         print('error - \'%s\' is not a source rpm.' % srpm, file=sys.stderr)
         sys.exit(1)
+    import fnmatch, stat
+    from .util import cpio, packagequery, rpmquery
+    if not os.path.isdir(dir):
+        dir = os.getcwd()
+    with open(srpm, 'rb') as fsrpm:
+        try:
+            rpmq = rpmquery.RpmQuery(fsrpm)
+            rpmq.read()
+            payload = rpmq.payload()
+        except packagequery.PackageError:
+            # the payload compressor is not supported by python
+            return _unpack_srcrpm_cpio(srpm, dir, *files, overwrite=overwrite)
+        try:
+            archive = cpio.CpioStreamRead(payload, srpm)
+            for hdr in archive:
+                fn = hdr.filename
+                if fn.startswith('./'):
+                    fn = fn[2:]
+                if files and not [i for i in files if fnmatch.fnmatch(fn, i)]:
+                    continue
+                if not stat.S_ISREG(hdr.mode):
+                    continue
+                # a source rpm has no subdirectories
+                if '/' in fn or fn in (os.curdir, os.pardir):
+                    raise cpio.CpioError(srpm, 'invalid file name \'%s\'' % hdr.filename)
+                target = os.path.join(dir, fn)
+                if os.path.lexists(target):
+                    if not overwrite and os.lstat(target).st_mtime >= hdr.mtime:
+                        continue
+                    # do not write through a symlink or hardlink
+                    os.unlink(target)
+                archive.copyin_file(hdr, dir, fn)
+        except (cpio.CpioError, EnvironmentError, EOFError) as e:
+            print('error - cannot extract \'%s\': %s' % (srpm, e), file=sys.stderr)
+            sys.exit(1)
+
+def _unpack_srcrpm_cpio(srpm, dir, *files, **kwargs):
+    """unpacks the srpm with rpm2cpio and cpio (see unpack_srcrpm)"""
+    cpio_args = ['cpio', '-i']
+    if kwargs.pop('overwrite', False):
+        cpio_args.append('-u')
     curdir = os.getcwd()
-    if os.path.isdir(dir):
-        os.chdir(dir)
+    os.chdir(dir)
     ret = -1
     with open(srpm, 'r') as fsrpm:
         with open(os.devnull, 'w') as devnull:
@@ -6773,7 +7240,7 @@ def unpack_srcrpm(srpm, dir, *files):
                                              stdout=subprocess.PIPE)
             # XXX: shell injection is possible via the files parameter, but the
             #      current osc code does not use the files parameter.
-            cpio_proc = subprocess.Popen(['cpio', '-i'] + list(files),
+            cpio_proc = subprocess.Popen(cpio_args + list(files),
                                          stdin=rpm2cpio_proc.stdout,
                                          stderr=devnull)
             rpm2cpio_proc.stdout.close()
@@ -6794,7 +7261,7 @@ def is_rpm(f):
     except:
         return False
 
-    if h == '\xed\xab\xee\xdb':
+    if h == b'\xed\xab\xee\xdb':
         return True
     else:
         return False
@@ -6810,7 +7277,7 @@ def is_srcrpm(f):
     except:
         return False
 
-    if h[7] == '\x01':
+    if h[7:8] == b'\x01':
         return True
     else:
         return False
@@ -7621,6 +8088,25 @@ def run_external(filename, *args, **kwargs):
             raise
         raise oscerr.ExtRuntimeError(e.strerror, filename)
 
+def start_external(filename, *args, **kwargs):
+    """Starts the program filename via subprocess.Popen.
+
+    The arguments are the same as for run_external. Returns the
+    subprocess.Popen object (the caller has to wait for it).
+
+    """
+    kwargs.setdefault('shell', False)
+    if args:
+        cmd = [filename] + list(args)
+    else:
+        cmd = filename
+    try:
+        return subprocess.Popen(cmd, **kwargs)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        raise oscerr.ExtRuntimeError(e.strerror, filename)
+
 def return_external(filename, *args, **kwargs):
     """Executes the program filename via subprocess.check_output.
 
@@ -8,33 +8,84 @@ from __future__ import print_function
 import sys, os
 
 try:
-    from urllib.parse import quote_plus
+    from urllib.parse import quote_plus, urlsplit
     from urllib.request import HTTPBasicAuthHandler, HTTPCookieProcessor, HTTPPasswordMgrWithDefaultRealm, HTTPError
 except ImportError:
     #python 2.x
     from urllib import quote_plus
+    from urlparse import urlsplit
     from urllib2 import HTTPBasicAuthHandler, HTTPCookieProcessor, HTTPPasswordMgrWithDefaultRealm, HTTPError
 
+try:
+    import queue
+except ImportError:
+    #python 2.x
+    import Queue as queue
+
 from urlgrabber.grabber import URLGrabber, URLGrabError
-from urlgrabber.mirror import MirrorGroup
-from .core import makeurl, streamfile, dgst
+from urlgrabber.progress import format_time, format_number
+from .core import makeurl, streamfile
 from .util import packagequery, cpio
+from .cache import CacheIndex
+from . import cache
 from . import conf
 from . import oscerr
+import multiprocessing
+import multiprocessing.util
 import tempfile
 import re
+import shutil
+import threading
+import time
 try:
     from .meter import TextMeter
 except:
     TextMeter = None
 
 
-def join_url(self, base_url, rel_url):
-    """to override _join_url of MirrorGroup, because we want to
-    pass full URLs instead of base URL where relative_url is added later...
-    IOW, we make MirrorGroup ignore relative_url
+def urlgrab_error(url, e):
+    """converts the HTTPError e into a URLGrabError"""
+    exc = URLGrabError(14, str(e))
+    exc.url = url
+    exc.exception = e
+    exc.code = e.code
+    return exc
+
+
+class StreamFile:
+    """
+    read-only file object for the response of url (the data is read via
+    streamfile, so that the progress is shown).
     """
-    return base_url
+    def __init__(self, url, progress_obj=None, text=None, bufsize=65536):
+        self.url = url
+        self.chunks = streamfile(url, progress_obj=progress_obj, text=text,
+                                 bufsize=bufsize)
+        # unread data (only the part after self.offset is unread)
+        self.buf = bytearray()
+        self.offset = 0
+
+    def read(self, size):
+        while len(self.buf) - self.offset < size:
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                break
+            except HTTPError as e:
+                raise urlgrab_error(self.url, e)
+            except IOError as e:
+                raise URLGrabError(4, str(e))
+            if self.offset:
+                # drop the consumed data before appending
+                del self.buf[:self.offset]
+                self.offset = 0
+            self.buf += chunk
+        data = bytes(self.buf[self.offset:self.offset + size])
+        self.offset += len(data)
+        return data
+
+    def close(self):
+        self.chunks.close()
 
 
 class OscFileGrabber(URLGrabber):
@@ -57,16 +108,124 @@ class OscFileGrabber(URLGrabber):
                                     text=text):
                     f.write(i)
             except HTTPError as e:
-                exc = URLGrabError(14, str(e))
-                exc.url = url
-                exc.exception = e
-                exc.code = e.code
-                raise exc
+                raise urlgrab_error(url, e)
             except IOError as e:
                 raise URLGrabError(4, str(e))
         return filename
 
 
+def run_jobs(func, items, jobs):
+    """
+    calls func(item) for each item in at most jobs threads. The first
+    exception which is raised by func is re-raised (the pending items
+    are not processed in this case).
+    """
+    todo = queue.Queue()
+    for item in items:
+        todo.put(item)
+    errors = []
+
+    def worker():
+        while not errors:
+            try:
+                item = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                func(item)
+            except (Exception, SystemExit) as e:
+                errors.append(e)
+
+    threads = []
+    for i in range(min(len(items), jobs)):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    try:
+        for t in threads:
+            # join with a timeout, otherwise a ctrl-c is not delivered
+            while t.is_alive():
+                t.join(0.2)
+    except KeyboardInterrupt:
+        # let the workers stop after their current item
+        errors.append(None)
+        raise
+    if errors:
+        raise errors[0]
+
+
+class AggregateMeter:
+    """
+    Shows the overall progress (bytes, rate and ETA) of concurrent
+    downloads instead of one meter per file. Each download gets its
+    own FileMeter (see file_meter()).
+    """
+    def __init__(self, total, fo=None):
+        self.total = total
+        self.fo = fo or sys.stdout
+        self.done = 0
+        # bytes of the finished downloads
+        self.finished = 0
+        self.active = {}
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+
+    def file_meter(self):
+        return FileMeter(self)
+
+    def _update(self):
+        read = self.finished + sum(self.active.values())
+        etime = time.time() - self.start_time
+        eta = '--:--'
+        if self.done and read and etime:
+            # estimate the total size from the finished downloads
+            remaining = self.finished * self.total / self.done - read
+            eta = format_time(max(remaining, 0) / (read / etime))
+        self.fo.write('\r%d/%d packages %5sB %5sB/s ETA %s ' % (self.done, self.total,
+                      format_number(read), format_number(read / max(etime, 1)), eta))
+        self.fo.flush()
+
+    def update(self, meter, amount_read):
+        with self.lock:
+            self.active[meter] = amount_read
+            self._update()
+
+    def skip(self):
+        """a package is not downloaded (e.g. it is fetched via the api later on)"""
+        with self.lock:
+            self.total -= 1
+            self._update()
+
+    def finish(self, meter, success=True):
+        """the download of meter is finished (or failed)"""
+        with self.lock:
+            amount_read = self.active.pop(meter, 0)
+            if success:
+                self.finished += amount_read
+                self.done += 1
+            self._update()
+
+    def end(self):
+        self.fo.write('\n')
+        self.fo.flush()
+
+
+class FileMeter:
+    """forwards the progress of a single download to an AggregateMeter"""
+    def __init__(self, aggregate):
+        self.aggregate = aggregate
+
+    def start(self, *args, **kwargs):
+        self.aggregate.update(self, 0)
+
+    def update(self, amount_read, now=None):
+        self.aggregate.update(self, amount_read)
+
+    def end(self, amount_read, now=None):
+        self.aggregate.update(self, amount_read)
+
+
 class Fetcher:
     def __init__(self, cachedir='/tmp', api_host_options={}, urllist=[],
             http_debug=False, cookiejar=None, offline=False, enable_cpio=True):
@@ -77,11 +236,14 @@ class Fetcher:
             self.progress_obj = None
 
         self.cachedir = cachedir
+        self.cache_index = CacheIndex(cachedir)
         self.urllist = urllist
         self.http_debug = http_debug
         self.offline = offline
         self.cpio = {}
         self.enable_cpio = enable_cpio
+        # longest url for a cpio request (the server might reject longer urls)
+        self.max_url_len = 8192
 
         passmgr = HTTPPasswordMgrWithDefaultRealm()
         for host in api_host_options:
@@ -90,41 +252,52 @@ class Fetcher:
         openers = (HTTPBasicAuthHandler(passmgr), )
         if cookiejar:
             openers += (HTTPCookieProcessor(cookiejar), )
-        self.gr = OscFileGrabber(progress_obj=self.progress_obj)
-
-    def failureReport(self, errobj):
-        """failure output for failovers from urlgrabber"""
-        if errobj.url.startswith('file://'):
-            return {}
-        print('%s/%s: attempting download from api, since not found at %s'
-              % (self.curpac.project, self.curpac, errobj.url.split('/')[2]))
-        return {}
 
     def __add_cpio(self, pac):
         prpap = '%s/%s/%s/%s' % (pac.project, pac.repository, pac.repoarch, pac.repopackage)
         self.cpio.setdefault(prpap, {})[pac.repofilename] = pac
 
-    def __download_cpio_archive(self, apiurl, project, repo, arch, package, **pkgs):
-        if not pkgs:
-            return
+    def __cpio_url(self, apiurl, project, repo, arch, package, pkgs):
         query = ['binary=%s' % quote_plus(i) for i in pkgs]
         query.append('view=cpio')
+        return makeurl(apiurl, ['build', project, repo, arch, package], query=query)
+
+    def __cpio_batches(self, apiurl, project, repo, arch, package, pkgs):
+        """
+        splits pkgs into batches whose cpio url does not exceed
+        max_url_len (so that there is no need to wait for a
+        "414 Request-URI Too Large" response).
+        """
+        length = len(self.__cpio_url(apiurl, project, repo, arch, package, {}))
+        batches = [{}]
+        batch_len = length
+        for name in sorted(pkgs):
+            l = len('&binary=%s' % quote_plus(name))
+            if batches[-1] and batch_len + l > self.max_url_len:
+                batches.append({})
+                batch_len = length
+            batches[-1][name] = pkgs[name]
+            batch_len += l
+        return [i for i in batches if i]
+
+    def __download_cpio_archive(self, apiurl, project, repo, arch, package, pkgs, progress_obj=None):
+        if not pkgs:
+            return
         try:
-            url = makeurl(apiurl, ['build', project, repo, arch, package], query=query)
-            sys.stdout.write("preparing download ...\r")
-            sys.stdout.flush()
-            with tempfile.NamedTemporaryFile(prefix='osc_build_cpio') as tmparchive:
-                self.gr.urlgrab(url, filename=tmparchive.name,
+            url = self.__cpio_url(apiurl, project, repo, arch, package, pkgs)
+            # the archive is not stored on disk: each member is written
+            # to the cache dir (and moved into place) while it is read
+            stream = StreamFile(url, progress_obj=progress_obj,
                                 text='fetching packages for \'%s\'' % project)
-                archive = cpio.CpioRead(tmparchive.name)
-                archive.read()
+            try:
+                archive = cpio.CpioStreamRead(stream, url)
                 for hdr in archive:
                     # XXX: we won't have an .errors file because we're using
                     # getbinarylist instead of the public/... route
                     # (which is routed to getbinaries)
                     # getbinaries does not support kiwi builds
                     if hdr.filename == '.errors':
-                        archive.copyin_file(hdr.filename)
+                        archive.copyin_file(hdr)
                         raise oscerr.APIError('CPIO archive is incomplete '
                                               '(see .errors file)')
                     if package == '_repository':
@@ -139,23 +312,27 @@ class Fetcher:
                         # this is a kiwi product
                         pac = pkgs[hdr.filename]
 
-                    # Extract a single file from the cpio archive
+                    # Extract a single file from the cpio stream (into the
+                    # package's cache dir, so that moving it is cheap)
+                    fd, tmpfile = tempfile.mkstemp(prefix='.osc_build_file',
+                                                   dir=pac.localdir)
+                    os.close(fd)
                     try:
-                        fd, tmpfile = tempfile.mkstemp(prefix='osc_build_file')
-                        archive.copyin_file(hdr.filename,
-                                            os.path.dirname(tmpfile),
+                        archive.copyin_file(hdr, os.path.dirname(tmpfile),
                                             os.path.basename(tmpfile))
-                        self.move_package(tmpfile, pac.localdir, pac)
+                        hdrmd5 = self.verify_hdrmd5(tmpfile, pac)
+                        self.move_package(tmpfile, pac.localdir, pac, hdrmd5)
                     finally:
-                        os.close(fd)
                         if os.path.exists(tmpfile):
                             os.unlink(tmpfile)
-
-                for pac in pkgs.values():
-                    if not os.path.isfile(pac.fullfilename):
-                        raise oscerr.APIError('failed to fetch file \'%s\': '
-                                              'missing in CPIO archive' %
-                                              pac.repofilename)
+            finally:
+                stream.close()
+
+            for pac in pkgs.values():
+                if not os.path.isfile(pac.fullfilename):
+                    raise oscerr.APIError('failed to fetch file \'%s\': '
+                                          'missing in CPIO archive' %
+                                          pac.repofilename)
         except URLGrabError as e:
             if e.errno != 14 or e.code != 414:
                 raise
@@ -164,52 +341,145 @@ class Fetcher:
             if len(keys) == 1:
                 raise oscerr.APIError('unable to fetch cpio archive: '
                                       'server always returns code 414')
-            n = len(pkgs) / 2
+            n = len(pkgs) // 2
             new_pkgs = dict([(k, pkgs[k]) for k in keys[:n]])
             self.__download_cpio_archive(apiurl, project, repo, arch,
-                                         package, **new_pkgs)
+                                         package, new_pkgs, progress_obj)
             new_pkgs = dict([(k, pkgs[k]) for k in keys[n:]])
             self.__download_cpio_archive(apiurl, project, repo, arch,
-                                         package, **new_pkgs)
+                                         package, new_pkgs, progress_obj)
 
     def __fetch_cpio(self, apiurl):
+        """
+        fetch the cpio archives concurrently (at most download_jobs
+        requests at the same time)
+        """
+        todo = []
         for prpap, pkgs in self.cpio.items():
             project, repo, arch, package = prpap.split('/', 3)
-            self.__download_cpio_archive(apiurl, project, repo, arch, package, **pkgs)
-
-    def fetch(self, pac, prefix=''):
-        # for use by the failure callback
-        self.curpac = pac
-
-        MirrorGroup._join_url = join_url
-        mg = MirrorGroup(self.gr, pac.urllist, failure_callback=(self.failureReport, (), {}))
-
+            for batch in self.__cpio_batches(apiurl, project, repo, arch, package, pkgs):
+                todo.append((project, repo, arch, package, batch))
+        if not todo:
+            return
+        sys.stdout.write("preparing download ...\r")
+        sys.stdout.flush()
+        if len(todo) == 1:
+            self.__download_cpio_archive(apiurl, *todo[0], progress_obj=self.progress_obj)
+            return
+        meter = None
+        if self.progress_obj:
+            meter = AggregateMeter(len(todo))
+
+        def fetch(args):
+            file_meter = None
+            if meter is not None:
+                file_meter = meter.file_meter()
+            self.__download_cpio_archive(apiurl, *args, progress_obj=file_meter)
+            if meter is not None:
+                meter.finish(file_meter)
+
+        run_jobs(fetch, todo, max(1, int(conf.config['download_jobs'])))
+        if meter is not None:
+            meter.end()
+
+    def __fetch_mirrors(self, pac, meter=None):
+        """
+        try to fetch pac from its mirrors (in order). At most download_jobs
+        transfers per mirror host run at the same time (see fetch_all).
+        Returns False if no mirror has the package.
+        """
         if self.http_debug:
-            print('\nURLs to try for package \'%s\':' % pac, file=sys.stderr)
-            print('\n'.join(pac.urllist), file=sys.stderr)
-            print(file=sys.stderr)
-
-        try:
-            with tempfile.NamedTemporaryFile(prefix='osc_build',
-                                             delete=False) as tmpfile:
-                mg.urlgrab(pac.filename, filename=tmpfile.name,
-                           text='%s(%s) %s' % (prefix, pac.project, pac.filename))
-                self.move_package(tmpfile.name, pac.localdir, pac)
-        except URLGrabError as e:
-            if self.enable_cpio and e.errno == 256:
+            with self.lock:
+                print('\nURLs to try for package \'%s\':' % pac, file=sys.stderr)
+                print('\n'.join(pac.urllist), file=sys.stderr)
+                print(file=sys.stderr)
+        for url in pac.urllist:
+            fd, tmpfile = tempfile.mkstemp(prefix='osc_build')
+            os.close(fd)
+            file_meter = None
+            if meter is not None:
+                file_meter = meter.file_meter()
+            try:
+                with self.host_slots[urlsplit(url)[1]]:
+                    gr = OscFileGrabber(progress_obj=file_meter)
+                    filename = gr.urlgrab(url, filename=tmpfile,
+                                          text='(%s) %s' % (pac.project, pac.filename))
+                if filename != tmpfile:
+                    # a file:// url (the file must not be moved away)
+                    import shutil
+                    shutil.copyfile(filename, tmpfile)
+                self.move_package(tmpfile, pac.localdir, pac)
+                if meter is not None:
+                    meter.finish(file_meter)
+                return True
+            except URLGrabError as e:
+                if meter is not None:
+                    meter.finish(file_meter, success=False)
+                if e.errno == 14 and getattr(e, 'code', None) != 404:
+                    with self.lock:
+                        print('\n%s: %s (trying next mirror)' % (url, e.strerror), file=sys.stderr)
+            finally:
+                if os.path.exists(tmpfile):
+                    os.unlink(tmpfile)
+        return False
+
+    def fetch_all(self, pacs):
+        """
+        fetch the pacs concurrently. Packages which are not available on
+        any mirror are fetched via the api (cpio) afterwards.
+        """
+        if not pacs:
+            return
+        jobs = max(1, int(conf.config['download_jobs']))
+        hosts = set()
+        for pac in pacs:
+            hosts.update([urlsplit(url)[1] for url in pac.urllist])
+        self.host_slots = dict([(host, threading.BoundedSemaphore(jobs)) for host in hosts])
+        self.lock = threading.Lock()
+        missing = []
+        meter = None
+        if self.progress_obj:
+            meter = AggregateMeter(len(pacs))
+
+        def fetch(pac):
+            if not meter:
+                # if there isn't a progress bar, there is no output at all
+                with self.lock:
+                    print('(%s) %s' % (pac.project, pac.filename))
+            if not self.__fetch_mirrors(pac, meter):
+                missing.append(pac)
+                if meter is not None:
+                    meter.skip()
+
+        run_jobs(fetch, pacs, jobs * len(hosts))
+        if meter is not None:
+            meter.end()
+        for pac in pacs:
+            if not pac in missing:
+                continue
+            if self.enable_cpio:
                 self.__add_cpio(pac)
-                return
+                continue
             print()
-            print('Error:', e.strerror, file=sys.stderr)
             print('Failed to retrieve %s from the following locations '
                   '(in order):' % pac.filename, file=sys.stderr)
             print('\n'.join(pac.urllist), file=sys.stderr)
             sys.exit(1)
-        finally:
-            if os.path.exists(tmpfile.name):
-                os.unlink(tmpfile.name)
 
-    def move_package(self, tmpfile, destdir, pac_obj=None):
+    def verify_hdrmd5(self, filename, pac):
+        """
+        raises an APIError if the hdrmd5 of filename does not match.
+        Returns the hdrmd5 of filename (None if pac has no hdrmd5).
+        """
+        if not pac.hdrmd5:
+            return None
+        hdrmd5 = CacheIndex.compute_hdrmd5(filename, pac.name.startswith('container:'))
+        if hdrmd5 and hdrmd5 != pac.hdrmd5:
+            raise oscerr.APIError('hdrmd5 mismatch for \'%s\': %s != %s'
+                                  % (pac.repofilename, hdrmd5, pac.hdrmd5))
+        return hdrmd5
+
+    def move_package(self, tmpfile, destdir, pac_obj=None, hdrmd5=None):
         import shutil
         canonname = None
         if pac_obj and pac_obj.name.startswith('container:'):
@@ -230,6 +500,17 @@ class Fetcher:
             pac_obj.fullfilename = fullfilename
         shutil.move(tmpfile, fullfilename)
         os.chmod(fullfilename, 0o644)
+        if pac_obj is not None and pac_obj.hdrmd5:
+            self.cache_index.add(fullfilename, hdrmd5,
+                                 container=pac_obj.name.startswith('container:'))
+
+    def prune(self):
+        """remove the least recently used packages (see packagecache_maxsize)"""
+        removed = cache.prune(self.cachedir, conf.config['packagecache_maxsize'],
+                              conf.config['packagecache_maxage'])
+        if removed:
+            print('Removed %d packages (%d MiB) from the package cache'
+                  % (len(removed), sum([i[1] for i in removed]) // (1024 * 1024)))
 
     def dirSetup(self, pac):
         dir = os.path.join(self.cachedir, pac.localdir)
@@ -252,24 +533,25 @@ class Fetcher:
                     if os.path.exists(i.fullfilename[:-7] + ext):
                         i.canonname = i.canonname[:-7] + ext
                         i.makeurls(self.cachedir, self.urllist)
-
+        # the dependencies must not be removed by a concurrent prune
+        cache.pin(self.cachedir, [i.fullfilename for i in buildinfo.deps])
+        for i in buildinfo.deps:
             if os.path.exists(i.fullfilename):
                 cached += 1
                 if i.hdrmd5:
-                    from .util import packagequery
-                    if i.name.startswith('container:'):
-                        hdrmd5 = dgst(i.fullfilename)
-                    else:
-                        hdrmd5 = packagequery.PackageQuery.queryhdrmd5(i.fullfilename)
+                    hdrmd5 = self.cache_index.hdrmd5(i.fullfilename,
+                                                     i.name.startswith('container:'))
                     if not hdrmd5 or hdrmd5 != i.hdrmd5:
                         os.unlink(i.fullfilename)
+                        self.cache_index.remove(i.fullfilename)
                         cached -= 1
         miss = 0
         needed = all - cached
         if all:
             miss = 100.0 * needed / all
         print("%.1f%% cache miss. %d/%d dependencies cached.\n" % (miss, cached, all))
-        done = 1
+        fetch = []
+        linked = 0
         for i in buildinfo.deps:
             i.makeurls(self.cachedir, self.urllist)
             if not os.path.exists(i.fullfilename):
@@ -279,26 +561,31 @@ class Fetcher:
                                             '--offline not possible.' %
                                             i.fullfilename)
                 self.dirSetup(i)
+                if i.hdrmd5 and self.cache_index.link(i.hdrmd5, i.fullfilename):
+                    # the same package is cached for a different project
+                    linked += 1
+                    continue
                 if i.hdrmd5 and self.enable_cpio:
                     self.__add_cpio(i)
-                    done += 1
                     continue
-                try:
-                    # if there isn't a progress bar, there is no output at all
-                    if not self.progress_obj:
-                        print('%d/%d (%s) %s' % (done, needed, i.project, i.filename))
-                    self.fetch(i)
-                    if self.progress_obj:
-                        print("  %d/%d\r" % (done, needed), end=' ')
-                        sys.stdout.flush()
-
-                except KeyboardInterrupt:
-                    print('Cancelled by user (ctrl-c)')
-                    print('Exiting.')
-                    sys.exit(0)
-                done += 1
+                fetch.append(i)
+        if linked:
+            print('%d packages linked from the cache of other projects.\n' % linked)
+        try:
+            self.fetch_all(fetch)
+        except KeyboardInterrupt:
+            print('Cancelled by user (ctrl-c)')
+            print('Exiting.')
+            sys.exit(0)
 
         self.__fetch_cpio(buildinfo.apiurl)
+        self.cache_index.save()
+        deps = [i.fullfilename for i in buildinfo.deps]
+        # the canonname of a fetched package might differ
+        cache.pin(self.cachedir, deps)
+        cache.touch(deps)
+        if not self.offline:
+            self.prune()
 
         prjs = list(buildinfo.projects.keys())
         for i in prjs:
@@ -359,20 +646,21 @@ def verify_pacs_old(pac_list):
     # don't care about the return value because we check the
     # output anyway, and rpm always writes to stdout.
 
-    # save locale first (we rely on English rpm output here)
-    saved_LC_ALL = os.environ.get('LC_ALL')
-    os.environ['LC_ALL'] = 'en_EN'
-
-    o = subprocess.Popen(['rpm', '-K'] + pac_list, stdout=subprocess.PIPE,
-                         stderr=subprocess.STDOUT, close_fds=True).stdout
+    # we rely on English rpm output here
+    env = os.environ.copy()
+    env['LC_ALL'] = 'en_EN'
 
-    # restore locale
-    if saved_LC_ALL:
-        os.environ['LC_ALL'] = saved_LC_ALL
-    else:
-        os.environ.pop('LC_ALL')
+    # run one rpm -K per core (each one checks a part of the packages)
+    jobs = min(len(pac_list), multiprocessing.cpu_count())
+    procs = [subprocess.Popen(['rpm', '-K'] + pac_list[i::jobs], stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, close_fds=True,
+                              universal_newlines=True, env=env)
+             for i in range(jobs)]
+    lines = []
+    for proc in procs:
+        lines.extend(proc.communicate()[0].splitlines(True))
 
-    for line in o.readlines():
+    for line in lines:
 
         if 'OK' not in line:
             print()
@@ -412,9 +700,31 @@ def verify_pacs_old(pac_list):
             sys.exit(1)
 
 
-def verify_pacs(bi):
+_checker = None
+
+def _verify_init(keys, tmpdir):
+    """initializes the Checker of a verify_pacs worker process"""
+    global _checker
+    from . import checker
+    _checker = checker.Checker(tmpdir)
+    _checker.readkeys(keys)
+    multiprocessing.util.Finalize(_checker, _checker.cleanup, exitpriority=10)
+
+def _verify(pkg):
+    """returns a (pkg, error) tuple (error is None if pkg was verified)"""
+    try:
+        _checker.check(pkg)
+    except Exception as e:
+        return pkg, str(e)
+    return pkg, None
+
+def verify_pacs(bi, cache_index=None):
     """Take a list of rpm filenames and verify their signatures.
 
+       The packages are verified by a pool of worker processes (each
+       one with its own rpmdb). If a cache_index is specified, packages
+       which were already verified with the same keys are skipped.
+
        In case of failure, exit.
        """
 
@@ -431,24 +741,52 @@ def verify_pacs(bi):
     print("using keys from", ', '.join(bi.prjkeys))
 
     from . import checker
-    failed = False
-    checker = checker.Checker()
+    # check the keys before the workers are started
+    c = checker.Checker()
     try:
-        checker.readkeys(bi.keys)
+        c.readkeys(bi.keys)
+    finally:
+        c.cleanup()
+
+    verified = None
+    hdrmd5s = {}
+    if cache_index is not None:
+        from .cache import VerifiedCache
+        verified = VerifiedCache(cache_index.cachedir, bi.keys)
         for pkg in pac_list:
+            # the checker ignores non rpms
+            if pkg.endswith('.rpm'):
+                hdrmd5s[pkg] = cache_index.hdrmd5(pkg)
+        pac_list = [i for i in pac_list if not verified.is_verified(i, hdrmd5s.get(i))]
+
+    failed = []
+    if pac_list:
+        jobs = min(len(pac_list), multiprocessing.cpu_count())
+        # the rpmdbs of the workers are created in tmpdir, so that they
+        # are also removed if the workers are terminated
+        tmpdir = tempfile.mkdtemp(prefix='oscverify')
+        try:
+            pool = multiprocessing.Pool(jobs, _verify_init, (bi.keys, tmpdir))
             try:
-                checker.check(pkg)
-            except Exception as e:
-                failed = True
-                print(pkg, ':', e)
-    except:
-        checker.cleanup()
-        raise
-
+                results = pool.map(_verify, pac_list, chunksize=max(1, len(pac_list) // (jobs * 4)))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        for pkg, error in results:
+            if error is not None:
+                failed.append(pkg)
+                print(pkg, ':', error)
+            elif verified is not None:
+                verified.add(pkg, hdrmd5s.get(pkg))
+
+    if verified is not None:
+        verified.save()
     if failed:
-        checker.cleanup()
         sys.exit(1)
 
-    checker.cleanup()
-
 # vim: sw=4 et
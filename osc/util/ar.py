@@ -15,21 +15,17 @@
 
 from __future__ import print_function
 
+import errno
 import os
 import re
 import sys
 import stat
 
-#XXX: python 2.7 contains io.StringIO, which needs unicode instead of str
-#therefor try to import old stuff before new one here
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
-
 # workaround for python24
 if not hasattr(os, 'SEEK_SET'):
     os.SEEK_SET = 0
+    os.SEEK_CUR = 1
+    os.SEEK_END = 2
 
 class ArError(Exception):
     """Base class for all ar related errors"""
@@ -45,6 +41,9 @@ class ArHdr:
     """Represents an ar header entry"""
     def __init__(self, fn, date, uid, gid, mode, size, fmag, off):
         self.file = fn.strip()
+        if not isinstance(self.file, str):
+            # python 3.x
+            self.file = self.file.decode('utf-8', 'surrogateescape')
         self.date = date.strip()
         self.uid = uid.strip()
         self.gid = gid.strip()
@@ -57,14 +56,53 @@ class ArHdr:
     def __str__(self):
         return '%16s %d' % (self.file, self.size)
 
-class ArFile(StringIO):
-    """Represents a file which resides in the archive"""
-    def __init__(self, fn, uid, gid, mode, buf):
-        StringIO.__init__(self, buf)
+class ArFile:
+    """
+    Represents a file which resides in the archive. The data is read on
+    demand from the archive (only the data section [dataoff, dataoff + size)
+    of the archive can be accessed).
+    """
+    def __init__(self, fn, uid, gid, mode, archive, dataoff, size):
         self.name = fn
         self.uid = uid
         self.gid = gid
         self.mode = mode
+        self.size = size
+        # the archive must not be closed as long as the file is used
+        self.__archive = archive
+        self.__dataoff = dataoff
+        self.__pos = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.size - self.__pos:
+            size = self.size - self.__pos
+        if size <= 0:
+            return b''
+        data = self.__archive._read(self.__dataoff + self.__pos, size)
+        self.__pos += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.__pos
+        elif whence == os.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise IOError(errno.EINVAL, 'negative seek offset')
+        self.__pos = offset
+
+    def tell(self):
+        return self.__pos
+
+    def close(self):
+        pass
+
+    def getvalue(self):
+        pos = self.__pos
+        self.seek(0)
+        data = self.read()
+        self.seek(pos)
+        return data
 
     def saveTo(self, dir = None):
         """
@@ -76,7 +114,12 @@ class ArFile(StringIO):
             dir = os.getcwd()
         fn = os.path.join(dir, self.name)
         f = open(fn, 'wb')
-        f.write(self.getvalue())
+        self.seek(0)
+        while True:
+            data = self.read(65536)
+            if not data:
+                break
+            f.write(data)
         f.close()
         os.chmod(fn, self.mode)
         uid = self.uid
@@ -97,7 +140,7 @@ class Ar:
     Readonly access.
     """
     hdr_len = 60
-    hdr_pat = re.compile('^(.{16})(.{12})(.{6})(.{6})(.{8})(.{10})(.{2})', re.DOTALL)
+    hdr_pat = re.compile(b'^(.{16})(.{12})(.{6})(.{6})(.{8})(.{10})(.{2})', re.DOTALL)
 
     def __init__(self, fn = None, fh = None):
         if fn == None and fh == None:
@@ -119,6 +162,8 @@ class Ar:
 
     def _init_datastructs(self):
         self.hdrs = []
+        # maps a filename to its hdr (see get_file)
+        self.hdrs_by_name = {}
         self.ext_fnhdr = None
 
     def _appendHdr(self, hdr):
@@ -150,16 +195,23 @@ class Ar:
             # XXX: is it safe to read all the data in one chunk? I assume the '//' data section
             #      won't be too large
             data = self.__file.read(self.ext_fnhdr.size)
-            end = data.find('/')
+            end = data.find(b'/')
             if end != -1:
                 h.file = data[0:end]
+                if not isinstance(h.file, str):
+                    # python 3.x
+                    h.file = h.file.decode('utf-8', 'surrogateescape')
             else:
                 raise ArError('//', 'invalid data section - trailing slash (off: %d)' % start)
 
     def _get_file(self, hdr):
-        self.__file.seek(hdr.dataoff, os.SEEK_SET)
         return ArFile(hdr.file, hdr.uid, hdr.gid, hdr.mode,
-                      self.__file.read(hdr.size))
+                      self, hdr.dataoff, hdr.size)
+
+    def _read(self, off, size):
+        """reads (at most) size bytes at offset off of the archive"""
+        self.__file.seek(off, os.SEEK_SET)
+        return self.__file.read(size)
 
     def read(self):
         """reads in the archive. It tries to use mmap due to performance reasons (in case of large files)"""
@@ -180,7 +232,7 @@ class Ar:
             self.__file.seek(0, os.SEEK_SET)
         self._init_datastructs()
         data = self.__file.read(7)
-        if data != '!<arch>':
+        if data != b'!<arch>':
             raise ArError(self.filename, 'no ar archive')
         pos = 8
         while (len(data) != 0):
@@ -199,16 +251,19 @@ class Ar:
             # offset ARFMAG[0] will be used for padding (according to the current binutils code)
             pos += hdr.size + (hdr.size & 1)
         self._fixupFilenames()
+        for h in self.hdrs:
+            # the first file wins (if an archive contains a file more than once)
+            self.hdrs_by_name.setdefault(h.file, h)
 
     def get_file(self, fn):
-        for h in self.hdrs:
-            if h.file == fn:
-                return self._get_file(h)
-        return None
+        """returns an ArFile (its data is read on demand) or None"""
+        hdr = self.hdrs_by_name.get(fn)
+        if hdr is None:
+            return None
+        return self._get_file(hdr)
 
     def __iter__(self):
         for h in self.hdrs:
             if h.file == '/':
                 continue
             yield self._get_file(h)
-        raise StopIteration()
@@ -1,12 +1,23 @@
 
 from __future__ import print_function
 
+import gzip
 import os.path
 import re
 import tarfile
-from . import packagequery
+from . import packagequery, rpmquery
 import subprocess
 
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 class ArchError(packagequery.PackageError):
     pass
 
@@ -21,13 +32,11 @@ class ArchQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
 
     def read(self, all_tags=True, self_provides=True, *extra_tags):
         # all_tags and *extra_tags are currently ignored
-        f = open(self.__path, 'rb')
-        #self.magic = f.read(5)
-        #if self.magic == '\375\067zXZ':
-        #    self.pkgsuffix = 'pkg.tar.xz'
-        fn = open('/dev/null', 'wb')
-        pipe = subprocess.Popen(['tar', '-O', '-xf', self.__path, '.PKGINFO'], stdout=subprocess.PIPE, stderr=fn).stdout
-        for line in pipe.readlines():
+        data = self.__read_pkginfo()
+        if not isinstance(data, str):
+            # python 3.x
+            data = data.decode('utf-8', 'replace')
+        for line in data.splitlines():
             line = line.rstrip().split(' = ', 2)
             if len(line) == 2:
                 if not line[0] in self.fields:
@@ -38,12 +47,48 @@ class ArchQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
             self.fields.setdefault('provides', []).append(prv)
         return self
 
+    def __read_pkginfo(self):
+        """
+        returns the content of the .PKGINFO. The package is decompressed
+        in-process and only up to the .PKGINFO (which is usually the first
+        member).
+        """
+        f = self.__file
+        f.seek(0)
+        magic = f.read(6)
+        f.seek(0)
+        if magic[:2] == b'\037\213':
+            fobj = gzip.GzipFile(fileobj=f, mode='rb')
+        elif magic == b'\375\067zXZ\0' and lzma is not None:
+            fobj = lzma.LZMAFile(f)
+        elif magic[:4] == b'\050\265\057\375' and zstandard is not None:
+            fobj = zstandard.ZstdDecompressor().stream_reader(f)
+        else:
+            # no python module for the compression
+            return self.__read_pkginfo_tar()
+        try:
+            tar = tarfile.open(fileobj=fobj, mode='r|')
+            for tarinfo in tar:
+                if tarinfo.name == '.PKGINFO':
+                    return tar.extractfile(tarinfo).read()
+        except (tarfile.TarError, EOFError, IOError) as e:
+            raise ArchError(self.__path, 'cannot read .PKGINFO: %s' % e)
+        raise ArchError(self.__path, 'missing .PKGINFO')
+
+    def __read_pkginfo_tar(self):
+        fn = open('/dev/null', 'wb')
+        try:
+            return subprocess.Popen(['tar', '-O', '-xf', self.__path, '.PKGINFO'],
+                                    stdout=subprocess.PIPE, stderr=fn).communicate()[0]
+        finally:
+            fn.close()
+
     def vercmp(self, archq):
-        res = cmp(int(self.epoch()), int(archq.epoch()))
+        res = packagequery.cmp(int(self.epoch() or 0), int(archq.epoch() or 0))
         if res != 0:
             return res
         res = ArchQuery.rpmvercmp(self.version(), archq.version())
-        if res != None:
+        if res != 0:
             return res
         res = ArchQuery.rpmvercmp(self.release(), archq.release())
         return res
@@ -133,48 +178,10 @@ class ArchQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
     def rpmvercmp(ver1, ver2):
         """
         implementation of RPM's version comparison algorithm
-        (as described in lib/rpmvercmp.c)
+        (as described in lib/rpmvercmp.c), but without the special
+        handling of '~'
         """
-        if ver1 == ver2:
-            return 0
-        res = 0
-        while res == 0:
-            # remove all leading non alphanumeric chars
-            ver1 = re.sub('^[^a-zA-Z0-9]*', '', ver1)
-            ver2 = re.sub('^[^a-zA-Z0-9]*', '', ver2)
-            if not (len(ver1) and len(ver2)):
-                break
-            # check if we have a digits segment
-            mo1 = re.match('(\d+)', ver1)
-            mo2 = re.match('(\d+)', ver2)
-            numeric = True
-            if mo1 is None:
-                mo1 = re.match('([a-zA-Z]+)', ver1)
-                mo2 = re.match('([a-zA-Z]+)', ver2)
-                numeric = False
-            # check for different types: alpha and numeric
-            if mo2 is None:
-                if numeric:
-                    return 1
-                return -1
-            seg1 = mo1.group(0)
-            ver1 = ver1[mo1.end(0):]
-            seg2 = mo2.group(1)
-            ver2 = ver2[mo2.end(1):]
-            if numeric:
-                # remove leading zeros
-                seg1 = re.sub('^0+', '', seg1)
-                seg2 = re.sub('^0+', '', seg2)
-                # longer digit segment wins - if both have the same length
-                # a simple ascii compare decides
-                res = len(seg1) - len(seg2) or cmp(seg1, seg2)
-            else:
-                res = cmp(seg1, seg2)
-        if res > 0:
-            return 1
-        elif res < 0:
-            return -1
-        return cmp(ver1, ver2)
+        return rpmquery.rpmvercmp(ver1, ver2, tilde=False)
 
     @staticmethod
     def filename(name, epoch, version, release, arch):
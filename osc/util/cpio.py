@@ -15,11 +15,13 @@
 
 from __future__ import print_function
 
+import errno
 import mmap
 import os
 import stat
 import struct
 import sys
+from io import BytesIO
 
 # workaround for python24
 if not hasattr(os, 'SEEK_SET'):
@@ -36,10 +38,14 @@ class CpioError(Exception):
     def __str__(self):
         return '%s: %s' % (self.file, self.msg)
 
-class CpioHdr:
+class CpioHdr(object):
     """
     Represents a cpio header ("New" portable format and CRC format).
     """
+    __slots__ = ('ino', 'mode', 'uid', 'gid', 'nlink', 'mtime', 'filesize',
+                 'dev_maj', 'dev_min', 'rdev_maj', 'rdev_min', 'namesize',
+                 'checksum', 'filename', 'dataoff')
+
     def __init__(self, mgc, ino, mode, uid, gid, nlink, mtime, filesize,
                  dev_maj, dev_min, rdev_maj, rdev_min, namesize, checksum,
                  off = -1, filename = ''):
@@ -47,25 +53,23 @@ class CpioHdr:
         All passed parameters are hexadecimal strings (not NUL terminated) except
         off and filename. They will be converted into normal ints.
         """
-        self.ino = ino
-        self.mode = mode
-        self.uid = uid
-        self.gid = gid
-        self.nlink = nlink
-        self.mtime = mtime
+        self.ino = int(ino, 16)
+        self.mode = int(mode, 16)
+        self.uid = int(uid, 16)
+        self.gid = int(gid, 16)
+        self.nlink = int(nlink, 16)
+        self.mtime = int(mtime, 16)
         # 0 indicates FIFO or dir
-        self.filesize = filesize
-        self.dev_maj = dev_maj
-        self.dev_min = dev_min
+        self.filesize = int(filesize, 16)
+        self.dev_maj = int(dev_maj, 16)
+        self.dev_min = int(dev_min, 16)
         # only needed for special block/char files
-        self.rdev_maj = rdev_maj
-        self.rdev_min = rdev_min
+        self.rdev_maj = int(rdev_maj, 16)
+        self.rdev_min = int(rdev_min, 16)
         # length of filename (inluding terminating NUL)
-        self.namesize = namesize
+        self.namesize = int(namesize, 16)
         # != 0 indicates CRC format (which we do not support atm)
-        self.checksum = checksum
-        for k, v in self.__dict__.items():
-            self.__dict__[k] = int(v, 16)
+        self.checksum = int(checksum, 16)
         self.filename = filename
         # data starts at dataoff and ends at dataoff+filesize
         self.dataoff = off
@@ -73,6 +77,42 @@ class CpioHdr:
     def __str__(self):
         return "%s %s %s %s" % (self.filename, self.filesize, self.namesize, self.dataoff)
 
+def _copy_range(src, off, size, dst, bufsize=65536):
+    """
+    copies size bytes, starting at offset off, from the file object src
+    to the file object dst. If possible, the data is copied in the kernel
+    (copy_file_range or sendfile) - otherwise it is copied in chunks of at
+    most bufsize bytes.
+    """
+    dst.flush()
+    for copy in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+        if copy is None or not size:
+            continue
+        try:
+            while size:
+                if copy is os.sendfile:
+                    n = copy(dst.fileno(), src.fileno(), off, size)
+                else:
+                    n = copy(src.fileno(), dst.fileno(), size, off)
+                if not n:
+                    raise OSError(errno.EIO, 'unexpected end of file')
+                off += n
+                size -= n
+            return
+        except OSError as e:
+            # not supported for these files - try the next method
+            if not e.errno in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+            # a partial copy leaves the file offset of dst behind
+            dst.seek(0, os.SEEK_END)
+    src.seek(off, os.SEEK_SET)
+    while size:
+        data = src.read(min(size, bufsize))
+        if not data:
+            raise IOError(errno.EIO, 'unexpected end of file')
+        dst.write(data)
+        size -= len(data)
+
 class CpioRead:
     """
     Represents a cpio archive.
@@ -89,15 +129,19 @@ class CpioRead:
     hdr_fmt = '6s8s8s8s8s8s8s8s8s8s8s8s8s8s'
     hdr_len = 110
 
-    def __init__(self, filename):
+    def __init__(self, filename, bufsize=65536):
         self.filename = filename
+        self.bufsize = bufsize
         self.format = -1
+        self.__fobj = None
         self.__file = None
         self._init_datastructs()
 
     def __del__(self):
         if self.__file:
             self.__file.close()
+        if self.__fobj:
+            self.__fobj.close()
 
     def __iter__(self):
         for h in self.hdrs:
@@ -105,6 +149,8 @@ class CpioRead:
 
     def _init_datastructs(self):
         self.hdrs = []
+        # filename -> hdr (the first member with this name wins)
+        self.hdrs_by_name = {}
 
     def _calc_padding(self, off):
         """
@@ -126,9 +172,10 @@ class CpioRead:
             raise NotImplementedError(msg)
         fn = os.path.join(dest, fn)
         f = open(fn, 'wb')
-        self.__file.seek(hdr.dataoff, os.SEEK_SET)
-        f.write(self.__file.read(hdr.filesize))
-        f.close()
+        try:
+            _copy_range(self.__fobj, hdr.dataoff, hdr.filesize, f, self.bufsize)
+        finally:
+            f.close()
         os.chmod(fn, hdr.mode)
         uid = hdr.uid
         if uid != os.geteuid() or os.geteuid() != 1:
@@ -139,19 +186,16 @@ class CpioRead:
         os.chown(fn, uid, gid)
 
     def _get_hdr(self, fn):
-        for h in self.hdrs:
-            if h.filename == fn:
-                return h
-        return None
+        return self.hdrs_by_name.get(fn)
 
     def read(self):
         if not self.__file:
-            self.__file = open(self.filename, 'rb')
+            self.__fobj = self.__file = open(self.filename, 'rb')
             try:
                 if sys.platform[:3] != 'win':
-                    self.__file = mmap.mmap(self.__file.fileno(), os.path.getsize(self.__file.name), prot = mmap.PROT_READ)
+                    self.__file = mmap.mmap(self.__fobj.fileno(), os.path.getsize(self.__fobj.name), prot = mmap.PROT_READ)
                 else:
-                    self.__file = mmap.mmap(self.__file.fileno(), os.path.getsize(self.__file.name))
+                    self.__file = mmap.mmap(self.__fobj.fileno(), os.path.getsize(self.__fobj.name))
             except EnvironmentError as e:
                 if e.errno == 19 or ( hasattr(e, 'winerror') and e.winerror == 5 ):
                     print('cannot use mmap to read the file, failing back to default', file=sys.stderr)
@@ -161,6 +205,9 @@ class CpioRead:
             self.__file.seek(0, os.SEEK_SET)
         self._init_datastructs()
         data = self.__file.read(6)
+        if not isinstance(data, str):
+            # python 3.x
+            data = data.decode('ascii', 'replace')
         self.format = data
         if not self.format in self.sfmt.values():
             raise CpioError(self.filename, '\'%s\' is not a supported cpio format' % self.format)
@@ -174,6 +221,8 @@ class CpioRead:
             data = struct.unpack(self.hdr_fmt, data)
             hdr = CpioHdr(*data)
             hdr.filename = self.__file.read(hdr.namesize - 1)
+            if not isinstance(hdr.filename, str):
+                hdr.filename = hdr.filename.decode('utf-8')
             if hdr.filename == 'TRAILER!!!':
                 break
             pos += hdr.namesize
@@ -181,6 +230,7 @@ class CpioRead:
                 pos += self._calc_padding(hdr.namesize + 110)
             hdr.dataoff = pos
             self.hdrs.append(hdr)
+            self.hdrs_by_name.setdefault(hdr.filename, hdr)
             pos += hdr.filesize + self._calc_padding(hdr.filesize)
 
     def copyin_file(self, filename, dest = None, new_fn = None):
@@ -206,51 +256,175 @@ class CpioRead:
         for h in self.hdrs:
             self._copyin_file(h, dest, h.filename)
 
+class CpioStreamRead:
+    """
+    Reads a cpio archive sequentially from a file object (for instance
+    a http response), so that the archive does not have to be stored
+    on disk. The data of a member has to be read (see read_data and
+    copyin_file) before the next header is requested - otherwise it
+    is skipped.
+    Supported formats:
+    * ascii SVR4 no CRC also called "new_ascii"
+    """
+
+    hdr_fmt = CpioRead.hdr_fmt
+    hdr_len = CpioRead.hdr_len
+
+    def __init__(self, fobj, filename='<stream>', bufsize=65536):
+        self.fobj = fobj
+        self.filename = filename
+        self.bufsize = bufsize
+        self.pos = 0
+        # unread data (and padding) of the current member
+        self._left = 0
+        self._padding = 0
+
+    def _read(self, size):
+        data = self.fobj.read(size)
+        # a decompressing file object may return less data than requested
+        while len(data) < size:
+            chunk = self.fobj.read(size - len(data))
+            if not chunk:
+                raise CpioError(self.filename, 'unexpected end of archive at offset %d' % self.pos)
+            data += chunk
+        self.pos += size
+        return data
+
+    def _skip(self, size):
+        while size:
+            size -= len(self._read(min(size, self.bufsize)))
+
+    def __iter__(self):
+        while True:
+            self._skip(self._left + self._padding)
+            self._left = self._padding = 0
+            data = self._read(self.hdr_len)
+            magic = data[:6]
+            if not isinstance(magic, str):
+                magic = magic.decode('ascii', 'replace')
+            if not magic in CpioRead.sfmt.values():
+                raise CpioError(self.filename, '\'%s\' is not a supported cpio format' % magic)
+            hdr = CpioHdr(*struct.unpack(self.hdr_fmt, data))
+            hdr.filename = self._read(hdr.namesize)[:-1]
+            if not isinstance(hdr.filename, str):
+                hdr.filename = hdr.filename.decode('utf-8')
+            self._skip((4 - ((self.hdr_len + hdr.namesize) % 4)) % 4)
+            if hdr.filename == 'TRAILER!!!':
+                return
+            hdr.dataoff = self.pos
+            self._left = hdr.filesize
+            self._padding = (4 - (hdr.filesize % 4)) % 4
+            yield hdr
+
+    def read_data(self):
+        """yields the data of the current member in chunks of at most bufsize bytes"""
+        while self._left:
+            data = self._read(min(self._left, self.bufsize))
+            self._left -= len(data)
+            yield data
+
+    def copyin_file(self, hdr, dest=None, new_fn=None):
+        """
+        saves the current member (hdr) to dest/new_fn (see
+        CpioRead.copyin_file). Only regular files are supported.
+        """
+        if not stat.S_ISREG(stat.S_IFMT(hdr.mode)):
+            msg = '\'%s\' is no regular file - only regular files are supported atm' % hdr.filename
+            raise NotImplementedError(msg)
+        fn = os.path.join(dest or os.getcwd(), new_fn or hdr.filename)
+        with open(fn, 'wb') as f:
+            for data in self.read_data():
+                f.write(data)
+        os.chmod(fn, hdr.mode)
+
 class CpioWrite:
-    """cpio archive small files in memory, using new style portable header format"""
+    """
+    Writes a cpio archive, using new style portable header format, to a file
+    object (for instance a file or socket.makefile('wb')). The headers and the
+    data are written immediately, so the archive is never kept in memory. If
+    no file object is passed, the archive is written to an in-memory buffer
+    (see get).
+    """
 
-    def __init__(self):
-        self.cpio = ''
+    def __init__(self, fobj=None, bufsize=65536):
+        self.fobj = fobj
+        if fobj is None:
+            self.fobj = BytesIO()
+        self.bufsize = bufsize
+        # number of bytes written so far (needed for the padding)
+        self.pos = 0
 
-    def add(self, name=None, content=None, perms=0x1a4, type=0x8000):
+    def _write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.fobj.write(data)
+        self.pos += len(data)
+
+    def _pad(self, align):
+        if self.pos % align:
+            self._write(b'\0' * (align - self.pos % align))
+
+    def _write_hdr(self, name, filesize, mode):
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
         namesize = len(name) + 1
-        if namesize % 2:
-            name += '\0'
-        filesize = len(content)
-        mode = perms | type
-
-        c = []
-        c.append('070701') # magic
-        c.append('%08X' % 0) # inode
-        c.append('%08X' % mode) # mode
-        c.append('%08X' % 0) # uid
-        c.append('%08X' % 0) # gid
-        c.append('%08X' % 0) # nlink
-        c.append('%08X' % 0) # mtime
-        c.append('%08X' % filesize)
-        c.append('%08X' % 0) # major
-        c.append('%08X' % 0) # minor
-        c.append('%08X' % 0) # rmajor
-        c.append('%08X' % 0) # rminor
-        c.append('%08X' % namesize)
-        c.append('%08X' % 0) # checksum
-
-        c.append(name + '\0')
-        c.append('\0' * (len(''.join(c)) % 4))
-
-        c.append(content)
-
-        c = ''.join(c)
-        if len(c) % 4:
-            c += '\0' * (4 - len(c) % 4)
-
-        self.cpio += c
+        hdr = '070701' # magic
+        hdr += '%08X' % 0 # inode
+        hdr += '%08X' % mode
+        hdr += '%08X' % 0 # uid
+        hdr += '%08X' % 0 # gid
+        hdr += '%08X' % 0 # nlink
+        hdr += '%08X' % 0 # mtime
+        hdr += '%08X' % filesize
+        hdr += '%08X' % 0 # major
+        hdr += '%08X' % 0 # minor
+        hdr += '%08X' % 0 # rmajor
+        hdr += '%08X' % 0 # rminor
+        hdr += '%08X' % namesize
+        hdr += '%08X' % 0 # checksum
+        self._write(hdr)
+        self._write(name + b'\0')
+        self._pad(4)
+
+    def add(self, name=None, content=None, perms=0x1a4, type=0x8000):
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        self._write_hdr(name, len(content), perms | type)
+        self._write(content)
+        self._pad(4)
+
+    def add_file(self, name, filename, perms=None):
+        """
+        adds the file filename as name. The data is copied in chunks of
+        at most bufsize bytes. If perms is None, the permissions of the
+        file are used.
+        """
+        with open(filename, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if perms is None:
+                perms = stat.S_IMODE(st.st_mode)
+            self._write_hdr(name, st.st_size, perms | stat.S_IFREG)
+            size = st.st_size
+            while size:
+                data = f.read(min(size, self.bufsize))
+                if not data:
+                    raise CpioError(filename, 'file shrunk while adding it to the archive')
+                self._write(data)
+                size -= len(data)
+        self._pad(4)
 
     def add_padding(self):
-        if len(self.cpio) % 512:
-            self.cpio += '\0' * (512 - len(self.cpio) % 512)
+        self._pad(512)
 
-    def get(self):
+    def finish(self):
+        """writes the trailer (the archive is complete afterwards)"""
         self.add('TRAILER!!!', '')
         self.add_padding()
-        return ''.join(self.cpio)
+
+    def get(self):
+        """
+        finishes the archive and returns it (only if it was written to
+        the in-memory buffer).
+        """
+        self.finish()
+        return self.fobj.getvalue()
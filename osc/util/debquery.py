@@ -2,10 +2,10 @@
 from __future__ import print_function
 
 from . import ar
+import io
 import os.path
 import re
 import tarfile
-import StringIO
 from . import packagequery
 
 HAVE_LZMA = True
@@ -34,30 +34,39 @@ class DebQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
         debbin = arfile.get_file('debian-binary')
         if debbin is None:
             raise DebError(self.__path, 'no debian binary')
-        if debbin.read() != '2.0\n':
+        if debbin.read() != b'2.0\n':
             raise DebError(self.__path, 'invalid debian binary format')
+        # the control.tar is streamed from the archive (the data.tar is
+        # not read at all)
         control = arfile.get_file('control.tar.gz')
         if control is not None:
-            # XXX: python2.4 relies on a name
-            tar = tarfile.open(name='control.tar.gz', fileobj=control)
+            tar = tarfile.open(fileobj=control, mode='r|gz')
+        elif arfile.get_file('control.tar') is not None:
+            tar = tarfile.open(fileobj=arfile.get_file('control.tar'), mode='r|')
         else:
             control = arfile.get_file('control.tar.xz')
             if control is None:
                 raise DebError(self.__path, 'missing control.tar')
-            if not HAVE_LZMA:
+            if 'xzopen' in tarfile.TarFile.OPEN_METH.values():
+                tar = tarfile.open(fileobj=control, mode='r|xz')
+            elif not HAVE_LZMA:
                 raise DebError(self.__path, 'can\'t open control.tar.xz without python-lzma')
-            decompressed = lzma.decompress(control.read())
-            tar = tarfile.open(name="control.tar.xz",
-                               fileobj=StringIO.StringIO(decompressed))
-        try:
-            name = './control'
-            # workaround for python2.4's tarfile module
-            if 'control' in tar.getnames():
-                name = 'control'
-            control = tar.extractfile(name)
-        except KeyError:
+            else:
+                # the control.tar.xz is small
+                decompressed = lzma.decompress(control.read())
+                tar = tarfile.open(fileobj=io.BytesIO(decompressed))
+        control = None
+        for tarinfo in tar:
+            if tarinfo.name in ('control', './control'):
+                control = tar.extractfile(tarinfo)
+                break
+        if control is None:
             raise DebError(self.__path,
                            'missing \'control\' file in control.tar')
+        control = io.BytesIO(control.read())
+        if str is not bytes:
+            # python 3.x
+            control = io.TextIOWrapper(control, encoding='utf-8', errors='replace')
         self.__parse_control(control, all_tags, self_provides, *extra_tags)
         return self
 
@@ -98,11 +107,11 @@ class DebQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
             self.fields['provides'].append('%s (= %s)' % (self.name(), '-'.join(versrel)))
 
     def vercmp(self, debq):
-        res = cmp(int(self.epoch()), int(debq.epoch()))
+        res = packagequery.cmp(int(self.epoch()), int(debq.epoch()))
         if res != 0:
             return res
         res = DebQuery.debvercmp(self.version(), debq.version())
-        if res != None:
+        if res != 0:
             return res
         res = DebQuery.debvercmp(self.release(), debq.release())
         return res
@@ -176,12 +185,13 @@ class DebQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
         # (found this nice approach in Build/Deb.pm (build package))
         ver1 = re.sub('(\d+)', lambda m: (32 * '0' + m.group(1))[-32:], ver1)
         ver2 = re.sub('(\d+)', lambda m: (32 * '0' + m.group(1))[-32:], ver2)
-        vers = map(lambda x, y: (x or '', y or ''), ver1, ver2)
+        # the shorter version is padded with '' (python 3.x's map stops early)
+        vers = [(ver1[i:i + 1], ver2[i:i + 1]) for i in range(max(len(ver1), len(ver2)))]
         for v1, v2 in vers:
             if v1 == v2:
                 continue
             if (v1.isalpha() and v2.isalpha()) or (v1.isdigit() and v2.isdigit()):
-                res = cmp(v1, v2)
+                res = packagequery.cmp(v1, v2)
                 if res != 0:
                     return res
             else:
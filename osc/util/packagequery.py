@@ -1,6 +1,21 @@
 
 from __future__ import print_function
 
+import json
+import multiprocessing
+import os
+import sys
+
+try:
+    import sqlite3
+except ImportError:
+    # no cache (see QueryCache)
+    sqlite3 = None
+
+def cmp(a, b):
+    """python 3.x has no cmp builtin"""
+    return (a > b) - (a < b)
+
 class PackageError(Exception):
     """base class for all package related errors"""
     def __init__(self, fname, msg):
@@ -29,16 +44,19 @@ class PackageQueries(dict):
         """
         self.__setitem__(query.name(), query)
 
+    @classmethod
+    def matches_architecture(cls, wanted_architecture, architecture):
+        """Returns True if a package of the architecture can be used for the
+        wanted architecture."""
+        return (architecture in [wanted_architecture, 'noarch', 'all', 'any']
+                or wanted_architecture in cls.architectureMap.get(architecture, []))
+
     def __setitem__(self, name, query):
         if name != query.name():
             raise ValueError("key '%s' does not match "
                              "package query name '%s'" % (name, query.name()))
 
-        architecture = query.arch()
-
-        if (architecture in [self.wanted_architecture, 'noarch', 'all', 'any']
-            or self.wanted_architecture in self.architectureMap.get(architecture,
-                                                                [])):
+        if self.matches_architecture(self.wanted_architecture, query.arch()):
             current_query = self.get(name)
 
             # if current query does not exist or is older than this new query
@@ -60,18 +78,18 @@ class PackageQuery:
         f.seek(0)
         extra_tags = ()
         pkgquery = None
-        if magic[:4] == '\xed\xab\xee\xdb':
+        if magic[:4] == b'\xed\xab\xee\xdb':
             from . import rpmquery
             pkgquery = rpmquery.RpmQuery(f)
             extra_tags = extra_rpmtags
-        elif magic == '!<arch>':
+        elif magic == b'!<arch>':
             from . import debquery
             pkgquery = debquery.DebQuery(f)
             extra_tags = extra_debtags
-        elif magic[:5] == '<?xml':
+        elif magic[:5] == b'<?xml':
             f.close()
             return None
-        elif magic[:5] == '\375\067zXZ' or magic[:2] == '\037\213':
+        elif magic[:5] == b'\375\067zXZ' or magic[:2] == b'\037\213' or magic[:4] == b'\050\265\057\375':
             from . import archquery
             pkgquery = archquery.ArchQuery(f)
         else:
@@ -85,15 +103,18 @@ class PackageQuery:
         f = open(filename, 'rb')
         magic = f.read(7)
         f.seek(0)
-        if magic[:4] == '\xed\xab\xee\xdb':
+        if magic[:4] == b'\xed\xab\xee\xdb':
             from . import rpmquery
             f.close()
             return rpmquery.RpmQuery.queryhdrmd5(filename)
         return None
 
 
-class PackageQueryResult:
+class PackageQueryResult(object):
     """abstract base class that represents the result of a package query"""
+    # allows __slots__ in subclasses
+    __slots__ = ()
+
     def name(self):
         raise NotImplementedError
 
@@ -159,18 +180,290 @@ class PackageQueryResult:
             evr = epoch + ":" + evr 
         return evr 
 
+class PackageQueryRecord(PackageQueryResult):
+    """Compact copy of the fields of a PackageQueryResult which are needed to
+    resolve dependencies. In contrast to a PackageQueryResult, it can be
+    pickled and serialized (see to_data)."""
+
+    fields = ('name', 'arch', 'epoch', 'version', 'release', 'provides',
+              'requires', 'conflicts', 'obsoletes', 'recommends', 'suggests',
+              'supplements', 'enhances')
+
+    __slots__ = ('__path', '__pkgtype', '__data')
+
+    def __init__(self, path, pkgtype, data):
+        """pkgtype is 'rpm', 'deb' or 'arch' and data is a dict which
+        maps the fields to their values"""
+        self.__path = path
+        self.__pkgtype = pkgtype
+        self.__data = data
+
+    @classmethod
+    def from_result(cls, pkgq):
+        pkgtype = {'DebQuery': 'deb', 'ArchQuery': 'arch'}.get(pkgq.__class__.__name__, 'rpm')
+        data = dict([(field, getattr(pkgq, field)()) for field in cls.fields])
+        return cls(pkgq.path(), pkgtype, data)
+
+    @classmethod
+    def from_data(cls, path, data):
+        return cls(path, data[0], data[1])
+
+    def to_data(self):
+        return [self.__pkgtype, self.__data]
+
+    def name(self):
+        return self.__data['name']
+
+    def version(self):
+        return self.__data['version']
+
+    def release(self):
+        return self.__data['release']
+
+    def epoch(self):
+        return self.__data['epoch']
+
+    def arch(self):
+        return self.__data['arch']
+
+    def description(self):
+        return None
+
+    def path(self):
+        return self.__path
+
+    def provides(self):
+        return self.__data['provides']
+
+    def requires(self):
+        return self.__data['requires']
+
+    def conflicts(self):
+        return self.__data['conflicts']
+
+    def obsoletes(self):
+        return self.__data['obsoletes']
+
+    def recommends(self):
+        return self.__data['recommends']
+
+    def suggests(self):
+        return self.__data['suggests']
+
+    def supplements(self):
+        return self.__data['supplements']
+
+    def enhances(self):
+        return self.__data['enhances']
+
+    def gettag(self, tag):
+        return None
+
+    def vercmp(self, pkgquery):
+        """compares the EVRs like the vercmp of the query class of the
+        package type"""
+        if self.__pkgtype == 'deb':
+            from .debquery import DebQuery
+            vercmp = DebQuery.debvercmp
+            res = cmp(int(self.epoch()), int(pkgquery.epoch()))
+        elif self.__pkgtype == 'arch':
+            from .archquery import ArchQuery
+            vercmp = ArchQuery.rpmvercmp
+            res = cmp(int(self.epoch() or 0), int(pkgquery.epoch() or 0))
+        else:
+            from .rpmquery import RpmQuery
+            vercmp = RpmQuery.rpmvercmp
+            res = vercmp(str(self.epoch()), str(pkgquery.epoch()))
+        if res != 0:
+            return res
+        res = vercmp(self.version(), pkgquery.version())
+        if res != 0:
+            return res
+        return vercmp(self.release(), pkgquery.release())
+
+class QueryCache:
+    """sqlite cache of query_many, which maps the (dev, inode, size,
+    mtime_ns) of a package to the data of its PackageQueryRecord"""
+
+    def __init__(self, fname):
+        self.db = None
+        if sqlite3 is None:
+            return
+        try:
+            self.db = sqlite3.connect(fname, timeout=30)
+            self.db.execute('CREATE TABLE IF NOT EXISTS pkgs (dev INTEGER, ino INTEGER, '
+                            'size INTEGER, mtime_ns INTEGER, data TEXT, '
+                            'PRIMARY KEY (dev, ino, size, mtime_ns))')
+        except sqlite3.Error:
+            # for instance, fname is not writable
+            self.db = None
+
+    @staticmethod
+    def key(path):
+        st = os.stat(path)
+        mtime_ns = getattr(st, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            # python 2.x
+            mtime_ns = int(st.st_mtime * 1000000000)
+        return (st.st_dev, st.st_ino, st.st_size, mtime_ns)
+
+    def get(self, key):
+        """returns a (found, data) tuple"""
+        if self.db is None:
+            return False, None
+        row = self.db.execute('SELECT data FROM pkgs WHERE dev = ? AND ino = ? AND '
+                              'size = ? AND mtime_ns = ?', key).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def update(self, entries, keep=None):
+        """stores the (key, data) entries. If keep is specified, all other
+        keys are removed."""
+        if self.db is None:
+            return
+        try:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO pkgs VALUES (?, ?, ?, ?, ?)',
+                                    [key + (json.dumps(data), ) for key, data in entries])
+                if keep is not None:
+                    keys = self.db.execute('SELECT dev, ino, size, mtime_ns FROM pkgs').fetchall()
+                    keep = set(keep)
+                    self.db.executemany('DELETE FROM pkgs WHERE dev = ? AND ino = ? AND '
+                                        'size = ? AND mtime_ns = ?',
+                                        [key for key in keys if not tuple(key) in keep])
+        except sqlite3.Error:
+            # for instance, the database is locked by another process
+            pass
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+def _query_data(path):
+    """queries path in a worker process of query_many"""
+    try:
+        pkgq = PackageQuery.query(path)
+    except PackageError as e:
+        # a PackageError cannot be unpickled
+        return None, (e.fname, e.msg)
+    if pkgq is None:
+        return None, None
+    return PackageQueryRecord.from_result(pkgq).to_data(), None
+
+def query_many(paths, jobs=None, cache=None, prune=False):
+    """Returns a list of PackageQueryRecords (None for a file which is no
+    package) for the packages in paths.
+
+    @param jobs number of worker processes which read the headers
+                (default: number of cpus)
+    @param cache filename of a QueryCache: only new or changed packages
+                 are read
+    @param prune if True, the packages which are not in paths are removed
+                 from the cache
+    @raise PackageError if a package cannot be read
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    keys = [QueryCache.key(path) for path in paths]
+    qcache = QueryCache(cache) if cache is not None else None
+    try:
+        data = {}
+        todo = []
+        queued = set()
+        for path, key in zip(paths, keys):
+            # a hardlinked package is only read once
+            if key in data or key in queued:
+                continue
+            found = False
+            if qcache is not None:
+                found, pkgdata = qcache.get(key)
+            if found:
+                data[key] = pkgdata
+            else:
+                todo.append((path, key))
+                queued.add(key)
+
+        if jobs > 1 and len(todo) > 1:
+            jobs = min(jobs, len(todo))
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = pool.map(_query_data, [path for path, key in todo],
+                                   chunksize=max(1, len(todo) // (jobs * 4)))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            results = [_query_data(path) for path, key in todo]
+
+        for (path, key), (pkgdata, error) in zip(todo, results):
+            if error is not None:
+                raise PackageError(*error)
+            data[key] = pkgdata
+
+        if qcache is not None:
+            qcache.update([(key, data[key]) for path, key in todo],
+                          keys if prune else None)
+    finally:
+        if qcache is not None:
+            qcache.close()
+
+    return [PackageQueryRecord.from_data(path, data[key]) if data[key] is not None else None
+            for path, key in zip(paths, keys)]
+
+package_suffixes = ('.rpm', '.deb', '.pkg.tar.xz', '.pkg.tar.gz', '.pkg.tar.zst')
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m osc.util.packagequery')
+    parser.add_argument('--json', action='store_true',
+                        help='print the name, arch, EVR and dependencies of the packages '
+                             'as a JSON list')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of cpus)')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='sqlite cache of the package headers')
+    parser.add_argument('paths', nargs='+', metavar='PATH',
+                        help='packages or directories (which are searched recursively)')
+    args = parser.parse_args(argv)
+    if not args.json:
+        if len(args.paths) != 1:
+            parser.error('only a single package can be queried without --json')
+        pkgq = PackageQuery.query(args.paths[0])
+        print(pkgq.name())
+        print(pkgq.version())
+        print(pkgq.release())
+        print(pkgq.description())
+        print('##########')
+        print('\n'.join(pkgq.provides()))
+        print('##########')
+        print('\n'.join(pkgq.requires()))
+        return
+    paths = []
+    for path in args.paths:
+        if not os.path.isdir(path):
+            paths.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            paths.extend([os.path.join(root, i) for i in sorted(files) if i.endswith(package_suffixes)])
+    res = []
+    for path, record in zip(paths, query_many(paths, jobs=args.jobs, cache=args.cache)):
+        if record is None:
+            continue
+        pkgtype, data = record.to_data()
+        data = dict(data, path=path, type=pkgtype)
+        res.append(data)
+    json.dump(res, sys.stdout, indent=1, sort_keys=True)
+    print()
+
 if __name__ == '__main__':
-    import sys
     try:
-        pkgq = PackageQuery.query(sys.argv[1])
+        main(sys.argv[1:])
     except PackageError as e:
         print(e.msg)
         sys.exit(2)
-    print(pkgq.name())
-    print(pkgq.version())
-    print(pkgq.release())
-    print(pkgq.description())
-    print('##########')
-    print('\n'.join(pkgq.provides()))
-    print('##########')
-    print('\n'.join(pkgq.requires()))
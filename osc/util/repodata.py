@@ -47,46 +47,98 @@ def primaryPath(directory):
 
     return primaryPath
 
-def queries(directory):
-    """Returns a list of RepoDataQueries constructed from the repodata under
-    the directory.
+def iterqueries(directory, wanted_architecture=None):
+    """Yields the RepoDataQueryResults of the packages in the repodata under
+    the directory. The primary repository data file is parsed incrementally,
+    so that only one package element is kept in memory at a time.
 
     @param directory path to a repository directory (parent directory of
                      repodata directory)
-    @return list of RepoDataQueryResult instances
+    @param wanted_architecture if specified, only packages which match it
+                               (see PackageQueries.matches_architecture)
+                               are yielded
     @raise IOError if repomd.xml contains no primary location
     """
     path = primaryPath(directory)
+    directory = os.path.abspath(directory)
+    packageTag = namespace("common") + "package"
+    archTag = namespace("common") + "arch"
 
     gunzippedPrimary = gzip.GzipFile(path)
-    elementTree = ET.parse(gunzippedPrimary)
-    root = elementTree.getroot()
-
-    packageQueries = []
-    for packageElement in root:
-        packageQuery = RepoDataQueryResult(directory, packageElement)
-        packageQueries.append(packageQuery)
+    try:
+        root = None
+        for event, element in ET.iterparse(gunzippedPrimary, events=("start", "end")):
+            if root is None:
+                root = element
+            if event != "end" or element.tag != packageTag:
+                continue
+            architecture = element.findtext(archTag)
+            if (wanted_architecture is None or
+                osc.util.packagequery.PackageQueries.matches_architecture(
+                    wanted_architecture, architecture)):
+                yield RepoDataQueryResult(directory, element)
+            # drop the already parsed packages
+            root.clear()
+    finally:
+        gunzippedPrimary.close()
+
+def queries(directory, wanted_architecture=None):
+    """Returns a list of RepoDataQueries constructed from the repodata under
+    the directory.
 
-    return packageQueries
+    @param directory path to a repository directory (parent directory of
+                     repodata directory)
+    @param wanted_architecture if specified, only packages which match it
+                               are returned
+    @return list of RepoDataQueryResult instances
+    @raise IOError if repomd.xml contains no primary location
+    """
+    return list(iterqueries(directory, wanted_architecture))
 
 class RepoDataQueryResult(osc.util.packagequery.PackageQueryResult):
     """PackageQueryResult that reads in data from the repodata directory files."""
 
+    # a full distribution repository has tens of thousands of packages
+    __slots__ = ('__directory', '__name', '__arch', '__epoch', '__version',
+                 '__release', '__description', '__location', '__collections')
+
+    collections = ('provides', 'requires', 'conflicts', 'obsoletes',
+                   'recommends', 'suggests', 'supplements', 'enhances')
+
     def __init__(self, directory, element):
         """Creates a RepoDataQueryResult from the a package Element under a metadata
-        Element in a primary.xml file.
+        Element in a primary.xml file. The Element is only read during
+        construction (it can be cleared afterwards).
 
         @param directory repository directory path.  Used to convert relative
                          paths to full paths.
         @param element package Element
         """
         self.__directory = os.path.abspath(directory)
-        self.__element = element
-
-    def __formatElement(self):
-        return self.__element.find(namespace("common") + "format")
-
-    def __parseEntry(self, element):
+        self.__name = element.findtext(namespace("common") + "name")
+        self.__arch = element.findtext(namespace("common") + "arch")
+        self.__description = element.findtext(namespace("common") + "description")
+        versionElement = element.find(namespace("common") + "version")
+        self.__epoch = versionElement.get("epoch")
+        self.__version = versionElement.get("ver")
+        self.__release = versionElement.get("rel")
+        self.__location = element.find(namespace("common") + "location").get("href")
+
+        # only the non-empty collections are stored
+        self.__collections = {}
+        formatElement = element.find(namespace("common") + "format")
+        if formatElement is not None:
+            for collection in self.collections:
+                collectionElement = formatElement.find(namespace("rpm") + collection)
+                if collectionElement is None:
+                    continue
+                entries = tuple([self.__parseEntry(entryElement)
+                                 for entryElement in collectionElement.findall(namespace("rpm") + "entry")])
+                if entries:
+                    self.__collections[collection] = entries
+
+    @staticmethod
+    def __parseEntry(element):
         entry = element.get("name")
         flags = element.get("flags")
 
@@ -102,48 +154,31 @@ class RepoDataQueryResult(osc.util.packagequery.PackageQueryResult):
         return entry
 
     def __parseEntryCollection(self, collection):
-        formatElement = self.__formatElement()
-        collectionElement = formatElement.find(namespace("rpm") + collection)
-
-        entries = []
-        if collectionElement is not None:
-            for entryElement in collectionElement.findall(namespace("rpm") +
-                                                          "entry"):
-                entry = self.__parseEntry(entryElement)
-                entries.append(entry)
-
-        return entries
-
-    def __versionElement(self):
-        return self.__element.find(namespace("common") + "version")
+        return list(self.__collections.get(collection, ()))
 
     def arch(self):
-        return self.__element.find(namespace("common") + "arch").text
+        return self.__arch
 
     def description(self):
-        return self.__element.find(namespace("common") + "description").text
+        return self.__description
 
     def distribution(self):
         return None
 
     def epoch(self):
-        return self.__versionElement().get("epoch")
+        return self.__epoch
 
     def name(self):
-        return self.__element.find(namespace("common") + "name").text
+        return self.__name
 
     def path(self):
-        locationElement = self.__element.find(namespace("common") + "location")
-        relativePath = locationElement.get("href")
-        absolutePath = os.path.join(self.__directory, relativePath)
-
-        return absolutePath
+        return os.path.join(self.__directory, self.__location)
 
     def provides(self):
         return self.__parseEntryCollection("provides")
 
     def release(self):
-        return self.__versionElement().get("rel")
+        return self.__release
 
     def requires(self):
         return self.__parseEntryCollection("requires")
@@ -185,4 +220,4 @@ class RepoDataQueryResult(osc.util.packagequery.PackageQueryResult):
         return res
 
     def version(self):
-        return self.__versionElement().get("ver")
+        return self.__version
@@ -4,8 +4,19 @@ from __future__ import print_function
 import os
 import re
 import struct
+import sys
 from . import packagequery
 
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 class RpmError(packagequery.PackageError):
     pass
 
@@ -14,20 +25,24 @@ class RpmHeaderError(RpmError):
 
 class RpmHeader:
     """corresponds more or less to the indexEntry_s struct"""
-    def __init__(self, offset, length):
+    def __init__(self, offset, length, path=None):
         self.offset = offset
         # length of the data section (without length of indexEntries)
         self.length = length
         self.entries = []
+        self.tags = {}
+        # the data section (the entries are decoded on demand)
+        self.data = None
+        self.path = path
 
     def append(self, entry):
         self.entries.append(entry)
+        entry.header = self
+        # the first entry wins (if a tag occurs more than once)
+        self.tags.setdefault(entry.tag, entry)
 
     def gettag(self, tag):
-        for i in self.entries:
-            if i.tag == tag:
-                return i
-        return None
+        return self.tags.get(tag)
 
     def __iter__(self):
         for i in self.entries:
@@ -36,17 +51,79 @@ class RpmHeader:
     def __len__(self):
         return len(self.entries)
 
-class RpmHeaderEntry:
+    def decode(self, entry):
+        data = self.data
+        off = entry.offset
+        cnt = entry.count
+        if entry.type == 2:
+            return struct.unpack_from('!%dc' % cnt, data, off)
+        elif entry.type == 3:
+            return struct.unpack_from('!%dh' % cnt, data, off)
+        elif entry.type == 4:
+            return struct.unpack_from('!%di' % cnt, data, off)
+        elif entry.type == 5:
+            return struct.unpack_from('!%dq' % cnt, data, off)
+        elif entry.type == 6:
+            return unpack_string(data, off)
+        elif entry.type == 7:
+            return data[off:off + cnt]
+        elif entry.type == 8 or entry.type == 9:
+            strings = []
+            while cnt > 0:
+                cnt -= 1
+                end = data.index(b'\0', off)
+                strings.append(_decode(data[off:end]))
+                # also skip '\0'
+                off = end + 1
+            if entry.type == 8:
+                return strings
+            lang = os.getenv('LANGUAGE') or os.getenv('LC_ALL') \
+                or os.getenv('LC_MESSAGES') or os.getenv('LANG')
+            if lang is None:
+                return strings[0]
+            # get private i18n table
+            table = self.gettag(100)
+            # just care about the country code
+            lang = lang.split('_', 1)[0]
+            for i, l in enumerate(table.data[:len(strings)]):
+                if l == lang:
+                    return strings[i]
+            return strings[0]
+        raise RpmHeaderError(self.path, 'unsupported tag type \'%d\' (tag: \'%s\'' % (entry.type, entry.tag))
+
+class RpmHeaderEntry(object):
     """corresponds to the entryInfo_s struct (except the data attribute)"""
 
     # each element represents an int
     ENTRY_SIZE = 16
+
+    __slots__ = ('tag', 'type', 'offset', 'count', 'header', '_data')
+
+    # marks a not yet decoded entry
+    _undecoded = object()
+
     def __init__(self, tag, type, offset, count):
         self.tag = tag
         self.type = type
         self.offset = offset
         self.count = count
-        self.data = None
+        self.header = None
+        self._data = self._undecoded
+
+    @property
+    def data(self):
+        """the decoded data (it is decoded on first access)"""
+        if self._data is self._undecoded:
+            self._data = None
+            try: # this may fail for -debug* packages
+                self._data = self.header.decode(self)
+            except Exception:
+                pass
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
 
 class RpmQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
     LEAD_SIZE = 96
@@ -80,6 +157,8 @@ class RpmQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
 
     def read(self, all_tags=False, self_provides=True, *extra_tags, **extra_kw):
         # self_provides is unused because a rpm always has a self provides
+        # all_tags and extra_tags are unused because the tags are decoded
+        # on demand (see RpmHeaderEntry.data)
         self.__read_lead()
         data = self.__file.read(RpmHeaderEntry.ENTRY_SIZE)
         hdrmgc, reserved, il, dl = struct.unpack('!I3i', data)
@@ -94,79 +173,33 @@ class RpmQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
             self.__file.read(pad)
             data = self.__file.read(RpmHeaderEntry.ENTRY_SIZE)
         hdrmgc, reserved, il, dl = struct.unpack('!I3i', data)
-        self.header = RpmHeader(pad, dl)
+        self.header = RpmHeader(pad, dl, self.__path)
         if self.HEADER_MAGIC != hdrmgc:
             raise RpmHeaderError(self.__path, 'invalid headermagic \'%s\'' % hdrmgc)
         data = self.__file.read(il * RpmHeaderEntry.ENTRY_SIZE)
-        while len(data) > 0:
-            ei = struct.unpack('!4i', data[:RpmHeaderEntry.ENTRY_SIZE])
-            self.header.append(RpmHeaderEntry(*ei))
-            data = data[RpmHeaderEntry.ENTRY_SIZE:]
-        data = self.__file.read(self.header.length)
-        for i in self.header:
-            if i.tag in self.default_tags + extra_tags or all_tags:
-                try: # this may fail for -debug* packages
-                    self.__read_data(i, data)
-                except: pass
+        if len(data) != il * RpmHeaderEntry.ENTRY_SIZE:
+            raise RpmHeaderError(self.__path, 'truncated header')
+        ei = struct.unpack('!%di' % (4 * il), data)
+        for i in range(0, len(ei), 4):
+            self.header.append(RpmHeaderEntry(*ei[i:i + 4]))
+        self.header.data = self.__file.read(self.header.length)
         return self
 
     def __read_lead(self):
         data = self.__file.read(self.LEAD_SIZE)
-        leadmgc, = struct.unpack('!I', data[:4])
+        if len(data) != self.LEAD_SIZE:
+            raise RpmError(self.__path, 'truncated lead')
+        leadmgc, = struct.unpack_from('!I', data)
         if leadmgc != self.LEAD_MAGIC:
             raise RpmError(self.__path, 'invalid lead magic \'%s\'' % leadmgc)
-        sigtype, = struct.unpack('!h', data[78:80])
+        sigtype, = struct.unpack_from('!h', data, 78)
         if sigtype != self.HEADERSIG_TYPE:
             raise RpmError(self.__path, 'invalid header signature \'%s\'' % sigtype)
 
-    def __read_data(self, entry, data):
-        off = entry.offset
-        if entry.type == 2:
-            entry.data = struct.unpack('!%dc' % entry.count, data[off:off + 1 * entry.count])
-        if entry.type == 3:
-            entry.data = struct.unpack('!%dh' % entry.count, data[off:off + 2 * entry.count])
-        elif entry.type == 4:
-            entry.data = struct.unpack('!%di' % entry.count, data[off:off + 4 * entry.count])
-        elif entry.type == 6:
-            entry.data = unpack_string(data[off:])
-        elif entry.type == 7:
-            entry.data = data[off:off + entry.count]
-        elif entry.type == 8 or entry.type == 9:
-            cnt = entry.count
-            entry.data = []
-            while cnt > 0:
-                cnt -= 1
-                s = unpack_string(data[off:])
-                # also skip '\0'
-                off += len(s) + 1
-                entry.data.append(s)
-            if entry.type == 8:
-                return
-            lang = os.getenv('LANGUAGE') or os.getenv('LC_ALL') \
-                or os.getenv('LC_MESSAGES') or os.getenv('LANG')
-            if lang is None:
-                entry.data = entry.data[0]
-                return
-            # get private i18n table
-            table = self.header.gettag(100)
-            # just care about the country code
-            lang = lang.split('_', 1)[0]
-            cnt = 0
-            for i in table.data:
-                if cnt > len(entry.data) - 1:
-                    break
-                if i == lang:
-                    entry.data = entry.data[cnt]
-                    return
-                cnt += 1
-            entry.data = entry.data[0]
-        else:
-            raise RpmHeaderError(self.__path, 'unsupported tag type \'%d\' (tag: \'%s\'' % (entry.type, entry.tag))
-
     def __reqprov(self, tag, flags, version, strong=None):
         pnames = self.header.gettag(tag)
         if not pnames:
-	    return []
+            return []
         pnames = pnames.data
         pflags = self.header.gettag(flags).data
         pvers = self.header.gettag(version).data
@@ -281,6 +314,28 @@ class RpmQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
     def gettag(self, num):
         return self.header.gettag(num)
 
+    def payload(self):
+        """
+        returns a file object for the decompressed (cpio) payload. read()
+        has to be called first, because the payload starts right after
+        the header. Raises a RpmError if the payload compressor
+        (PAYLOADCOMPRESSOR = 1125) is not supported.
+        """
+        compressor = self.gettag(1125)
+        compressor = compressor.data if compressor is not None else 'gzip'
+        if compressor == 'gzip':
+            import gzip
+            return gzip.GzipFile(fileobj=self.__file, mode='rb')
+        elif compressor == 'bzip2' and sys.version_info[0] >= 3:
+            # python 2.x's BZ2File cannot read from a file object
+            import bz2
+            return bz2.BZ2File(self.__file)
+        elif compressor in ('xz', 'lzma') and lzma is not None:
+            return lzma.LZMAFile(self.__file)
+        elif compressor == 'zstd' and zstandard is not None:
+            return zstandard.ZstdDecompressor().stream_reader(self.__file)
+        raise RpmError(self.__path, 'unsupported payload compressor \'%s\'' % compressor)
+
     def canonname(self):
         if self.is_nosrc():
             arch = 'nosrc'
@@ -302,7 +357,7 @@ class RpmQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
     def queryhdrmd5(filename):
         f = open(filename, 'rb')
         rpmq = RpmQuery(f)
-        rpmq.read(1004, querysig=True)
+        rpmq.read(querysig=True)
         f.close()
         entry = rpmq.gettag(1004)
         if entry is None:
@@ -315,71 +370,69 @@ class RpmQuery(packagequery.PackageQuery, packagequery.PackageQueryResult):
         implementation of RPM's version comparison algorithm
         (as described in lib/rpmvercmp.c)
         """
-        if ver1 == ver2:
-            return 0
-        res = 0
-        while res == 0:
-            # remove all leading non alphanumeric or tilde chars
-            ver1 = re.sub('^[^a-zA-Z0-9~]*', '', ver1)
-            ver2 = re.sub('^[^a-zA-Z0-9~]*', '', ver2)
-            if ver1.startswith('~') or ver2.startswith('~'):
-                if not ver1.startswith('~'):
-                    return 1
-                elif not ver2.startswith('~'):
-                    return -1
-                ver1 = ver1[1:]
-                ver2 = ver2[1:]
-                continue
-
-            if not (len(ver1) and len(ver2)):
-                break
-
-            # check if we have a digits segment
-            mo1 = re.match('(\d+)', ver1)
-            mo2 = re.match('(\d+)', ver2)
-            numeric = True
-            if mo1 is None:
-                mo1 = re.match('([a-zA-Z]+)', ver1)
-                mo2 = re.match('([a-zA-Z]+)', ver2)
-                numeric = False
-            # check for different types: alpha and numeric
-            if mo2 is None:
-                if numeric:
-                    return 1
-                return -1
-            seg1 = mo1.group(0)
-            ver1 = ver1[mo1.end(0):]
-            seg2 = mo2.group(1)
-            ver2 = ver2[mo2.end(1):]
-            if numeric:
-                # remove leading zeros
-                seg1 = re.sub('^0+', '', seg1)
-                seg2 = re.sub('^0+', '', seg2)
-                # longer digit segment wins - if both have the same length
-                # a simple ascii compare decides
-                res = len(seg1) - len(seg2) or cmp(seg1, seg2)
-            else:
-                res = cmp(seg1, seg2)
-        if res > 0:
-            return 1
-        elif res < 0:
-            return -1
-        return cmp(ver1, ver2)
+        return rpmvercmp(ver1, ver2)
 
     @staticmethod
     def filename(name, epoch, version, release, arch):
         return '%s-%s-%s.%s.rpm' % (name, version, release, arch)
 
-def unpack_string(data):
-    """unpack a '\\0' terminated string from data"""
-    val = ''
-    for c in data:
-        c, = struct.unpack('!c', c)
-        if c == '\0':
-            break
+# the segments of a version (all other chars are separators)
+_segment_re = {True: re.compile('~|[0-9]+|[a-zA-Z]+'),
+               False: re.compile('[0-9]+|[a-zA-Z]+')}
+# maps (version, tilde) to its version_key
+_version_keys = {}
+
+def version_key(ver, tilde=True):
+    """
+    returns a tuple which sorts exactly like ver is ordered by rpmvercmp,
+    for instance, sorted(versions, key=version_key). If tilde is False, a
+    '~' is just a separator (and does not sort before everything else).
+    """
+    key = _version_keys.get((ver, tilde))
+    if key is not None:
+        return key
+    key = []
+    for seg in _segment_re[tilde].findall(ver):
+        # a '~' sorts before the end of a version, which sorts before
+        # an alpha segment, which sorts before a digit segment
+        if seg == '~':
+            key.append((0, ''))
+        elif seg.isdigit():
+            key.append((3, int(seg)))
         else:
-            val += c
-    return val
+            key.append((2, seg))
+    key.append((1, ''))
+    key = tuple(key)
+    if len(_version_keys) > 100000:
+        _version_keys.clear()
+    _version_keys[(ver, tilde)] = key
+    return key
+
+def evr_key(epoch, version, release):
+    """returns a tuple which sorts like RpmQuery.vercmp orders packages"""
+    return (version_key(str(epoch)), version_key(version), version_key(release))
+
+def rpmvercmp(ver1, ver2, tilde=True):
+    """
+    implementation of RPM's version comparison algorithm
+    (as described in lib/rpmvercmp.c), see also version_key
+    """
+    if ver1 == ver2:
+        return 0
+    return packagequery.cmp(version_key(ver1, tilde), version_key(ver2, tilde))
+
+def _decode(data):
+    if str is bytes:
+        # python 2.x
+        return data
+    return data.decode('utf-8', 'surrogateescape')
+
+def unpack_string(data, offset=0):
+    """unpack a '\\0' terminated string from data (starting at offset)"""
+    end = data.find(b'\0', offset)
+    if end == -1:
+        end = len(data)
+    return _decode(data[offset:end])
 
 if __name__ == '__main__':
     import sys
@@ -149,6 +149,8 @@ class OscTestCase(unittest.TestCase):
                                  override_no_keyring=True, override_no_gnome_keyring=True)
         os.environ['OSC_CONFIG'] = oscrc
 
+        # the tests chdir into the tmpdir (see tearDown)
+        self.cwd = os.getcwd()
         self.tmpdir = tempfile.mkdtemp(prefix='osc_test')
         if copytree:
             shutil.copytree(os.path.join(self._get_fixtures_dir(), 'osctest'), os.path.join(self.tmpdir, 'osctest'))
@@ -159,6 +161,7 @@ class OscTestCase(unittest.TestCase):
         sys.stdout = StringIO()
 
     def tearDown(self):
+        os.chdir(self.cwd)
         self.assertTrue(len(EXPECTED_REQUESTS) == 0)
         sys.stdout = self.stdout
         try:
@@ -23,6 +23,16 @@ import test_request
 import test_setlinkrev
 import test_prdiff
 import test_conf
+import test_storev2
+import test_cpio
+import test_cache
+import test_repodata
+import test_packagequery
+import test_debquery
+import test_archquery
+import test_serviceinfo
+import test_fetch
+import test_build
 
 suite = unittest.TestSuite()
 suite.addTests(test_addfiles.suite())
@@ -40,6 +50,16 @@ suite.addTests(test_request.suite())
 suite.addTests(test_setlinkrev.suite())
 suite.addTests(test_prdiff.suite())
 suite.addTests(test_conf.suite())
+suite.addTests(test_storev2.suite())
+suite.addTests(test_cpio.suite())
+suite.addTests(test_cache.suite())
+suite.addTests(test_repodata.suite())
+suite.addTests(test_packagequery.suite())
+suite.addTests(test_debquery.suite())
+suite.addTests(test_archquery.suite())
+suite.addTests(test_serviceinfo.suite())
+suite.addTests(test_fetch.suite())
+suite.addTests(test_build.suite())
 
 if have_xmlrunner:
     result = xmlrunner.XMLTestRunner(output=os.path.join(os.getcwd(), 'junit-xml-results')).run(suite)
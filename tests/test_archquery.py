@@ -0,0 +1,75 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from osc.util import archquery, packagequery
+
+def suite():
+    return unittest.makeSuite(TestArchQuery)
+
+PKGINFO = b"""# Generated by makepkg
+pkgname = foo
+pkgver = 1:1.0-2
+pkgdesc = foo package
+arch = x86_64
+depend = glibc
+depend = bar>=1.0
+optdepend = baz: for the baz feature
+"""
+
+class TestArchQuery(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test_archquery')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_pkg(self, fname, mode, pkginfo=PKGINFO):
+        fname = os.path.join(self.tmpdir, fname)
+        tar = tarfile.open(fname, mode)
+        for name, data in (('.PKGINFO', pkginfo), ('usr/bin/foo', b'x' * 4096)):
+            if data is None:
+                continue
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+        tar.close()
+        return fname
+
+    def _check(self, fname):
+        archq = packagequery.PackageQuery.query(fname)
+        self.assertEqual(archq.name(), 'foo')
+        self.assertEqual(archq.epoch(), '1')
+        self.assertEqual(archq.version(), '1.0')
+        self.assertEqual(archq.arch(), 'x86_64')
+        self.assertEqual(archq.description(), 'foo package')
+        self.assertEqual(archq.requires(), ['glibc', 'bar>=1.0'])
+        self.assertEqual(archq.suggests(), ['baz'])
+        self.assertEqual(archq.provides(), ['foo = 1:1.0-2'])
+
+    def test_gz(self):
+        self._check(self._write_pkg('foo-1:1.0-2-x86_64.pkg.tar.gz', 'w:gz'))
+
+    @unittest.skipIf(archquery.lzma is None, 'no lzma module')
+    def test_xz(self):
+        self._check(self._write_pkg('foo-1:1.0-2-x86_64.pkg.tar.xz', 'w:xz'))
+
+    def test_missing_pkginfo(self):
+        fname = self._write_pkg('foo-1.0-2-x86_64.pkg.tar.gz', 'w:gz', pkginfo=None)
+        self.assertRaises(archquery.ArchError, packagequery.PackageQuery.query, fname)
+
+    def test_vercmp(self):
+        """a package without an epoch"""
+        fname1 = self._write_pkg('foo-1.0-2-x86_64.pkg.tar.gz', 'w:gz',
+                                 PKGINFO.replace(b'1:1.0-2', b'1.0-2'))
+        fname2 = self._write_pkg('foo-1.0-3-x86_64.pkg.tar.gz', 'w:gz',
+                                 PKGINFO.replace(b'1:1.0-2', b'1.0-3'))
+        archq1 = packagequery.PackageQuery.query(fname1)
+        archq2 = packagequery.PackageQuery.query(fname2)
+        self.assertEqual(archq1.vercmp(archq2), -1)
+
+if __name__ == '__main__':
+    unittest.main()
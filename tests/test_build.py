@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from osc import build
+except ImportError:
+    # urlgrabber is not installed
+    build = None
+
+def suite():
+    return unittest.makeSuite(TestKeepBuiltFiles)
+
+@unittest.skipIf(build is None, 'urlgrabber is not installed')
+class TestKeepBuiltFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test_build')
+        self.pacdir = os.path.join(self.tmpdir, 'packages')
+        self.destdir = os.path.join(self.tmpdir, 'keep')
+        os.makedirs(os.path.join(self.pacdir, 'RPMS', 'x86_64'))
+        os.makedirs(os.path.join(self.pacdir, 'SRPMS'))
+        os.mkdir(self.destdir)
+        self.rpm = self._write(os.path.join('RPMS', 'x86_64', 'foo-1.0-1.x86_64.rpm'), 'foo')
+        self._write(os.path.join('SRPMS', 'foo-1.0-1.src.rpm'), 'src')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, data):
+        fname = os.path.join(self.pacdir, name)
+        with open(fname, 'w') as f:
+            f.write(data)
+        return fname
+
+    def _keep(self):
+        s_built, b_built = build.get_built_files(self.pacdir, 'spec', digest=True)
+        copied = []
+        copy2 = build.shutil.copy2
+        def copy(src, dest):
+            copied.append(os.path.basename(src))
+            copy2(src, dest)
+        build.shutil.copy2 = copy
+        try:
+            build.keep_built_files(b_built + s_built, self.destdir)
+        finally:
+            build.shutil.copy2 = copy2
+        return sorted(copied)
+
+    def test_keep_built_files(self):
+        """an identical file is not copied again"""
+        self.assertEqual(self._keep(), ['foo-1.0-1.src.rpm', 'foo-1.0-1.x86_64.rpm'])
+        self.assertEqual(self._keep(), [])
+        # same content, but a different mtime (for instance, a rebuild)
+        st = os.stat(self.rpm)
+        os.utime(self.rpm, (st.st_atime, st.st_mtime + 10))
+        self.assertEqual(self._keep(), [])
+        # same size, but a different content
+        self._write(os.path.join('RPMS', 'x86_64', 'foo-1.0-1.x86_64.rpm'), 'bar')
+        os.utime(self.rpm, (st.st_atime, st.st_mtime + 20))
+        self.assertEqual(self._keep(), ['foo-1.0-1.x86_64.rpm'])
+        with open(os.path.join(self.destdir, 'foo-1.0-1.x86_64.rpm')) as f:
+            self.assertEqual(f.read(), 'bar')
+
+if __name__ == '__main__':
+    unittest.main()
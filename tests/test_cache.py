@@ -0,0 +1,192 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import osc.core
+from osc import cache
+from osc.cache import CacheIndex
+
+def suite():
+    s = unittest.makeSuite(TestCacheIndex)
+    s.addTests(unittest.makeSuite(TestCachePrune))
+    return s
+
+class TestCacheIndex(unittest.TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp(prefix='osc_test_cache')
+        self.pkgdir = os.path.join(self.cachedir, 'prj', 'repo', 'x86_64')
+        os.makedirs(self.pkgdir)
+        self.fname = os.path.join(self.pkgdir, 'foo.tar')
+        self._write(self.fname, 'foo')
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def _write(self, fname, data):
+        with open(fname, 'w') as f:
+            f.write(data)
+
+    def test_hdrmd5(self):
+        """the hdrmd5 is computed once and read from the index afterwards"""
+        index = CacheIndex(self.cachedir)
+        self.assertEqual(index.hdrmd5(self.fname, container=True), osc.core.dgst(self.fname))
+        index.save()
+        index = CacheIndex(self.cachedir)
+        # a stat call is sufficient
+        index.compute_hdrmd5 = None
+        self.assertEqual(index.hdrmd5(self.fname, container=True), osc.core.dgst(self.fname))
+        self.assertEqual(list(index.entries.keys()), [os.path.join('prj', 'repo', 'x86_64', 'foo.tar')])
+
+    def test_changed_file(self):
+        """the hdrmd5 of a changed file is computed again"""
+        index = CacheIndex(self.cachedir)
+        index.add(self.fname, 'abc')
+        self.assertEqual(index.hdrmd5(self.fname, container=True), 'abc')
+        self._write(self.fname, 'foobar')
+        self.assertEqual(index.hdrmd5(self.fname, container=True), osc.core.dgst(self.fname))
+
+    def test_missing_file(self):
+        index = CacheIndex(self.cachedir)
+        self.assertEqual(index.hdrmd5(os.path.join(self.pkgdir, 'bar.tar')), None)
+
+    def test_save_merge(self):
+        """the entries of a concurrently written index are kept (unless they were removed)"""
+        bar = os.path.join(self.pkgdir, 'bar.tar')
+        self._write(bar, 'bar')
+        index1 = CacheIndex(self.cachedir)
+        index2 = CacheIndex(self.cachedir)
+        index1.add(self.fname, 'foo')
+        index1.save()
+        index2.add(bar, 'bar')
+        index2.save()
+        index = CacheIndex(self.cachedir)
+        self.assertEqual(index.hdrmd5(self.fname), 'foo')
+        self.assertEqual(index.hdrmd5(bar), 'bar')
+        index.remove(bar)
+        index.save()
+        self.assertEqual(len(CacheIndex(self.cachedir).entries), 1)
+
+    def test_link(self):
+        """a package with the same hdrmd5 is hardlinked from a different project"""
+        index = CacheIndex(self.cachedir)
+        index.add(self.fname, 'abc')
+        index.save()
+        index = CacheIndex(self.cachedir)
+        otherdir = os.path.join(self.cachedir, 'other', 'repo', 'x86_64')
+        os.makedirs(otherdir)
+        other = os.path.join(otherdir, 'foo.tar')
+        self.assertFalse(index.link('def', other))
+        self.assertTrue(index.link('abc', other))
+        self.assertEqual(os.stat(other).st_ino, os.stat(self.fname).st_ino)
+        self.assertEqual(index.hdrmd5(other), 'abc')
+        # a changed package is not linked
+        os.unlink(other)
+        self._write(self.fname, 'foobar')
+        self.assertFalse(index.link('abc', other))
+
+    def test_verified(self):
+        """a verified package is only verified again if the keys or the package change"""
+        key1 = os.path.join(self.cachedir, '_pubkey1')
+        key2 = os.path.join(self.cachedir, '_pubkey2')
+        self._write(key1, 'key1')
+        self._write(key2, 'key2')
+        verified = cache.VerifiedCache(self.cachedir, [key1, key2])
+        self.assertFalse(verified.is_verified(self.fname, 'abc'))
+        verified.add(self.fname, 'abc')
+        verified.add(self.fname, None)
+        verified.save()
+        # the order of the keys does not matter
+        self.assertTrue(cache.VerifiedCache(self.cachedir, [key2, key1]).is_verified(self.fname, 'abc'))
+        self.assertFalse(cache.VerifiedCache(self.cachedir, [key1]).is_verified(self.fname, 'abc'))
+        self.assertFalse(cache.VerifiedCache(self.cachedir, [key1, key2]).is_verified(self.fname, None))
+        self.assertFalse(cache.VerifiedCache(self.cachedir, [key1, key2]).is_verified(self.fname, 'def'))
+        # a package with the same hdrmd5 at a different path
+        other = os.path.join(self.pkgdir, 'bar.tar')
+        self._write(other, 'foo')
+        self.assertFalse(cache.VerifiedCache(self.cachedir, [key1, key2]).is_verified(other, 'abc'))
+        # a modified package (with the same hdrmd5) is verified again
+        self._write(self.fname, 'foobar')
+        self.assertFalse(cache.VerifiedCache(self.cachedir, [key1, key2]).is_verified(self.fname, 'abc'))
+        os.unlink(self.fname)
+        self.assertFalse(cache.VerifiedCache(self.cachedir, [key1, key2]).is_verified(self.fname, 'abc'))
+        self._write(self.fname, 'foo')
+        verified = cache.VerifiedCache(self.cachedir, [key1, key2])
+        verified.add(self.fname, 'abc')
+        verified.save()
+        self.assertTrue(cache.VerifiedCache(self.cachedir, [key1, key2]).is_verified(self.fname, 'abc'))
+        self._write(key2, 'newkey')
+        self.assertFalse(cache.VerifiedCache(self.cachedir, [key1, key2]).is_verified(self.fname, 'abc'))
+
+    def test_verified_keysets(self):
+        """the keysets of an unchanged package are merged"""
+        key1 = os.path.join(self.cachedir, '_pubkey1')
+        self._write(key1, 'key1')
+        verified = cache.VerifiedCache(self.cachedir, [])
+        verified.add(self.fname, 'abc')
+        verified.save()
+        verified = cache.VerifiedCache(self.cachedir, [key1])
+        verified.add(self.fname, 'abc')
+        verified.save()
+        self.assertTrue(cache.VerifiedCache(self.cachedir, []).is_verified(self.fname, 'abc'))
+        self.assertTrue(cache.VerifiedCache(self.cachedir, [key1]).is_verified(self.fname, 'abc'))
+
+class TestCachePrune(unittest.TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp(prefix='osc_test_cache')
+        self.pkgdir = os.path.join(self.cachedir, 'prj', 'repo', 'x86_64')
+        os.makedirs(self.pkgdir)
+        self.pkgs = []
+        # foo0.rpm is the least recently used package
+        for i in range(4):
+            fname = os.path.join(self.pkgdir, 'foo%d.rpm' % i)
+            with open(fname, 'w') as f:
+                f.write('x' * 512 * 1024)
+            os.utime(fname, (1000 + i, 1000))
+            self.pkgs.append(fname)
+        with open(os.path.join(self.cachedir, 'prj', '_pubkey'), 'w') as f:
+            f.write('key')
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def _removed(self, removed):
+        return [os.path.basename(i[0]) for i in removed]
+
+    def test_prune_size(self):
+        """the least recently used packages are removed"""
+        removed = cache.prune(self.cachedir, max_size=1)
+        self.assertEqual(self._removed(removed), ['foo0.rpm', 'foo1.rpm'])
+        self.assertEqual(sorted(os.listdir(self.pkgdir)), ['foo2.rpm', 'foo3.rpm'])
+        self.assertTrue(os.path.exists(os.path.join(self.cachedir, 'prj', '_pubkey')))
+
+    def test_prune_touch(self):
+        """a used package is kept"""
+        cache.touch([self.pkgs[0]])
+        removed = cache.prune(self.cachedir, max_size=1)
+        self.assertEqual(self._removed(removed), ['foo1.rpm', 'foo2.rpm'])
+
+    def test_prune_age(self):
+        """all packages are older than one day"""
+        cache.touch(self.pkgs[3:])
+        removed = cache.prune(self.cachedir, max_age=1, dry_run=True)
+        self.assertEqual(self._removed(removed), ['foo0.rpm', 'foo1.rpm', 'foo2.rpm'])
+        self.assertEqual(len(os.listdir(self.pkgdir)), 4)
+
+    def test_prune_hardlinks(self):
+        """a hardlinked package is only counted once"""
+        os.link(self.pkgs[3], os.path.join(self.pkgdir, 'bar.rpm'))
+        removed = cache.prune(self.cachedir, max_size=1)
+        self.assertEqual(self._removed(removed), ['foo0.rpm', 'foo1.rpm'])
+
+    def test_prune_pinned(self):
+        """a package which is pinned by a running process is not removed"""
+        cache.pin(self.cachedir, self.pkgs[:1])
+        try:
+            removed = cache.prune(self.cachedir, max_size=1)
+        finally:
+            cache._unpin(os.path.join(self.cachedir, cache.pins_dir, str(os.getpid())))
+        self.assertEqual(self._removed(removed), ['foo1.rpm', 'foo2.rpm'])
+
+if __name__ == '__main__':
+    unittest.main()
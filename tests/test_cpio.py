@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+from io import BytesIO
+
+from osc.util import cpio
+
+def suite():
+    return unittest.makeSuite(TestCpio)
+
+class TestCpio(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test_cpio')
+        archive = cpio.CpioWrite()
+        archive.add('foo', 'foo content\n')
+        archive.add('bar.rpm', 'x' * 1000)
+        archive.add('empty', '')
+        self.archive = archive.get()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stream_read(self):
+        """read the members of a cpio archive from a file object"""
+        archive = cpio.CpioStreamRead(BytesIO(self.archive), bufsize=64)
+        hdrs = []
+        for hdr in archive:
+            hdrs.append((hdr.filename, hdr.filesize, b''.join(archive.read_data())))
+        self.assertEqual(hdrs, [('foo', 12, b'foo content\n'), ('bar.rpm', 1000, b'x' * 1000),
+                                ('empty', 0, b'')])
+
+    def test_stream_skip(self):
+        """unread members are skipped"""
+        archive = cpio.CpioStreamRead(BytesIO(self.archive), bufsize=64)
+        names = [hdr.filename for hdr in archive]
+        self.assertEqual(names, ['foo', 'bar.rpm', 'empty'])
+
+    def test_stream_copyin(self):
+        """extract a member to a different name"""
+        archive = cpio.CpioStreamRead(BytesIO(self.archive))
+        for hdr in archive:
+            if hdr.filename == 'bar.rpm':
+                archive.copyin_file(hdr, self.tmpdir, 'baz')
+        self.assertEqual(open(os.path.join(self.tmpdir, 'baz'), 'rb').read(), b'x' * 1000)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'foo')))
+
+    def _write_archive(self):
+        fname = os.path.join(self.tmpdir, 'archive.cpio')
+        with open(fname, 'wb') as f:
+            f.write(self.archive)
+        return fname
+
+    def test_read(self):
+        """the members of an archive are indexed by their name"""
+        archive = cpio.CpioRead(self._write_archive(), bufsize=64)
+        archive.read()
+        self.assertEqual([(h.filename, h.filesize) for h in archive],
+                         [('foo', 12), ('bar.rpm', 1000), ('empty', 0)])
+        self.assertEqual(archive._get_hdr('bar.rpm').filesize, 1000)
+        self.assertEqual(archive._get_hdr('missing'), None)
+        self.assertFalse(hasattr(archive._get_hdr('foo'), '__dict__'))
+
+    def test_copyin(self):
+        archive = cpio.CpioRead(self._write_archive(), bufsize=64)
+        archive.read()
+        archive.copyin_file('bar.rpm', self.tmpdir, 'baz')
+        self.assertEqual(open(os.path.join(self.tmpdir, 'baz'), 'rb').read(), b'x' * 1000)
+        self.assertRaises(cpio.CpioError, archive.copyin_file, 'missing', self.tmpdir)
+        dest = os.path.join(self.tmpdir, 'dest')
+        os.mkdir(dest)
+        archive.copyin(dest)
+        self.assertEqual(sorted(os.listdir(dest)), ['bar.rpm', 'empty', 'foo'])
+        self.assertEqual(open(os.path.join(dest, 'foo'), 'rb').read(), b'foo content\n')
+        self.assertEqual(open(os.path.join(dest, 'empty'), 'rb').read(), b'')
+
+    def test_write_fobj(self):
+        """an archive is written to a file object (files are added from disk)"""
+        fname = os.path.join(self.tmpdir, 'bar.rpm')
+        with open(fname, 'wb') as f:
+            f.write(b'x' * 1000)
+        out = BytesIO()
+        archive = cpio.CpioWrite(out, bufsize=64)
+        archive.add('foo', 'foo content\n')
+        archive.add_file('bar.rpm', fname, 0o644)
+        archive.add('empty', '')
+        archive.finish()
+        self.assertEqual(out.getvalue(), self.archive)
+        self.assertEqual(len(self.archive) % 512, 0)
+
+    def test_stream_truncated(self):
+        """a truncated archive raises a CpioError"""
+        archive = cpio.CpioStreamRead(BytesIO(self.archive[:150]))
+        self.assertRaises(cpio.CpioError, list, archive)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+from osc.util import ar, debquery
+
+def suite():
+    s = unittest.makeSuite(TestAr)
+    s.addTests(unittest.makeSuite(TestDebQuery))
+    return s
+
+CONTROL = b"""Package: foo
+Version: 1:1.0-2
+Architecture: amd64
+Depends: libc6 (>= 2.14), bar
+Provides: baz
+Description: foo package
+ a longer description
+"""
+
+def tar_data(files, mode='w:gz'):
+    f = io.BytesIO()
+    tar = tarfile.open(fileobj=f, mode=mode)
+    for name, data in files:
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = len(data)
+        tar.addfile(tarinfo, io.BytesIO(data))
+    tar.close()
+    return f.getvalue()
+
+def ar_data(members):
+    data = b'!<arch>\n'
+    for name, content in members:
+        data += ('%-16s%-12s%-6s%-6s%-8s%-10s' % (name + '/', '0', '0', '0', '100644', len(content))).encode('ascii')
+        data += b'`\n' + content
+        if len(content) & 1:
+            data += b'\n'
+    return data
+
+class TestAr(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test_ar')
+        self.fname = os.path.join(self.tmpdir, 'test.a')
+        with open(self.fname, 'wb') as f:
+            f.write(ar_data([('foo', b'foo data'), ('bar', b'odd'), ('baz', b'baz')]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_members(self):
+        arfile = ar.Ar(fn=self.fname)
+        arfile.read()
+        self.assertEqual([(i.name, i.size) for i in arfile], [('foo', 8), ('bar', 3), ('baz', 3)])
+        self.assertEqual(arfile.get_file('baz').read(), b'baz')
+        self.assertEqual(arfile.get_file('missing'), None)
+
+    def test_file_view(self):
+        """a file can only access its own data section"""
+        with open(self.fname, 'rb') as f:
+            arfile = ar.Ar(fh=f)
+            arfile.read()
+            foo = arfile.get_file('foo')
+            self.assertEqual(foo.read(3), b'foo')
+            self.assertEqual(foo.tell(), 3)
+            self.assertEqual(foo.read(), b' data')
+            self.assertEqual(foo.read(), b'')
+            foo.seek(-4, os.SEEK_END)
+            self.assertEqual(foo.read(100), b'data')
+            foo.seek(1)
+            self.assertEqual(foo.getvalue(), b'foo data')
+            self.assertEqual(foo.read(2), b'oo')
+
+class TestDebQuery(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test_debquery')
+        self.fname = os.path.join(self.tmpdir, 'foo_1.0-2_amd64.deb')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_deb(self, control_name, mode):
+        control = tar_data([('./control', CONTROL), ('./md5sums', b'')], mode)
+        data = tar_data([('./usr/bin/foo', b'x' * 4096)])
+        with open(self.fname, 'wb') as f:
+            f.write(ar_data([('debian-binary', b'2.0\n'), (control_name, control),
+                             ('data.tar.gz', data)]))
+
+    def _check(self):
+        with open(self.fname, 'rb') as f:
+            debq = debquery.DebQuery(f)
+            debq.read()
+        self.assertEqual(debq.name(), 'foo')
+        self.assertEqual(debq.epoch(), '1')
+        self.assertEqual(debq.version(), '1.0')
+        self.assertEqual(debq.release(), '2')
+        self.assertEqual(debq.arch(), 'amd64')
+        self.assertEqual(debq.requires(), ['libc6 (>= 2.14)', 'bar'])
+        self.assertEqual(debq.provides(), ['baz', 'foo (= 1:1.0-2)'])
+
+    def test_control_tar_gz(self):
+        self._write_deb('control.tar.gz', 'w:gz')
+        self._check()
+
+    def test_control_tar(self):
+        self._write_deb('control.tar', 'w')
+        self._check()
+
+    def test_no_deb(self):
+        with open(self.fname, 'wb') as f:
+            f.write(ar_data([('debian-binary', b'1.0\n')]))
+        with open(self.fname, 'rb') as f:
+            self.assertRaises(debquery.DebError, debquery.DebQuery(f).read)
+
+if __name__ == '__main__':
+    unittest.main()
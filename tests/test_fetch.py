@@ -0,0 +1,170 @@
+import os
+import threading
+import unittest
+
+import osc.core
+from common import OscTestCase
+from test_packagequery import write_rpm
+
+try:
+    from urllib.error import HTTPError
+    from urllib.request import HTTPHandler, build_opener, install_opener
+    from urllib.response import addinfourl
+    from io import BytesIO, StringIO
+except ImportError:
+    #python 2.x
+    from urllib2 import HTTPError, HTTPHandler, build_opener, install_opener, addinfourl
+    from cStringIO import StringIO
+    from io import BytesIO
+
+try:
+    from osc import fetch
+except ImportError:
+    # urlgrabber is not installed
+    fetch = None
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fetch_fixtures')
+
+def suite():
+    s = unittest.makeSuite(TestRunJobs)
+    s.addTests(unittest.makeSuite(TestStreamFile))
+    s.addTests(unittest.makeSuite(TestFetchAll))
+    return s
+
+class FakeHandler(HTTPHandler):
+    """serves the data of the urls dict (all other urls return 404)"""
+    def __init__(self, urls):
+        HTTPHandler.__init__(self)
+        self.urls = urls
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def http_open(self, req):
+        url = req.get_full_url()
+        with self.lock:
+            self.requested.append(url)
+        if not url in self.urls:
+            raise HTTPError(url, 404, 'Not Found', {}, None)
+        resp = addinfourl(BytesIO(self.urls[url]), {}, url)
+        resp.code = 200
+        resp.msg = 'OK'
+        return resp
+
+class FakePac:
+    def __init__(self, name, localdir, urllist):
+        self.name = self.binary = self.repofilename = name
+        self.filename = name + '.rpm'
+        self.project = 'prj'
+        self.repository = 'repo'
+        self.repoarch = 'x86_64'
+        self.repopackage = '_repository'
+        self.hdrmd5 = None
+        self.localdir = localdir
+        self.urllist = urllist
+
+    def __str__(self):
+        return self.name
+
+@unittest.skipIf(fetch is None, 'urlgrabber is not installed')
+class TestRunJobs(unittest.TestCase):
+    def test_run_jobs(self):
+        done = []
+        fetch.run_jobs(done.append, list(range(20)), 4)
+        self.assertEqual(sorted(done), list(range(20)))
+
+    def test_run_jobs_error(self):
+        """the first error is re-raised and the pending items are not processed"""
+        done = []
+        def func(item):
+            if item == 0:
+                raise ValueError(item)
+            done.append(item)
+        self.assertRaises(ValueError, fetch.run_jobs, func, list(range(50)), 1)
+        self.assertEqual(done, [])
+
+    def test_aggregate_meter(self):
+        """a skipped package is not counted"""
+        fo = StringIO()
+        meter = fetch.AggregateMeter(2, fo)
+        file_meter = meter.file_meter()
+        file_meter.start()
+        file_meter.update(100)
+        meter.finish(file_meter)
+        meter.skip()
+        self.assertEqual((meter.done, meter.total), (1, 1))
+        self.assertTrue(fo.getvalue().rstrip().split('\r')[-1].startswith('1/1 packages'))
+
+@unittest.skipIf(fetch is None, 'urlgrabber is not installed')
+class TestStreamFile(unittest.TestCase):
+    def setUp(self):
+        self.streamfile = fetch.streamfile
+        fetch.streamfile = lambda url, **kwargs: iter([b'abc', b'', b'defgh', b'ij'])
+
+    def tearDown(self):
+        fetch.streamfile = self.streamfile
+
+    def test_read(self):
+        """the chunks of the response are consumed from the front"""
+        f = fetch.StreamFile('http://localhost/foo')
+        self.assertEqual(f.read(2), b'ab')
+        self.assertEqual(f.read(0), b'')
+        self.assertEqual(f.read(4), b'cdef')
+        self.assertEqual(f.read(1), b'g')
+        self.assertEqual(f.read(10), b'hij')
+        self.assertEqual(f.read(1), b'')
+
+@unittest.skipIf(fetch is None, 'urlgrabber is not installed')
+class TestFetchAll(OscTestCase):
+    def _get_fixtures_dir(self):
+        return FIXTURES_DIR
+
+    def setUp(self):
+        OscTestCase.setUp(self, copytree=False)
+        self.localdir = os.path.join(self.tmpdir, 'cache', 'prj', 'repo', 'x86_64')
+        os.makedirs(self.localdir)
+        self.urls = {}
+        for name in ('foo', 'bar', 'baz'):
+            fname = os.path.join(self.tmpdir, name + '.rpm')
+            write_rpm(fname, name, '1.0', '1.1', [(name, 8, '1.0-1.1')])
+            with open(fname, 'rb') as f:
+                self.urls[name] = f.read()
+        self.handler = FakeHandler({})
+        # the mirrors are no apiurls, so the default opener is used
+        install_opener(build_opener(self.handler))
+        self.fetcher = fetch.Fetcher(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        install_opener(None)
+        OscTestCase.tearDown(self)
+
+    def _pac(self, name):
+        urllist = ['file://%s/%s.rpm' % (self.localdir, name)]
+        urllist += ['http://mirror%d/repo/%s.rpm' % (i, name) for i in (1, 2)]
+        return FakePac(name, self.localdir, urllist)
+
+    def test_fetch_all(self):
+        self.handler.urls.update({'http://mirror1/repo/foo.rpm': self.urls['foo'],
+                                  'http://mirror1/repo/bar.rpm': self.urls['bar']})
+        pacs = [self._pac('foo'), self._pac('bar')]
+        self.fetcher.fetch_all(pacs)
+        for pac in pacs:
+            self.assertEqual(pac.fullfilename, os.path.join(self.localdir, '%s-1.0-1.1.src.rpm' % pac.name))
+            self.assertEqual(open(pac.fullfilename, 'rb').read(), self.urls[pac.name])
+        self.assertEqual(sorted(self.handler.requested),
+                         ['http://mirror1/repo/bar.rpm', 'http://mirror1/repo/foo.rpm'])
+        self.assertEqual(self.fetcher.cpio, {})
+
+    def test_fetch_all_fallback(self):
+        """the next mirror is tried and a missing package is fetched via the api"""
+        self.handler.urls.update({'http://mirror2/repo/foo.rpm': self.urls['foo']})
+        self.fetcher.progress_obj = True
+        pacs = [self._pac('foo'), self._pac('baz')]
+        self.fetcher.fetch_all(pacs)
+        self.assertEqual(open(pacs[0].fullfilename, 'rb').read(), self.urls['foo'])
+        self.assertFalse(hasattr(pacs[1], 'fullfilename'))
+        self.assertEqual(self.fetcher.cpio, {'prj/repo/x86_64/_repository': {'baz': pacs[1]}})
+        # the progress reaches 100% (baz is not downloaded by fetch_all)
+        self.assertTrue(osc.core.sys.stdout.getvalue().rstrip().split('\r')[-1].startswith('1/1 packages'))
+
+if __name__ == '__main__':
+    unittest.main()
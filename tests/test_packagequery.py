@@ -0,0 +1,345 @@
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+from io import BytesIO
+
+import osc.core
+from osc.util import archquery, cpio, packagequery, rpmquery
+from osc.util.packagequery import PackageQueryRecord
+
+# the osc checkout (the tests must not rely on the cwd)
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def suite():
+    s = unittest.makeSuite(TestPackageQueryRecord)
+    s.addTests(unittest.makeSuite(TestRpmQuery))
+    s.addTests(unittest.makeSuite(TestRpmVercmp))
+    s.addTests(unittest.makeSuite(TestQueryMany))
+    return s
+
+def record(version, release='1.1', pkgtype='rpm', arch='x86_64'):
+    data = dict([(field, []) for field in PackageQueryRecord.fields])
+    data.update({'name': 'foo', 'arch': arch, 'epoch': None,
+                 'version': version, 'release': release,
+                 'provides': ['foo = %s-%s' % (version, release)]})
+    return PackageQueryRecord('/tmp/foo-%s-%s.%s.rpm' % (version, release, arch), pkgtype, data)
+
+class TestPackageQueryRecord(unittest.TestCase):
+    def test_data(self):
+        """a record can be restored from its (JSON serialized) data"""
+        rec = record('1.0')
+        data = json.loads(json.dumps(rec.to_data()))
+        rec2 = PackageQueryRecord.from_data(rec.path(), data)
+        for field in PackageQueryRecord.fields:
+            self.assertEqual(getattr(rec2, field)(), getattr(rec, field)())
+        self.assertEqual(rec2.path(), '/tmp/foo-1.0-1.1.x86_64.rpm')
+        self.assertEqual(rec2.evr(), '1.0-1.1')
+        self.assertFalse(hasattr(rec2, '__dict__'))
+
+    def test_vercmp(self):
+        self.assertEqual(record('1.0').vercmp(record('1.0')), 0)
+        self.assertEqual(record('1.0').vercmp(record('1.10')), -1)
+        self.assertEqual(record('1.0', '2').vercmp(record('1.0', '10')), -1)
+        self.assertEqual(record('1.0~rc1').vercmp(record('1.0')), -1)
+
+    def test_vercmp_types(self):
+        """the versions are compared like by the query class of the package type"""
+        self.assertEqual(record('1.0~rc1', pkgtype='arch').vercmp(record('1.0', pkgtype='arch')), 1)
+        def deb(version, release='1', epoch='0'):
+            rec = record(version, release, pkgtype='deb')
+            # a DebQuery always has an epoch
+            rec.to_data()[1]['epoch'] = epoch
+            return rec
+        self.assertEqual(deb('1.0~rc1').vercmp(deb('1.0')), -1)
+        self.assertEqual(deb('1.0', '2').vercmp(deb('1.0', '10')), -1)
+        self.assertEqual(deb('1.0', epoch='1').vercmp(deb('2.0')), 1)
+
+    def test_package_queries(self):
+        """the newest record of the wanted architecture is chosen"""
+        packageQueries = packagequery.PackageQueries('x86_64')
+        for rec in (record('1.0'), record('2.0', arch='i586'), record('1.1'), record('1.0.1')):
+            packageQueries.add(rec)
+        self.assertEqual(packageQueries['foo'].version(), '1.1')
+
+def rpm_header(entries):
+    """returns a rpm header which consists of the (tag, type, values) entries"""
+    index = b''
+    data = b''
+    for tag, type, values in entries:
+        if type == 4:
+            # 4 byte aligned
+            data += b'\0' * (-len(data) % 4)
+            value = struct.pack('!%di' % len(values), *values)
+        elif type == 7:
+            value = values
+        else:
+            value = b''.join([i.encode('utf-8') + b'\0' for i in values])
+        count = len(values)
+        if type == 6:
+            count = 1
+        index += struct.pack('!4i', tag, type, len(data), count)
+        data += value
+    return struct.pack('!I3i', rpmquery.RpmQuery.HEADER_MAGIC, 0, len(entries), len(data)) + index + data
+
+def gzip_compress(data):
+    f = BytesIO()
+    gz = gzip.GzipFile(fileobj=f, mode='wb')
+    gz.write(data)
+    gz.close()
+    return f.getvalue()
+
+def write_rpm(fname, name, version, release, provides, payload=b'', compressor=None):
+    """writes a (source) rpm; payload is the compressed cpio archive"""
+    lead = struct.pack('!I', rpmquery.RpmQuery.LEAD_MAGIC) + b'\0\0\0\1' + b'\0' * 70 + \
+        struct.pack('!h', rpmquery.RpmQuery.HEADERSIG_TYPE) + b'\0' * 16
+    entries = [(100, 8, ['C']), (1000, 6, [name]), (1001, 6, [version]),
+               (1002, 6, [release]), (1004, 9, ['a summary']), (1022, 6, ['x86_64']),
+               (1047, 8, [p[0] for p in provides]), (1112, 4, [p[1] for p in provides]),
+               (1113, 8, [p[2] for p in provides])]
+    if compressor:
+        entries.append((1125, 6, [compressor]))
+    header = rpm_header(entries)
+    sig = rpm_header([(1004, 7, hashlib.md5(header).digest())])
+    sig += b'\0' * (-len(sig) % 8)
+    with open(fname, 'wb') as f:
+        f.write(lead + sig + header + payload)
+    return hashlib.md5(header).hexdigest()
+
+class TestRpmQuery(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test_rpmquery')
+        self.fname = os.path.join(self.tmpdir, 'foo-1.0-1.1.x86_64.rpm')
+        self.hdrmd5 = write_rpm(self.fname, 'foo', '1.0', '1.1',
+                                [('foo', 8, '1.0-1.1'), ('bar', 0, ''), ('baz', 12, '2')])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_query(self):
+        rpmq = rpmquery.RpmQuery.query(self.fname)
+        self.assertEqual(rpmq.name(), 'foo')
+        self.assertEqual(rpmq.version(), '1.0')
+        self.assertEqual(rpmq.release(), '1.1')
+        self.assertEqual(rpmq.epoch(), 0)
+        self.assertEqual(rpmq.arch(), 'x86_64')
+        self.assertEqual(rpmq.summary(), 'a summary')
+        self.assertEqual(rpmq.provides(), ['foo = 1.0-1.1', 'bar', 'baz >= 2'])
+        self.assertEqual(rpmq.requires(), [])
+        self.assertEqual(rpmq.url(), None)
+        self.assertTrue(rpmq.is_src())
+        self.assertEqual(rpmq.canonname(), 'foo-1.0-1.1.src.rpm')
+
+    def test_queryhdrmd5(self):
+        self.assertEqual(rpmquery.RpmQuery.queryhdrmd5(self.fname), self.hdrmd5)
+        self.assertEqual(packagequery.PackageQuery.queryhdrmd5(self.fname), self.hdrmd5)
+
+    def _write_srcrpm(self, compressor, compress):
+        archive = cpio.CpioWrite()
+        archive.add('foo.spec', 'Name: foo\n')
+        archive.add('foo-1.0.tar.gz', 'x' * 1000)
+        archive.add('foo.changes', 'changes\n')
+        self.fname = os.path.join(self.tmpdir, 'foo-1.0-1.1.src.rpm')
+        write_rpm(self.fname, 'foo', '1.0', '1.1', [('foo', 8, '1.0-1.1')],
+                  compress(archive.get()), compressor)
+        os.mkdir(os.path.join(self.tmpdir, 'unpacked'))
+        return os.path.join(self.tmpdir, 'unpacked')
+
+    def test_unpack_srcrpm(self):
+        """the payload is unpacked in-process"""
+        dest = self._write_srcrpm('gzip', gzip_compress)
+        osc.core.unpack_srcrpm(self.fname, dest)
+        self.assertEqual(sorted(os.listdir(dest)), ['foo-1.0.tar.gz', 'foo.changes', 'foo.spec'])
+        self.assertEqual(open(os.path.join(dest, 'foo-1.0.tar.gz'), 'rb').read(), b'x' * 1000)
+
+    @unittest.skipIf(rpmquery.lzma is None, 'no lzma module')
+    def test_unpack_srcrpm_files(self):
+        """only the passed files are unpacked"""
+        dest = self._write_srcrpm('xz', rpmquery.lzma.compress)
+        osc.core.unpack_srcrpm(self.fname, dest, '*.spec', 'foo.changes')
+        self.assertEqual(sorted(os.listdir(dest)), ['foo.changes', 'foo.spec'])
+        self.assertEqual(open(os.path.join(dest, 'foo.spec'), 'rb').read(), b'Name: foo\n')
+
+    def test_unpack_srcrpm_existing(self):
+        """like cpio -i, an existing (newer) file is only replaced if overwrite is passed"""
+        dest = self._write_srcrpm('gzip', gzip_compress)
+        spec = os.path.join(dest, 'foo.spec')
+        with open(spec, 'w') as f:
+            f.write('Name: bar\n')
+        osc.core.unpack_srcrpm(self.fname, dest)
+        self.assertEqual(open(spec, 'rb').read(), b'Name: bar\n')
+        self.assertEqual(open(os.path.join(dest, 'foo.changes'), 'rb').read(), b'changes\n')
+        # an existing symlink is replaced (and not written through)
+        os.unlink(spec)
+        other = os.path.join(self.tmpdir, 'other')
+        with open(other, 'w') as f:
+            f.write('other\n')
+        os.symlink(other, spec)
+        osc.core.unpack_srcrpm(self.fname, dest, overwrite=True)
+        self.assertFalse(os.path.islink(spec))
+        self.assertEqual(open(spec, 'rb').read(), b'Name: foo\n')
+        self.assertEqual(open(other, 'rb').read(), b'other\n')
+
+    def test_invalid(self):
+        with open(self.fname, 'wb') as f:
+            f.write(b'\xed\xab\xee\xdb')
+        self.assertRaises(rpmquery.RpmError, rpmquery.RpmQuery.query, self.fname)
+
+class TestQueryMany(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='osc_test_querymany')
+        self.pkgs = []
+        for i in range(4):
+            fname = os.path.join(self.tmpdir, 'foo%d-1.0-1.1.x86_64.rpm' % i)
+            write_rpm(fname, 'foo%d' % i, '1.0', '1.1', [('foo%d' % i, 8, '1.0-1.1')])
+            self.pkgs.append(fname)
+        self.cache = os.path.join(self.tmpdir, '.cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_query_many(self):
+        records = packagequery.query_many(self.pkgs, jobs=2)
+        self.assertEqual([r.name() for r in records], ['foo0', 'foo1', 'foo2', 'foo3'])
+        self.assertEqual(records[1].provides(), ['foo1 = 1.0-1.1'])
+        self.assertEqual(records[1].path(), self.pkgs[1])
+
+    def test_cache(self):
+        """only new or changed packages are read"""
+        packagequery.query_many(self.pkgs, jobs=1, cache=self.cache)
+        queried = []
+        orig_query_data = packagequery._query_data
+        def query_data(path):
+            queried.append(path)
+            return orig_query_data(path)
+        packagequery._query_data = query_data
+        try:
+            write_rpm(self.pkgs[2], 'bar', '2.0', '1', [('bar', 8, '2.0-1')])
+            records = packagequery.query_many(self.pkgs, jobs=1, cache=self.cache, prune=True)
+        finally:
+            packagequery._query_data = orig_query_data
+        self.assertEqual(queried, [self.pkgs[2]])
+        self.assertEqual([r.name() for r in records], ['foo0', 'foo1', 'bar', 'foo3'])
+        self.assertEqual(packagequery.QueryCache(self.cache).db.execute('SELECT COUNT(*) FROM pkgs').fetchone()[0], 4)
+
+    def test_no_package(self):
+        fname = os.path.join(self.tmpdir, 'foo.rpm')
+        with open(fname, 'w') as f:
+            f.write('<?xml version="1.0"?>')
+        self.assertEqual(packagequery.query_many([fname, self.pkgs[0]])[0], None)
+        with open(fname, 'w') as f:
+            f.write('foobar')
+        self.assertRaises(packagequery.PackageError, packagequery.query_many, [fname, self.pkgs[0]])
+
+    def test_json(self):
+        out = subprocess.Popen([sys.executable, '-m', 'osc.util.packagequery', '--json', self.tmpdir],
+                               stdout=subprocess.PIPE, cwd=TOPDIR).communicate()[0]
+        res = json.loads(out.decode('utf-8'))
+        self.assertEqual([(i['name'], i['version'], i['type']) for i in res],
+                         [('foo%d' % i, '1.0', 'rpm') for i in range(4)])
+
+def legacy_rpmvercmp(ver1, ver2, tilde=True):
+    """the former (regex based) RpmQuery.rpmvercmp/ArchQuery.rpmvercmp"""
+    cmp = packagequery.cmp
+    if ver1 == ver2:
+        return 0
+    res = 0
+    while res == 0:
+        if tilde:
+            ver1 = re.sub('^[^a-zA-Z0-9~]*', '', ver1)
+            ver2 = re.sub('^[^a-zA-Z0-9~]*', '', ver2)
+            if ver1.startswith('~') or ver2.startswith('~'):
+                if not ver1.startswith('~'):
+                    return 1
+                elif not ver2.startswith('~'):
+                    return -1
+                ver1 = ver1[1:]
+                ver2 = ver2[1:]
+                continue
+        else:
+            ver1 = re.sub('^[^a-zA-Z0-9]*', '', ver1)
+            ver2 = re.sub('^[^a-zA-Z0-9]*', '', ver2)
+        if not (len(ver1) and len(ver2)):
+            break
+        mo1 = re.match(r'(\d+)', ver1)
+        mo2 = re.match(r'(\d+)', ver2)
+        numeric = True
+        if mo1 is None:
+            mo1 = re.match('([a-zA-Z]+)', ver1)
+            mo2 = re.match('([a-zA-Z]+)', ver2)
+            numeric = False
+        if mo2 is None:
+            if numeric:
+                return 1
+            return -1
+        seg1 = mo1.group(0)
+        ver1 = ver1[mo1.end(0):]
+        seg2 = mo2.group(1)
+        ver2 = ver2[mo2.end(1):]
+        if numeric:
+            seg1 = re.sub('^0+', '', seg1)
+            seg2 = re.sub('^0+', '', seg2)
+            res = len(seg1) - len(seg2) or cmp(seg1, seg2)
+        else:
+            res = cmp(seg1, seg2)
+    if res > 0:
+        return 1
+    elif res < 0:
+        return -1
+    return cmp(ver1, ver2)
+
+class TestRpmVercmp(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(42)
+        chars = '0001239aAbz.~_+-'
+        self.versions = [''.join([rnd.choice(chars) for i in range(rnd.randint(0, 8))])
+                         for i in range(400)]
+        self.versions += ['1.0', '1.0~rc1', '1.0a', '1.0.0', '01.0', '1.00', '2', '10', 'a', '~', '~~', '']
+
+    def test_examples(self):
+        self.assertEqual(rpmquery.rpmvercmp('1.0', '1.0'), 0)
+        self.assertEqual(rpmquery.rpmvercmp('1.0', '1_0'), 0)
+        self.assertEqual(rpmquery.rpmvercmp('1.0', '1.00'), 0)
+        self.assertEqual(rpmquery.rpmvercmp('1.0', '1.10'), -1)
+        self.assertEqual(rpmquery.rpmvercmp('1.0~rc1', '1.0'), -1)
+        self.assertEqual(rpmquery.rpmvercmp('1.0a', '1.0'), 1)
+        self.assertEqual(rpmquery.rpmvercmp('1.0a', '1.0.1'), -1)
+        self.assertEqual(archquery.ArchQuery.rpmvercmp('1.0~rc1', '1.0'), 1)
+
+    def test_rpmvercmp(self):
+        """rpmvercmp behaves like the former implementation"""
+        for tilde in (True, False):
+            for ver1 in self.versions[:100]:
+                for ver2 in self.versions:
+                    self.assertEqual(rpmquery.rpmvercmp(ver1, ver2, tilde),
+                                     legacy_rpmvercmp(ver1, ver2, tilde),
+                                     '%r %r %s' % (ver1, ver2, tilde))
+
+    def test_version_key(self):
+        """version_key sorts like the former implementation"""
+        for tilde in (True, False):
+            keys = [rpmquery.version_key(ver, tilde) for ver in self.versions]
+            for ver1, key1 in zip(self.versions[:100], keys):
+                for ver2, key2 in zip(self.versions, keys):
+                    self.assertEqual(packagequery.cmp(key1, key2),
+                                     legacy_rpmvercmp(ver1, ver2, tilde),
+                                     '%r %r %s' % (ver1, ver2, tilde))
+            vers = sorted(self.versions, key=lambda v: rpmquery.version_key(v, tilde))
+            for ver1, ver2 in zip(vers, vers[1:]):
+                self.assertTrue(legacy_rpmvercmp(ver1, ver2, tilde) <= 0)
+
+    def test_evr_key(self):
+        rpms = [record('1.0', '2'), record('1.0', '10'), record('1.0~rc1', '3'), record('0.9', '1')]
+        rpms.sort(key=lambda r: rpmquery.evr_key(r.epoch(), r.version(), r.release()))
+        self.assertEqual([r.evr() for r in rpms], ['0.9-1', '1.0~rc1-3', '1.0-2', '1.0-10'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from osc.util import packagequery, repodata
+
+def suite():
+    return unittest.makeSuite(TestRepoData)
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+  <data type="primary">
+    <location href="repodata/primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+PACKAGE = """  <package type="rpm">
+    <name>%(name)s</name>
+    <arch>%(arch)s</arch>
+    <version epoch="0" ver="%(ver)s" rel="1.1"/>
+    <description>%(name)s package</description>
+    <location href="%(arch)s/%(name)s-%(ver)s-1.1.%(arch)s.rpm"/>
+    <format>
+      <rpm:provides>
+        <rpm:entry name="%(name)s" flags="EQ" epoch="0" ver="%(ver)s" rel="1.1"/>
+        <rpm:entry name="lib%(name)s.so()(64bit)"/>
+      </rpm:provides>
+      <rpm:requires>
+        <rpm:entry name="bar" flags="GE" epoch="0" ver="1.0"/>
+      </rpm:requires>
+    </format>
+  </package>
+"""
+
+class TestRepoData(unittest.TestCase):
+    def setUp(self):
+        self.repodir = tempfile.mkdtemp(prefix='osc_test_repodata')
+        os.mkdir(os.path.join(self.repodir, 'repodata'))
+        with open(os.path.join(self.repodir, 'repodata', 'repomd.xml'), 'w') as f:
+            f.write(REPOMD)
+        pkgs = [('foo', 'x86_64', '1.0'), ('foo', 'i586', '1.0'),
+                ('foo', 'x86_64', '2.0'), ('foo-doc', 'noarch', '2.0')]
+        primary = '<?xml version="1.0" encoding="UTF-8"?>\n' \
+            '<metadata xmlns="http://linux.duke.edu/metadata/common" ' \
+            'xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="%d">\n' % len(pkgs)
+        for name, arch, ver in pkgs:
+            primary += PACKAGE % {'name': name, 'arch': arch, 'ver': ver}
+        primary += '</metadata>\n'
+        f = gzip.GzipFile(os.path.join(self.repodir, 'repodata', 'primary.xml.gz'), 'wb')
+        f.write(primary.encode('utf-8'))
+        f.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.repodir)
+
+    def test_queries(self):
+        pkgqs = repodata.queries(self.repodir)
+        self.assertEqual([(i.name(), i.arch(), i.version()) for i in pkgqs],
+                         [('foo', 'x86_64', '1.0'), ('foo', 'i586', '1.0'),
+                          ('foo', 'x86_64', '2.0'), ('foo-doc', 'noarch', '2.0')])
+        pkgq = pkgqs[0]
+        self.assertEqual(pkgq.epoch(), '0')
+        self.assertEqual(pkgq.release(), '1.1')
+        self.assertEqual(pkgq.description(), 'foo package')
+        self.assertEqual(pkgq.path(), os.path.join(self.repodir, 'x86_64', 'foo-1.0-1.1.x86_64.rpm'))
+        self.assertEqual(pkgq.provides(), ['foo = 1.0-1.1', 'libfoo.so()(64bit)'])
+        self.assertEqual(pkgq.requires(), ['bar >= 1.0'])
+        self.assertEqual(pkgq.conflicts(), [])
+        self.assertEqual(pkgq.canonname(), 'foo-1.0-1.1.x86_64.rpm')
+        self.assertFalse(hasattr(pkgq, '__dict__'))
+
+    def test_wanted_architecture(self):
+        """packages of other architectures are skipped while parsing"""
+        pkgqs = list(repodata.iterqueries(self.repodir, 'x86_64'))
+        self.assertEqual([(i.name(), i.arch(), i.version()) for i in pkgqs],
+                         [('foo', 'x86_64', '1.0'), ('foo', 'x86_64', '2.0'),
+                          ('foo-doc', 'noarch', '2.0')])
+        packageQueries = packagequery.PackageQueries('x86_64')
+        for pkgq in pkgqs:
+            packageQueries.add(pkgq)
+        self.assertEqual(packageQueries['foo'].version(), '2.0')
+
+if __name__ == '__main__':
+    unittest.main()
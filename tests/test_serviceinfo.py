@@ -0,0 +1,82 @@
+import sys
+import time
+import unittest
+
+import osc.conf
+import osc.core
+from osc.core import Serviceinfo
+
+def suite():
+    return unittest.makeSuite(TestServiceinfo)
+
+def service(name, mode='', *args):
+    return {'name': name, 'mode': mode, 'command': [name] + list(args)}
+
+class TestServiceinfo(unittest.TestCase):
+    def setUp(self):
+        self.config = osc.conf.config.copy()
+        osc.conf.config.update({'verbose': 0, 'debug': False})
+        self.serviceinfo = Serviceinfo()
+
+    def tearDown(self):
+        osc.conf.config.clear()
+        osc.conf.config.update(self.config)
+
+    def _names(self, batches):
+        return [[s['name'] for s in batch] for batch in batches]
+
+    def test_schedule(self):
+        """consecutive independent services are grouped into one batch"""
+        services = [service('download_url'), service('obs_scm'), service('recompress'),
+                    service('tar_scm'), service('download_files'), service('set_version')]
+        self.assertEqual(self._names(self.serviceinfo._schedule(services)),
+                         [['download_url', 'obs_scm'], ['recompress'],
+                          ['tar_scm', 'download_files'], ['set_version']])
+
+    def test_schedule_extract(self):
+        """a service which extracts files closes its batch"""
+        services = [service('obs_scm', '', '--extract', 'foo.spec'), service('tar_scm'),
+                    service('download_url')]
+        self.assertEqual(self._names(self.serviceinfo._schedule(services)),
+                         [['obs_scm'], ['tar_scm', 'download_url']])
+        self.assertEqual(self.serviceinfo._schedule([]), [])
+
+    def test_skip_service(self):
+        skip = self.serviceinfo._skip_service
+        for mode in ('', 'buildtime', 'serveronly', 'disabled', 'trylocal', 'localonly'):
+            self.assertFalse(skip(service('foo', mode), 'all', None))
+        self.assertFalse(skip(service('foo'), None, None))
+        self.assertTrue(skip(service('foo'), None, 'bar'))
+        self.assertFalse(skip(service('foo'), None, 'foo'))
+        self.assertTrue(skip(service('foo', 'buildtime'), None, None))
+        self.assertTrue(skip(service('foo', 'serveronly'), None, None))
+        self.assertTrue(skip(service('foo', 'disabled'), None, None))
+        self.assertFalse(skip(service('foo', 'disabled'), 'disabled', None))
+        self.assertTrue(skip(service('foo'), 'disabled', None))
+        self.assertTrue(skip(service('foo'), 'trylocal', None))
+        self.assertFalse(skip(service('foo', 'trylocal'), 'trylocal', None))
+        self.assertFalse(skip(service('foo', 'localonly'), 'trylocal', None))
+
+    def test_run_commands(self):
+        """a free slot is refilled while a slow command is still running"""
+        slow = [sys.executable, '-c', 'import time; time.sleep(1)']
+        fast = [sys.executable, '-c', 'pass']
+        start = time.time()
+        results = self.serviceinfo._run_commands([slow, fast, fast, fast, fast], 2)
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual(results, [(slow, 0), (fast, 0), (fast, 0), (fast, 0), (fast, 0)])
+
+    def test_run_commands_failure(self):
+        """no further commands are started after a failure"""
+        fail = [sys.executable, '-c', 'import sys; sys.exit(3)']
+        fast = [sys.executable, '-c', 'pass']
+        results = self.serviceinfo._run_commands([fail, fast], 1)
+        self.assertEqual(results, [(fail, 3)])
+
+    def test_run_commands_missing(self):
+        """a missing program raises an ExtRuntimeError"""
+        self.assertRaises(osc.oscerr.ExtRuntimeError, self.serviceinfo._run_commands,
+                          [['/nonexistent/osc-service']], 1)
+
+if __name__ == '__main__':
+    unittest.main()
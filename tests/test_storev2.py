@@ -0,0 +1,63 @@
+import osc.core
+import osc.oscerr
+import os
+from common import OscTestCase
+
+FIXTURES_DIR = os.path.join(os.getcwd(), 'project_package_status_fixtures')
+
+def suite():
+    import unittest
+    return unittest.makeSuite(TestStoreV2)
+
+class TestStoreV2(OscTestCase):
+    def _get_fixtures_dir(self):
+        return FIXTURES_DIR
+
+    def test_nomigration(self):
+        """the store is not migrated if store_v2 is disabled"""
+        self._change_to_pkg('simple')
+        osc.core.Package('.')
+        self.assertFalse(os.path.exists(os.path.join('.osc', '_store')))
+        self.assertEqual(open(os.path.join('.osc', '_osclib_version')).read(), '1.0\n')
+
+    def test_migration(self):
+        """migrate a wc to the store v2 format"""
+        osc.core.conf.config['store_v2'] = True
+        self._change_to_pkg('simple')
+        p = osc.core.Package('.')
+        self.assertTrue(os.path.isfile(os.path.join('.osc', '_store')))
+        self.assertEqual(open(os.path.join('.osc', '_osclib_version')).read(), '2.0\n')
+        for fname in ('_files', '_to_be_added', '_to_be_deleted'):
+            self.assertFalse(os.path.exists(os.path.join('.osc', fname)))
+        exp_st = [('A', 'add'), ('?', 'exists'), ('D', 'foo'), ('!', 'merge'), ('R', 'missing'),
+            ('!', 'missing_added'), ('M', 'nochange'), ('S', 'skipped'), (' ', 'test')]
+        self.assertEqual(p.get_status(), exp_st)
+
+    def test_migration_conflict(self):
+        """migrate a wc with a conflict"""
+        osc.core.conf.config['store_v2'] = True
+        self._change_to_pkg('conflict')
+        p = osc.core.Package('.')
+        self.assertFalse(os.path.exists(os.path.join('.osc', '_in_conflict')))
+        self.assertEqual(p.in_conflict, ['conflict'])
+        self._check_status(p, 'conflict', 'C')
+
+    def test_write(self):
+        """modify the state of a store v2 wc"""
+        osc.core.conf.config['store_v2'] = True
+        self._change_to_pkg('simple')
+        p = osc.core.Package('.')
+        p.addfile('exists')
+        p.delete_file('test')
+        self.assertFalse(os.path.exists(os.path.join('.osc', '_to_be_added')))
+        # the storev2 format is kept if store_v2 is disabled again
+        osc.core.conf.config['store_v2'] = False
+        p = osc.core.Package('.')
+        self.assertEqual(p.to_be_added, ['add', 'missing', 'missing_added', 'exists'])
+        self.assertEqual(p.to_be_deleted, ['foo', 'test'])
+        self._check_status(p, 'exists', 'A')
+        self._check_status(p, 'test', 'D')
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -32,6 +32,40 @@ class TestUpdate(OscTestCase):
         self.assertEqual(sys.stdout.getvalue(), exp)
         self._check_digests('testUpdateNewFile_files')
 
+    @GET('http://localhost/source/osctest/simple?rev=2', file='testUpdateNewFile_files')
+    @GET('http://localhost/source/osctest/simple/_meta', file='meta.xml')
+    @GET('http://localhost/source/osctest/simple/upstream_added?rev=2', file='testUpdateNewFile_upstream_added')
+    def testUpdateLazyNewFile(self):
+        """a new file was added to the remote package (lazy wc: a placeholder is created)"""
+        self._change_to_pkg('simple')
+        osc.core.store_write_string('.', '_lazy_size', '0\n')
+        p = osc.core.Package('.')
+        p.update(rev=2)
+        exp = 'A    upstream_added\nAt revision 2.\n'
+        self.assertEqual(sys.stdout.getvalue(), exp)
+        self._check_digests('testUpdateNewFile_files', 'upstream_added')
+        self.assertEqual(os.path.getsize('upstream_added'), 0)
+        self.assertFalse(os.path.exists(os.path.join('.osc', 'upstream_added')))
+        p = osc.core.Package('.')
+        self.assertEqual(p.lazy, ['upstream_added'])
+        self._check_status(p, 'upstream_added', ' ')
+        p.materialize()
+        self.assertEqual(p.lazy, [])
+        self.assertFalse(os.path.exists(os.path.join('.osc', '_lazy')))
+        self._check_digests('testUpdateNewFile_files')
+        self.assertEqual(open('upstream_added', 'r').read(), open(os.path.join('.osc', 'upstream_added'), 'r').read())
+        self._check_status(osc.core.Package('.'), 'upstream_added', ' ')
+
+    def testParseLazySize(self):
+        """the --lazy-size value may have a size suffix"""
+        self.assertEqual(osc.core.parse_size('0'), 0)
+        self.assertEqual(osc.core.parse_size('512'), 512)
+        self.assertEqual(osc.core.parse_size('10k'), 10 * 1024)
+        self.assertEqual(osc.core.parse_size('10M'), 10 * 1024 ** 2)
+        self.assertEqual(osc.core.parse_size('1G'), 1024 ** 3)
+        for size in ('', 'big', '-1', '1.5M', '10T'):
+            self.assertRaises(ValueError, osc.core.parse_size, size)
+
     @GET('http://localhost/source/osctest/simple?rev=2', file='testUpdateNewFileLocalExists_files')
     def testUpdateNewFileLocalExists(self):
         """
@@ -185,6 +219,30 @@ class TestUpdate(OscTestCase):
 
         self._check_digests('testUpdateLimitSizeAddDelete_files', 'bigfile', 'foo', 'merge', 'nochange')
 
+    @GET('http://localhost/source/osctest/limitsize?rev=latest', file='testUpdateLimitSizeAddDelete_filesremote')
+    @GET('http://localhost/source/osctest/limitsize/exists?rev=2', file='testUpdateLimitSizeAddDelete_exists')
+    @GET('http://localhost/source/osctest/limitsize/_meta', file='meta.xml')
+    def testUpdateSparseAddDelete(self):
+        """
+        like testUpdateLimitSizeAddDelete but files are skipped because of
+        the sparse include/exclude rules (which are kept in the store)
+        """
+        self._change_to_pkg('limitsize')
+        osc.core.Package('.').update(sparse_include=['exists', 'f*', 'merge'], sparse_exclude=['merge'])
+        exp = 'A    exists\nD    bigfile\nD    merge\nD    nochange\nAt revision 2.\n'
+        self.assertEqual(sys.stdout.getvalue(), exp)
+        self.assertFalse(os.path.exists(os.path.join('.osc', 'bigfile')))
+        self.assertFalse(os.path.exists('bigfile'))
+        self.assertFalse(os.path.exists(os.path.join('.osc', 'merge')))
+        self.assertFalse(os.path.exists('merge'))
+        self.assertTrue(os.path.exists('foo'))
+        self._check_digests('testUpdateSparseAddDelete_files', 'bigfile', 'merge', 'nochange')
+        p = osc.core.Package('.')
+        self.assertEqual(p.sparse_include, ['exists', 'f*', 'merge'])
+        self.assertEqual(p.sparse_exclude, ['merge'])
+        self._check_status(p, 'bigfile', 'S')
+        self._check_status(p, 'merge', 'S')
+
     @GET('http://localhost/source/osctest/services?rev=latest', file='testUpdateServiceFilesAddDelete_filesremote')
     @GET('http://localhost/source/osctest/services/bigfile?rev=2', file='testUpdateServiceFilesAddDelete_bigfile')
     @GET('http://localhost/source/osctest/services/_service%3Abar?rev=2', file='testUpdateServiceFilesAddDelete__service:bar')